@@ -1,4 +1,5 @@
 import sys
+import multiprocessing
 from PyQt4 import QtGui
 from FlatCAMApp import App
 
@@ -9,7 +10,12 @@ def debug_trace():
   pyqtRemoveInputHook()
   #set_trace()
 
-debug_trace()
-app = QtGui.QApplication(sys.argv)
-fc = App()
-sys.exit(app.exec_())
\ No newline at end of file
+# Worker processes started on Windows, or from a frozen
+# executable, import this module and must not run the application.
+if __name__ == '__main__':
+  multiprocessing.freeze_support()
+
+  debug_trace()
+  app = QtGui.QApplication(sys.argv)
+  fc = App()
+  sys.exit(app.exec_())
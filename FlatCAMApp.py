@@ -8,6 +8,7 @@ import simplejson as json
 import re
 import webbrowser
 import os
+import multiprocessing
 
 from PyQt4 import QtCore
 
@@ -20,6 +21,7 @@ from FlatCAMObj import *
 from PlotCanvas import *
 from FlatCAMGUI import *
 from FlatCAMCommon import LoudDict
+from FlatCAMProject import ProjectFile
 from FlatCAMTool import *
 
 
@@ -87,13 +89,29 @@ class App(QtCore.QObject):
 
         self.project_filename = None
 
+        # The project as last saved or opened. Objects in
+        # the project may load their data from it.
+        self.project_file = ProjectFile()
+
+        # Objects from the project file not plotted yet, as plotting
+        # loads their data. See plot_in_view().
+        self.unplotted = []
+        self.plotcanvas.view_callbacks.append(self.plot_in_view)
+
         self.last_folder = None
 
         self.toggle_units_ignore = False
 
+        # Worker processes for parsing. One per CPU by default.
+        try:
+            processes = multiprocessing.cpu_count()
+        except NotImplementedError:
+            processes = 1
+
         self.defaults_form = GlobalOptionsUI()
         self.defaults_form_fields = {
             "units": self.defaults_form.units_radio,
+            "processes": self.defaults_form.processes_entry,
             "gerber_plot": self.defaults_form.gerber_group.plot_cb,
             "gerber_solid": self.defaults_form.gerber_group.solid_cb,
             "gerber_multicolored": self.defaults_form.gerber_group.multicolored_cb,
@@ -121,8 +139,11 @@ class App(QtCore.QObject):
             "geometry_painttooldia": self.defaults_form.geometry_group.painttooldia_entry,
             "geometry_paintoverlap": self.defaults_form.geometry_group.paintoverlap_entry,
             "geometry_paintmargin": self.defaults_form.geometry_group.paintmargin_entry,
+            "geometry_linkcleared": self.defaults_form.geometry_group.linkcleared_cb,
+            "geometry_arcs": self.defaults_form.geometry_group.arcs_cb,
             "cncjob_plot": self.defaults_form.cncjob_group.plot_cb,
             "cncjob_tooldia": self.defaults_form.cncjob_group.tooldia_entry,
+            "cncjob_sweptarea": self.defaults_form.cncjob_group.sweptarea_cb,
             "cncjob_append": self.defaults_form.cncjob_group.append_text
         }
 
@@ -130,6 +151,7 @@ class App(QtCore.QObject):
         self.defaults.set_change_callback(lambda key: self.defaults_write_form())  # When the dictionary changes.
         self.defaults.update({
             "units": "IN",
+            "processes": processes,
             "gerber_plot": True,
             "gerber_solid": True,
             "gerber_multicolored": False,
@@ -157,8 +179,11 @@ class App(QtCore.QObject):
             "geometry_painttooldia": 0.07,
             "geometry_paintoverlap": 0.15,
             "geometry_paintmargin": 0.0,
+            "geometry_linkcleared": False,
+            "geometry_arcs": False,
             "cncjob_plot": True,
             "cncjob_tooldia": 0.016,
+            "cncjob_sweptarea": False,
             "cncjob_append": ""
         })
         self.load_defaults()
@@ -166,6 +191,7 @@ class App(QtCore.QObject):
         self.options_form = GlobalOptionsUI()
         self.options_form_fields = {
             "units": self.options_form.units_radio,
+            "processes": self.options_form.processes_entry,
             "gerber_plot": self.options_form.gerber_group.plot_cb,
             "gerber_solid": self.options_form.gerber_group.solid_cb,
             "gerber_multicolored": self.options_form.gerber_group.multicolored_cb,
@@ -193,8 +219,11 @@ class App(QtCore.QObject):
             "geometry_painttooldia": self.options_form.geometry_group.painttooldia_entry,
             "geometry_paintoverlap": self.options_form.geometry_group.paintoverlap_entry,
             "geometry_paintmargin": self.options_form.geometry_group.paintmargin_entry,
+            "geometry_linkcleared": self.options_form.geometry_group.linkcleared_cb,
+            "geometry_arcs": self.options_form.geometry_group.arcs_cb,
             "cncjob_plot": self.options_form.cncjob_group.plot_cb,
             "cncjob_tooldia": self.options_form.cncjob_group.tooldia_entry,
+            "cncjob_sweptarea": self.options_form.cncjob_group.sweptarea_cb,
             "cncjob_append": self.options_form.cncjob_group.append_text
         }
 
@@ -202,6 +231,7 @@ class App(QtCore.QObject):
         self.options.set_change_callback(lambda key: self.options_write_form())
         self.options.update({
             "units": "IN",
+            "processes": processes,
             "gerber_plot": True,
             "gerber_solid": True,
             "gerber_multicolored": False,
@@ -229,8 +259,11 @@ class App(QtCore.QObject):
             "geometry_painttooldia": 0.07,
             "geometry_paintoverlap": 0.15,
             "geometry_paintmargin": 0.0,
+            "geometry_linkcleared": False,
+            "geometry_arcs": False,
             "cncjob_plot": True,
             "cncjob_tooldia": 0.016,
+            "cncjob_sweptarea": False,
             "cncjob_append": ""
         })
         self.options.update(self.defaults)  # Copy app defaults to project options
@@ -239,6 +272,16 @@ class App(QtCore.QObject):
 
         self.collection = ObjectCollection()
         self.ui.project_tab_layout.addWidget(self.collection.view)
+
+        # Per-user directory for data kept by the application,
+        # independent of where it is launched from.
+        if os.name == 'nt':
+            self.data_path = os.path.join(os.environ.get('APPDATA', os.path.expanduser('~')), 'FlatCAM')
+        else:
+            self.data_path = os.path.join(os.path.expanduser('~'), '.FlatCAM')
+
+        # Parsed Gerber and Excellon files, by content.
+        self.cache = GeometryCache(os.path.join(self.data_path, "cache"), max_size=512*1024*1024)
         #### End of Data ####
 
         #### Worker ####
@@ -290,6 +333,7 @@ class App(QtCore.QObject):
         self.ui.menuoptions_transfer_p2a.triggered.connect(self.on_options_project2app)
         self.ui.menuoptions_transfer_o2p.triggered.connect(self.on_options_object2project)
         self.ui.menuoptions_transfer_p2o.triggered.connect(self.on_options_project2object)
+        self.ui.menuoptions_clearcache.triggered.connect(self.on_options_clearcache)
         self.ui.menuviewdisableall.triggered.connect(self.disable_plots)
         self.ui.menuviewdisableother.triggered.connect(lambda: self.disable_plots(except_current=True))
         self.ui.menuviewenable.triggered.connect(self.enable_all_plots)
@@ -482,7 +526,7 @@ class App(QtCore.QObject):
 
         App.log.debug("Calling object constructor...")
         obj = classdict[kind](name)
-        obj.units = self.options["units"]  # TODO: The constructor should look at defaults.
+        obj.set_units(self.options["units"])  # TODO: The constructor should look at defaults.
 
         # Set default options from self.options
         for option in self.options:
@@ -625,6 +669,17 @@ class App(QtCore.QObject):
         self.defaults.update(self.options)
         self.defaults_write_form()
 
+    def on_options_clearcache(self):
+        """
+        Callback for Options->Clear cache. Removes the parsed Gerber
+        and Excellon files kept in ``self.cache``.
+
+        :return: None
+        """
+
+        self.cache.clear()
+        self.inform.emit("Cache cleared.")
+
     def on_options_project2object(self):
         """
         Callback for Options->Transfer Options->Project=>Object. Copies options
@@ -986,6 +1041,10 @@ class App(QtCore.QObject):
         # Clear project filename
         self.project_filename = None
 
+        self.project_file.close()
+        self.project_file = ProjectFile()
+        self.unplotted = []
+
         # Re-fresh project options
         self.on_options_app2project()
 
@@ -1070,8 +1129,6 @@ class App(QtCore.QObject):
             self.on_file_saveprojectas()
         else:
             self.save_project(self.project_filename)
-            self.file_opened.emit("project", self.project_filename)
-            self.inform.emit("Project saved to: " + self.project_filename)
 
     def on_file_saveprojectas(self, make_copy=False):
         """
@@ -1105,14 +1162,7 @@ class App(QtCore.QObject):
             if result == QtGui.QMessageBox.Cancel:
                 return
 
-        self.save_project(filename)
-        self.file_opened.emit("project", filename)
-
-        if not make_copy:
-            self.project_filename = filename
-            self.inform.emit("Project saved to: " + self.project_filename)
-        else:
-            self.inform.emit("Project copy saved to: " + self.project_filename)
+        self.save_project(filename, make_copy=make_copy)
 
     def open_gerber(self, filename):
         """
@@ -1134,7 +1184,10 @@ class App(QtCore.QObject):
 
             # Opening the file happens here
             self.progress.emit(30)
-            gerber_obj.parse_file(filename)
+            key = self.cache.key(filename, gerber_obj)
+            if not self.cache.load(key, gerber_obj):
+                gerber_obj.parse_file(filename, processes=self.options["processes"])
+                self.cache.store(key, gerber_obj)
 
             # Further parsing
             self.progress.emit(70)
@@ -1184,7 +1237,10 @@ class App(QtCore.QObject):
         # How the object should be initialized
         def obj_init(excellon_obj, app_obj):
             self.progress.emit(20)
-            excellon_obj.parse_file(filename)
+            key = self.cache.key(filename, excellon_obj)
+            if not self.cache.load(key, excellon_obj):
+                excellon_obj.parse_file(filename)
+                self.cache.store(key, excellon_obj)
             excellon_obj.create_geometry()
             self.progress.emit(70)
 
@@ -1232,18 +1288,15 @@ class App(QtCore.QObject):
             assert isinstance(app_obj_, App)
             self.progress.emit(10)
 
-            f = open(filename)
-            gcode = f.read()
-            f.close()
-
-            job_obj.gcode = gcode
-
-            self.progress.emit(20)
-            job_obj.gcode_parse()
+            job_obj.parse_file(filename, progress=lambda done: self.progress.emit(10 + int(50 * done)))
 
             self.progress.emit(60)
             job_obj.create_geometry()
 
+            # Decimated paths for display
+            self.progress.emit(70)
+            job_obj.gcode_pyramid()
+
         # Object name
         name = filename.split('/')[-1].split('\\')[-1]
 
@@ -1279,12 +1332,26 @@ class App(QtCore.QObject):
         5) Calls new_object() with the object's from_dict() as init method.
         6) Calls plot_all()
 
+        Project containers (see ``ProjectFile``) only have their index
+        read here. The data of each object is loaded when first used.
+
         :param filename:  Name of the file from which to load.
         :type filename: str
         :return: None
         """
         App.log.debug("Opening project: " + filename)
 
+        try:
+            is_container = ProjectFile.is_container(filename)
+        except IOError:
+            App.log.error("Failed to open project file: %s" % filename)
+            self.inform.emit("ERROR: Failed to open project file: %s" % filename)
+            return
+
+        if is_container:
+            self.open_project_file(filename)
+            return
+
         try:
             f = open(filename, 'r')
         except IOError:
@@ -1322,6 +1389,57 @@ class App(QtCore.QObject):
         self.inform.emit("Project loaded from: " + filename)
         App.log.debug("Project loaded")
 
+    def open_project_file(self, filename):
+        """
+        Loads a project container. Objects are created from the
+        index right away and left to load their data when used.
+        See ``open_project()``.
+
+        :param filename:  Name of the file from which to load.
+        :type filename: str
+        :return: None
+        """
+
+        try:
+            project_file = ProjectFile(filename)
+        except:
+            App.log.error("Failed to parse project file: %s" % filename)
+            self.inform.emit("ERROR: Failed to parse project file: %s" % filename)
+            return
+
+        self.file_opened.emit("project", filename)
+
+        # Clear the current project
+        self.on_file_new()
+        self.project_file = project_file
+
+        # Project options
+        self.options.update(project_file.options)
+        self.project_filename = filename
+        self.ui.units_label.setText("[" + self.options["units"] + "]")
+
+        # Re create objects
+        App.log.debug("Re-creating objects...")
+        for entry in project_file.objects:
+            def obj_init(obj_inst, app_inst, entry=entry):
+                project_file.init_object(obj_inst, entry)
+            options = entry['attrs']['options']
+            App.log.debug(entry['attrs']['kind'] + ":  " + options['name'])
+            self.new_object(entry['attrs']['kind'], options['name'], obj_init,
+                            active=False, fit=False, plot=False)
+
+        # Only the objects in view are plotted, as it loads their
+        # data. The bounds of the rest are known from the index.
+        self.plotcanvas.clear()
+        self.unplotted = self.collection.get_list()
+        if project_file.view is not None:
+            self.plotcanvas.adjust_axes(*project_file.view)
+        else:
+            self.on_zoom_fit(None)
+
+        self.inform.emit("Project loaded from: " + filename)
+        App.log.debug("Project loaded")
+
     def plot_all(self):
         """
         Re-generates all plots from all objects.
@@ -1330,6 +1448,7 @@ class App(QtCore.QObject):
         """
         self.log.debug("plot_all()")
 
+        self.unplotted = []
         self.plotcanvas.clear()
         self.progress.emit(10)
 
@@ -1352,6 +1471,37 @@ class App(QtCore.QObject):
         #self.worker.add_task(worker_task, [self])
         self.worker_task.emit({'fcn': worker_task, 'params': [self]})
 
+    def plot_in_view(self, xmin, ymin, xmax, ymax):
+        """
+        Plots the objects in ``self.unplotted`` that are in the
+        given view, in the worker thread. Their bounds are found
+        without loading them. See ``ProjectFile.saved_bounds()``.
+        Called by the plot canvas when the view changes.
+
+        :return: None
+        """
+        objs = self.collection.get_list()
+        in_view = []
+        unplotted = []
+        for obj in self.unplotted:
+            if obj not in objs:
+                continue
+            oxmin, oymin, oxmax, oymax = obj.bounds()
+            if oxmin <= xmax and xmin <= oxmax and oymin <= ymax and ymin <= oymax:
+                in_view.append(obj)
+            else:
+                unplotted.append(obj)
+        self.unplotted = unplotted
+
+        if len(in_view) == 0:
+            return
+
+        def worker_task(app_obj):
+            for obj in in_view:
+                obj.plot()
+
+        self.worker_task.emit({'fcn': worker_task, 'params': [self]})
+
     def register_folder(self, filename):
         self.last_folder = os.path.split(str(filename))[0]
 
@@ -1496,12 +1646,23 @@ class App(QtCore.QObject):
         # self.worker.add_task(worker_task, [self])
         self.worker_task.emit({'fcn': worker_task, 'params': [self]})
 
-    def save_project(self, filename):
+    def save_project(self, filename, make_copy=False):
         """
-        Saves the current project to the specified file.
+        Saves the current project to the specified file. Unless
+        saving a copy, it becomes ``self.project_filename`` once
+        written.
+
+        Only a snapshot of the objects and options is taken here,
+        which is cheap. Writing it happens in the worker thread,
+        reporting through ``self.progress`` and ``self.inform``.
+        Only what changed since the last save is written when
+        saving to the same file. See ``ProjectFile.save()``.
 
         :param filename: Name of the file in which to save.
         :type filename: str
+        :param make_copy: Save a copy. Later saves still go
+            to ``self.project_filename``.
+        :type make_copy: bool
         :return: None
         """
         self.log.debug("save_project()")
@@ -1516,29 +1677,39 @@ class App(QtCore.QObject):
         # Project options
         self.options_read_form()
 
-        # Serialize the whole project
-        d = {"objs": [obj.to_dict() for obj in self.collection.get_list()],
-             "options": self.options,
-             "version": self.version}
+        # Snapshot of the whole project. Only objects that
+        # changed since the last save are copied.
+        project_file = self.project_file
+        items = project_file.snapshot(self.collection.get_list())
+        options = dict(self.options)
+        xmin, xmax = self.plotcanvas.axes.get_xlim()
+        ymin, ymax = self.plotcanvas.axes.get_ylim()
+        view = [float(xmin), float(ymin), float(xmax), float(ymax)]
 
-        # Open file
-        try:
-            f = open(filename, 'w')
-        except IOError:
-            App.log.error("ERROR: Failed to open file for saving:", filename)
-            return
-
-        # Write
-        try:
-            json.dump(d, f, default=to_dict)
-        except:
-            App.log.error("ERROR: File open but failed to write:", filename)
-            f.close()
-            return
+        def worker_task(app_obj):
+            self.progress.emit(5)
+            try:
+                project_file.save(filename, items, options, self.version,
+                                  progress=lambda fraction: self.progress.emit(int(5 + 90*fraction)),
+                                  copy=make_copy, view=view)
+            except:
+                e = sys.exc_info()
+                App.log.error("Failed to write project file %s: %s" % (filename, str(e[1])))
+                self.inform.emit("ERROR: Failed to write project file: %s (%s)" % (filename, str(e[1])))
+                self.progress.emit(0)
+                return
 
-        f.close()
+            self.progress.emit(100)
+            if make_copy:
+                self.inform.emit("Project copy saved to: %s" % filename)
+            else:
+                self.project_filename = filename
+                self.inform.emit("Project saved to: %s" % filename)
+            self.file_opened.emit("project", filename)
+            self.progress.emit(0)
 
-        self.inform.emit("Project saved to: %s" % filename)
+        # Send to worker
+        self.worker_task.emit({'fcn': worker_task, 'params': [self]})
 
 # def main():
 #
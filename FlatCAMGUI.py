@@ -78,6 +78,7 @@ class FlatCAMGUI(QtGui.QMainWindow):
         self.menuoptions_transfer_o2p = self.menuoptions_transfer.addAction("Object to Project")
         self.menuoptions_transfer_a2o = self.menuoptions_transfer.addAction("Application to Object")
         self.menuoptions_transfer_o2a = self.menuoptions_transfer.addAction("Object to Application")
+        self.menuoptions_clearcache = self.menuoptions.addAction("Clear cache")
 
         ### View ###
         self.menuview = self.menu.addMenu('&View')
@@ -538,6 +539,24 @@ class GeometryOptionsGroupUI(OptionsGroupUI):
         self.cnctooldia_entry = LengthEntry()
         grid1.addWidget(self.cnctooldia_entry, 3, 1)
 
+        # Link moves
+        self.linkcleared_cb = FCCheckBox(label="Link in cleared area")
+        self.linkcleared_cb.setToolTip(
+            "Cut straight to the next path instead\n"
+            "of lifting the tool, when the move stays\n"
+            "inside the area cut by the tool."
+        )
+        grid1.addWidget(self.linkcleared_cb, 4, 0, 1, 2)
+
+        # Arcs
+        self.arcs_cb = FCCheckBox(label="Cut arcs")
+        self.arcs_cb.setToolTip(
+            "Cut runs of short segments that\n"
+            "follow a circle as arcs (G02/G03)\n"
+            "instead of line by line."
+        )
+        grid1.addWidget(self.arcs_cb, 5, 0, 1, 2)
+
         ## Paint area
         self.paint_label = QtGui.QLabel('<b>Paint Area:</b>')
         self.paint_label.setToolTip(
@@ -613,6 +632,15 @@ class CNCJobOptionsGroupUI(OptionsGroupUI):
         self.tooldia_entry = LengthEntry()
         grid0.addWidget(self.tooldia_entry, 1, 1)
 
+        # Swept area
+        self.sweptarea_cb = FCCheckBox(label='Swept area')
+        self.sweptarea_cb.setToolTip(
+            "Plot the exact area swept by\n"
+            "the tool. Slower to draw the\n"
+            "first time for large jobs."
+        )
+        grid0.addWidget(self.sweptarea_cb, 2, 0, 1, 2)
+
         ## Export G-Code
         self.export_gcode_label = QtGui.QLabel("<b>Export G-Code:</b>")
         self.export_gcode_label.setToolTip(
@@ -649,6 +677,18 @@ class GlobalOptionsUI(QtGui.QWidget):
                                      {'label': 'mm', 'value': 'MM'}])
         hlay1.addWidget(self.units_radio)
 
+        hlay2 = QtGui.QHBoxLayout()
+        layout.addLayout(hlay2)
+        processeslabel = QtGui.QLabel('Processes:')
+        processeslabel.setToolTip(
+            "Number of processes creating the\n"
+            "geometry of Gerber files. 1 to\n"
+            "do it all in the application."
+        )
+        hlay2.addWidget(processeslabel)
+        self.processes_entry = IntEntry()
+        hlay2.addWidget(self.processes_entry)
+
         ####### Gerber #######
         # gerberlabel = QtGui.QLabel('<b>Gerber Options</b>')
         # layout.addWidget(gerberlabel)
@@ -4,6 +4,7 @@ import FlatCAMApp
 import inspect  # TODO: For debugging only.
 from camlib import *
 from FlatCAMCommon import LoudDict
+from PlotCanvas import ViewCulling
 
 
 ########################################
@@ -39,6 +40,7 @@ class FlatCAMObj(QtCore.QObject):
         self.form_fields = {}
 
         self.axes = None  # Matplotlib axes
+        self.culling = None  # ViewCulling of the plot
         self.kind = None  # Override with proper name
 
         self.muted_ui = False
@@ -48,6 +50,22 @@ class FlatCAMObj(QtCore.QObject):
         # self.ui.offset_button.clicked.connect(self.on_offset_button_click)
         # self.ui.scale_button.clicked.connect(self.on_scale_button_click)
 
+    def __getattr__(self, name):
+        # QObject comes before Geometry, so attributes
+        # deferred with Geometry.set_lazy() are handled here.
+        if name in self.__dict__.get('_lazy', ([], None))[0]:
+            self.load_lazy()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def bounds(self):
+        # Known from the project file while the object did not
+        # change, so that finding them does not load its data.
+        bounds = self.app.project_file.saved_bounds(self)
+        if bounds is None:
+            return super(FlatCAMObj, self).bounds()
+        return bounds
+
     def on_options_change(self, key):
         self.emit(QtCore.SIGNAL("optionChanged"), key)
 
@@ -381,7 +399,7 @@ class FlatCAMGerber(FlatCAMObj, Gerber):
                            [pts[6], pts[7], pts[8]],
                            [pts[9], pts[10], pts[11]]]}
             cuts = cases[self.options['gaps']]
-            geo_obj.solid_geometry = cascaded_union([LineString(segment) for segment in cuts])
+            geo_obj.solid_geometry = union_all([LineString(segment) for segment in cuts])
 
         # TODO: Check for None
         self.app.new_object("geometry", name, geo_init)
@@ -454,39 +472,23 @@ class FlatCAMGerber(FlatCAMObj, Gerber):
         if not FlatCAMObj.plot(self):
             return
 
-        geometry = self.solid_geometry
-
-        # Make sure geometry is iterable.
-        try:
-            _ = iter(geometry)
-        except TypeError:
-            geometry = [geometry]
-
-        if self.options["multicolored"]:
-            linespec = '-'
-        else:
-            linespec = 'k-'
+        # One artist for the whole object, with the
+        # parts around the view. See ViewCulling.
+        rings = rings_of(self.solid_geometry)
+        colors = ['b', 'g', 'r', 'c', 'm', 'y', 'k']
 
-        if self.options["solid"]:
-            for poly in geometry:
+        def make_artist(parts):
+            parts = parts.tolist()
+            if self.options["solid"]:
                 # TODO: Too many things hardcoded.
-                try:
-                    patch = PolygonPatch(poly,
-                                         facecolor="#BBF268",
-                                         edgecolor="#006E20",
-                                         alpha=0.75,
-                                         zorder=2)
-                    self.axes.add_patch(patch)
-                except AssertionError:
-                    FlatCAMApp.App.log.warning("A geometry component was not a polygon:")
-                    FlatCAMApp.App.log.warning(str(poly))
-        else:
-            for poly in geometry:
-                x, y = poly.exterior.xy
-                self.axes.plot(x, y, linespec)
-                for ints in poly.interiors:
-                    x, y = ints.coords.xy
-                    self.axes.plot(x, y, linespec)
+                return plot_rings(self.axes, [rings[k] for k in parts], solid=True,
+                                  color="#006E20", facecolor="#BBF268", alpha=0.75, zorder=2)
+            if self.options["multicolored"]:
+                return plot_rings(self.axes, [rings[k] for k in parts],
+                                  color=[colors[k % len(colors)] for k in parts])
+            return plot_rings(self.axes, [rings[k] for k in parts], color='k')
+
+        self.culling = ViewCulling(self.axes, rings_bounds(rings), make_artist)
 
         self.app.plotcanvas.auto_adjust_axes()
         #GLib.idle_add(self.app.plotcanvas.auto_adjust_axes)
@@ -600,7 +602,9 @@ class FlatCAMExcellon(FlatCAMObj, Excellon):
 
             tools_csv = ','.join(tools)
             # job_obj.generate_from_excellon_by_tool(self, self.options["toolselection"])
-            job_obj.generate_from_excellon_by_tool(self, tools_csv)
+            saved = job_obj.generate_from_excellon_by_tool(self, tools_csv)
+            app_obj.inform.emit("Drill order optimized. Rapid travel reduced by %.4f %s." %
+                                (saved, job_obj.units.lower()))
 
             # GLib.idle_add(lambda: app_obj.set_progress_bar(0.5, "Parsing G-Code..."))
             app_obj.progress.emit(50)
@@ -650,27 +654,22 @@ class FlatCAMExcellon(FlatCAMObj, Excellon):
         if not FlatCAMObj.plot(self):
             return
 
-        try:
-            _ = iter(self.solid_geometry)
-        except TypeError:
-            self.solid_geometry = [self.solid_geometry]
+        # One collection of circles for the drills
+        # around the view. See ViewCulling.
+        tools = sorted(self.drills.keys())
+        centers = self.drill_points(tools)
+        diameters = repeat([self.tools[tool]["C"] for tool in tools],
+                           [len(self.drills[tool]) for tool in tools])
+        radii = diameters[:, newaxis] / 2.0
+        bounds = concatenate([centers - radii, centers + radii], axis=1)
 
-        # Plot excellon (All polygons?)
-        if self.options["solid"]:
-            for geo in self.solid_geometry:
-                patch = PolygonPatch(geo,
-                                     facecolor="#C40000",
-                                     edgecolor="#750000",
-                                     alpha=0.75,
-                                     zorder=3)
-                self.axes.add_patch(patch)
-        else:
-            for geo in self.solid_geometry:
-                x, y = geo.exterior.coords.xy
-                self.axes.plot(x, y, 'r-')
-                for ints in geo.interiors:
-                    x, y = ints.coords.xy
-                    self.axes.plot(x, y, 'g-')
+        def make_artist(parts):
+            if self.options["solid"]:
+                return plot_circles(self.axes, centers[parts], diameters[parts], solid=True,
+                                    color="#750000", facecolor="#C40000", alpha=0.75, zorder=3)
+            return plot_circles(self.axes, centers[parts], diameters[parts], color='r')
+
+        self.culling = ViewCulling(self.axes, bounds, make_artist)
 
         self.app.plotcanvas.auto_adjust_axes()
         # GLib.idle_add(self.app.plotcanvas.auto_adjust_axes)
@@ -721,6 +720,7 @@ class FlatCAMCNCjob(FlatCAMObj, CNCjob):
         self.options.update({
             "plot": True,
             "tooldia": 0.4 / 25.4,  # 0.4mm in inches
+            "sweptarea": False,
             "append": ""
         })
 
@@ -739,6 +739,7 @@ class FlatCAMCNCjob(FlatCAMObj, CNCjob):
         self.form_fields.update({
             "plot": self.ui.plot_cb,
             "tooldia": self.ui.tooldia_entry,
+            "sweptarea": self.ui.sweptarea_cb,
             "append": self.ui.append_text
         })
 
@@ -764,9 +765,7 @@ class FlatCAMCNCjob(FlatCAMObj, CNCjob):
 
         postamble = str(self.ui.append_text.get_value())
 
-        f = open(filename, 'w')
-        f.write(self.gcode + "\n" + postamble)
-        f.close()
+        self.export_gcode(filename, postamble)
 
         self.app.file_opened.emit("cncjob", filename)
         self.app.inform.emit("Saved to: " + filename)
@@ -784,7 +783,7 @@ class FlatCAMCNCjob(FlatCAMObj, CNCjob):
         if not FlatCAMObj.plot(self):
             return
 
-        self.plot2(self.axes, tooldia=self.options["tooldia"])
+        self.plot2(self.axes, tooldia=self.options["tooldia"], swept=self.options["sweptarea"])
 
         self.app.plotcanvas.auto_adjust_axes()
 
@@ -818,7 +817,9 @@ class FlatCAMGeometry(FlatCAMObj, Geometry):
             "cnctooldia": 0.4 / 25.4,
             "painttooldia": 0.0625,
             "paintoverlap": 0.15,
-            "paintmargin": 0.01
+            "paintmargin": 0.01,
+            "linkcleared": False,
+            "arcs": False
         })
 
         # Attributes to be included in serialization
@@ -843,7 +844,9 @@ class FlatCAMGeometry(FlatCAMObj, Geometry):
             "cnctooldia": self.ui.cnctooldia_entry,
             "painttooldia": self.ui.painttooldia_entry,
             "paintoverlap": self.ui.paintoverlap_entry,
-            "paintmargin": self.ui.paintmargin_entry
+            "paintmargin": self.ui.paintmargin_entry,
+            "linkcleared": self.ui.linkcleared_cb,
+            "arcs": self.ui.arcs_cb
         })
 
         self.ui.plot_cb.stateChanged.connect(self.on_plot_cb_click)
@@ -898,7 +901,15 @@ class FlatCAMGeometry(FlatCAMObj, Geometry):
             # GLib.idle_add(lambda: app_obj.set_progress_bar(0.4, "Analyzing Geometry..."))
             app_obj.progress.emit(40)
             # TODO: The tolerance should not be hard coded. Just for testing.
-            job_obj.generate_from_geometry(self, tolerance=0.0005)
+            if self.options["linkcleared"]:
+                safe_region = CNCjob.cleared_region(self.solid_geometry, self.options["cnctooldia"])
+            else:
+                safe_region = None
+            before, after = job_obj.generate_from_geometry(self, tolerance=0.0005,
+                                                           safe_region=safe_region,
+                                                           arcs=self.options["arcs"])
+            app_obj.inform.emit("Toolpaths sequenced. Rapid travel from %.4f to %.4f %s." %
+                                (before, after, job_obj.units.lower()))
 
             # GLib.idle_add(lambda: app_obj.set_progress_bar(0.5, "Parsing G-Code..."))
             app_obj.progress.emit(50)
@@ -946,6 +957,8 @@ class FlatCAMGeometry(FlatCAMObj, Geometry):
             self.solid_geometry = affinity.scale(self.solid_geometry, factor, factor,
                                                  origin=(0, 0))
 
+        self.changed()
+
     def offset(self, vect):
         """
         Offsets all geometry by a given vector/
@@ -964,6 +977,8 @@ class FlatCAMGeometry(FlatCAMObj, Geometry):
         else:
             self.solid_geometry = affinity.translate(self.solid_geometry, xoff=dx, yoff=dy)
 
+        self.changed()
+
     def convert_units(self, units):
         factor = Geometry.convert_units(self, units)
 
@@ -995,31 +1010,12 @@ class FlatCAMGeometry(FlatCAMObj, Geometry):
         except TypeError:
             self.solid_geometry = [self.solid_geometry]
 
-        for geo in self.solid_geometry:
-
-            if type(geo) == Polygon:
-                x, y = geo.exterior.coords.xy
-                self.axes.plot(x, y, 'r-')
-                for ints in geo.interiors:
-                    x, y = ints.coords.xy
-                    self.axes.plot(x, y, 'r-')
-                continue
-
-            if type(geo) == LineString or type(geo) == LinearRing:
-                x, y = geo.coords.xy
-                self.axes.plot(x, y, 'r-')
-                continue
-
-            if type(geo) == MultiPolygon:
-                for poly in geo:
-                    x, y = poly.exterior.coords.xy
-                    self.axes.plot(x, y, 'r-')
-                    for ints in poly.interiors:
-                        x, y = ints.coords.xy
-                        self.axes.plot(x, y, 'r-')
-                continue
-
-            FlatCAMApp.App.log.warning("Did not plot:", str(type(geo)))
+        # One artist for all the geometry, with the
+        # parts around the view. See ViewCulling.
+        rings = rings_of(self.solid_geometry)
+        self.culling = ViewCulling(self.axes, rings_bounds(rings),
+                                   lambda parts: plot_rings(self.axes, [rings[k] for k in parts.tolist()],
+                                                            color='r'))
 
         self.app.plotcanvas.auto_adjust_axes()
         # GLib.idle_add(self.app.plotcanvas.auto_adjust_axes)
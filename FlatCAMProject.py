@@ -0,0 +1,456 @@
+import os
+import mmap
+import zlib
+import struct
+import threading
+import simplejson as json
+
+from camlib import pack, unpack
+
+
+class ProjectFile(object):
+    """
+    Project container. The file holds a blob for each object
+    with its heavy attributes (geometry, G-code, drills, ...) and
+    a small JSON index with the project options and, for each
+    object, the rest of its attributes and where its blob is. The
+    index is read when opening and the file is memory-mapped, so
+    each blob is decoded only when its object first needs it.
+    See ``Geometry.set_lazy()``. The index also has the bounds of
+    each object and the view of the plot, so that objects out of
+    view need not be decoded to show the project.
+
+    Saving again to the same file only appends the blobs of the
+    objects that changed, found by their ``revision``, and a new
+    index. The header is updated last, so until then the file is
+    still the previous save. When most of the file is no longer
+    used, it is compacted by writing it anew.
+
+    Layout::
+
+        magic (8 bytes)
+        index offset, index length (unsigned 64-bit, little endian)
+        blobs: zlib(pack({attr: value, ...})), one per object
+        index: JSON
+        [more blobs and indexes appended by later saves]
+    """
+
+    magic = b"FCPROJ\x00\x02"
+
+    header = struct.Struct("<QQ")
+
+    # Attributes always in the index, besides numbers.
+    # Anything else goes in the blob.
+    index_attrs = ['options', 'kind', 'units']
+
+    # Compact when the unused part of the file is larger
+    # than this fraction of it.
+    max_garbage = 0.5
+
+    def __init__(self, filename=None):
+        """
+        Opens a project file and reads its index. Without a filename,
+        stands for a project that has not been saved yet.
+
+        :param filename: Project file, as written by ``ProjectFile.save()``.
+        :type filename: str
+        :return: ProjectFile
+        """
+        self.filename = None
+        self.file = None
+        self.map = None
+        self.size = 0
+
+        # Held while using self.file or self.map.
+        self.lock = threading.RLock()
+
+        self.version = None
+        self.options = {}
+
+        # View of the plot when saved: [xmin, ymin, xmax, ymax] or None.
+        self.view = None
+
+        # [{'attrs': {...}, 'lazy': [...], 'blob': [offset, length],
+        #   'bounds': [xmin, ymin, xmax, ymax]}, ...]
+        self.objects = []
+
+        # Object -> (revision, entry) as last saved or loaded.
+        self.saved = {}
+
+        if filename is not None:
+            index = self._open(filename)
+            self.version = index['version']
+            self.options = index['options']
+            self.view = index.get('view')
+            self.objects = index['objs']
+
+    def _open(self, filename):
+        """
+        Opens and maps the file and returns its index.
+        """
+        f = open(filename, 'rb')
+        try:
+            if f.read(len(ProjectFile.magic)) != ProjectFile.magic:
+                raise ValueError("Not a project container: %s" % filename)
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            f.close()
+            raise
+
+        start = len(ProjectFile.magic)
+        index_offset, index_length = ProjectFile.header.unpack(
+            m[start:start + ProjectFile.header.size])
+        index = json.loads(m[index_offset:index_offset + index_length].decode('utf-8'))
+
+        self.filename = filename
+        self.file = f
+        self.map = m
+        self.size = len(m)
+        return index
+
+    @staticmethod
+    def is_container(filename):
+        """
+        Whether the file is a project container, as opposed to
+        the older JSON project files.
+
+        :param filename: Project file.
+        :type filename: str
+        :rtype: bool
+        """
+        f = open(filename, 'rb')
+        try:
+            return f.read(len(ProjectFile.magic)) == ProjectFile.magic
+        finally:
+            f.close()
+
+    def raw_blob(self, entry):
+        """
+        The blob of an object as stored.
+
+        :param entry: Element of ``self.objects``.
+        :type entry: dict
+        :rtype: bytes
+        """
+        with self.lock:
+            offset, length = entry['blob']
+            return self.map[offset:offset + length]
+
+    def blob(self, entry):
+        """
+        Decodes the blob of an object.
+
+        :param entry: Element of ``self.objects``.
+        :type entry: dict
+        :return: {attribute: value, ...}
+        :rtype: dict
+        """
+        return unpack(zlib.decompress(self.raw_blob(entry)))
+
+    def init_object(self, obj, entry):
+        """
+        Sets the attributes of ``obj`` from the index and
+        defers those in the blob until they are used.
+
+        :param obj: Object to populate.
+        :type obj: FlatCAMObj
+        :param entry: Element of ``self.objects``.
+        :type entry: dict
+        :return: None
+        """
+        for attr in entry['attrs']:
+            if attr == 'units':
+                obj.set_units(entry['attrs'][attr])
+            elif attr == 'options':
+                obj.options.update(entry['attrs'][attr])
+            else:
+                setattr(obj, attr, entry['attrs'][attr])
+
+        obj.set_lazy(entry['lazy'], lambda: self.blob(entry))
+        self.saved[obj] = (obj.revision, entry)
+
+    def saved_bounds(self, obj):
+        """
+        Bounds of an object as last saved or loaded, if it did not
+        change since. Unlike ``obj.bounds()``, its data is not loaded.
+
+        :param obj: Object in the project.
+        :return: (xmin, ymin, xmax, ymax) or None if not known.
+        :rtype: tuple
+        """
+        saved = self.saved.get(obj)
+        if saved is None or saved[0] != obj.revision or saved[1].get('bounds') is None:
+            return None
+        return tuple(saved[1]['bounds'])
+
+    def close(self):
+        """
+        Releases the file. Objects whose blob has not been
+        loaded can't load it anymore.
+
+        :return: None
+        """
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.file.close()
+            self.map = None
+            self.file = None
+
+    @staticmethod
+    def split(d):
+        """
+        Splits an object's ``to_dict()`` into the attributes for
+        the index and those for the blob.
+
+        :param d: Dictionary from ``to_dict()``.
+        :type d: dict
+        :return: (index attributes, blob attributes)
+        :rtype: tuple
+        """
+        attrs = {}
+        heavy = {}
+        for attr in d:
+            value = d[attr]
+            if attr in ProjectFile.index_attrs or value is None or \
+                    isinstance(value, (bool, int, float)):
+                attrs[attr] = value
+            else:
+                heavy[attr] = value
+        return attrs, heavy
+
+    @staticmethod
+    def snapshot_dict(d):
+        """
+        Copy of an object's ``to_dict()`` that can be written while
+        the object is in use. Only lists and dictionaries are copied,
+        one level deep. What they hold, like geometry, NumPy arrays
+        and nested dictionaries, is shared, so objects must replace
+        it rather than change it in place, as ``scale()`` and
+        ``offset()`` do.
+
+        :param d: Dictionary from ``to_dict()``.
+        :type d: dict
+        :return: The copy.
+        :rtype: dict
+        """
+        result = {}
+        for attr in d:
+            if isinstance(d[attr], list):
+                result[attr] = list(d[attr])
+            elif isinstance(d[attr], dict):
+                result[attr] = dict(d[attr])
+            else:
+                result[attr] = d[attr]
+        return result
+
+    def snapshot(self, objs):
+        """
+        Takes what ``save()`` needs from the objects. Objects that did
+        not change since they were last saved or loaded only have their
+        index attributes taken, and their data is not loaded. The rest
+        are copied with ``snapshot_dict()``.
+
+        :param objs: Objects in the project.
+        :type objs: list
+        :return: List of (object, revision, entry, attributes,
+            bounds). For changed objects, entry is None, attributes are
+            the whole copy and bounds are found with ``obj.bounds()``.
+        :rtype: list
+        """
+        items = []
+        for obj in objs:
+            saved = self.saved.get(obj)
+            if saved is not None and saved[0] == obj.revision:
+                entry = saved[1]
+                attrs = {}
+                for attr in obj.ser_attrs:
+                    if attr not in entry['lazy']:
+                        attrs[attr] = getattr(obj, attr)
+                attrs = ProjectFile.snapshot_dict(attrs)
+                items.append((obj, obj.revision, entry, attrs, entry.get('bounds')))
+            else:
+                items.append((obj, obj.revision, None,
+                              ProjectFile.snapshot_dict(obj.to_dict()),
+                              [float(b) for b in obj.bounds()]))
+        return items
+
+    @staticmethod
+    def encode(heavy):
+        return zlib.compress(pack(heavy))
+
+    def save(self, filename, items, options, version, progress=None, copy=False, view=None):
+        """
+        Saves the project. Appends to the file when saving to the one
+        already open and there is not too much garbage in it, and
+        writes it anew otherwise. Afterwards this refers to the
+        saved file, unless saving a copy.
+
+        :param filename: Project file.
+        :type filename: str
+        :param items: From ``snapshot()``.
+        :type items: list
+        :param options: Project options. Must be JSON serializable.
+        :type options: dict
+        :param version: Application version.
+        :type version: int
+        :param progress: Called with the fraction of objects written.
+        :type progress: function
+        :param copy: Write a copy of the project to ``filename`` and
+            keep referring to the current file. Later saves still go
+            there. The same as a plain save if ``filename`` is it.
+        :type copy: bool
+        :param view: View of the plot, [xmin, ymin, xmax, ymax].
+        :type view: list
+        :return: None
+        """
+
+        index = {'version': version, 'options': options, 'view': view}
+
+        if copy and filename != self.filename:
+            tmp_filename, entries = self._write_new(filename, items, index, progress)
+            ProjectFile._replace(tmp_filename, filename)
+            return
+
+        # Bytes in use if appending
+        reused = sum([item[2]['blob'][1] for item in items if item[2] is not None])
+        garbage = self.size - reused
+
+        if filename == self.filename and self.map is not None and \
+                garbage <= ProjectFile.max_garbage * self.size:
+            self._append(items, index, progress)
+        else:
+            self._rewrite(filename, items, index, progress)
+
+        self.options = options
+        self.version = version
+        self.view = view
+
+    def _write_objects(self, f, items, progress, copy_blobs):
+        """
+        Writes the blobs of the items at the current position
+        of ``f`` and returns the new index entries.
+        """
+        entries = []
+        for obj, revision, entry, attrs, bounds in items:
+            if entry is None:
+                attrs, heavy = ProjectFile.split(attrs)
+                lazy = sorted(heavy.keys())
+                blob = ProjectFile.encode(heavy)
+            else:
+                lazy = entry['lazy']
+                blob = self.raw_blob(entry) if copy_blobs else None
+
+            if blob is None:
+                location = entry['blob']
+            else:
+                location = [f.tell(), len(blob)]
+                f.write(blob)
+
+            entries.append({'attrs': attrs, 'lazy': lazy, 'blob': location, 'bounds': bounds})
+
+            if progress is not None:
+                progress(float(len(entries)) / len(items))
+
+        return entries
+
+    @staticmethod
+    def _write_index(f, entries, index):
+        """
+        Writes the index at the current position of ``f``
+        and returns its offset and length.
+        """
+        index = json.dumps(dict(index, objs=entries)).encode('utf-8')
+        index_offset = f.tell()
+        f.write(index)
+        return index_offset, len(index)
+
+    def _commit(self, items, entries):
+        """
+        Records the entries just saved. Entries of objects that
+        may still load lazily are updated in place, as their
+        loaders refer to them.
+        """
+        saved = {}
+        for (obj, revision, entry, attrs, bounds), new_entry in zip(items, entries):
+            if entry is not None:
+                entry.update(new_entry)
+                new_entry = entry
+            saved[obj] = (revision, new_entry)
+        self.saved = saved
+        self.objects = entries
+
+    def _append(self, items, index, progress):
+        # Windows can't extend a file that is mapped, so the map is
+        # closed meanwhile. Holding the lock, lazy loads wait for it.
+        with self.lock:
+            self.close()
+            try:
+                f = open(self.filename, 'r+b')
+                try:
+                    f.seek(0, os.SEEK_END)
+                    entries = self._write_objects(f, items, progress, copy_blobs=False)
+                    index_offset, index_length = ProjectFile._write_index(f, entries, index)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                    # Only now the new index takes effect.
+                    f.seek(len(ProjectFile.magic))
+                    f.write(ProjectFile.header.pack(index_offset, index_length))
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    f.close()
+            finally:
+                # The new blobs, or the file as it was on failure.
+                self._open(self.filename)
+
+            self._commit(items, entries)
+
+    def _write_new(self, filename, items, index, progress):
+        """
+        Writes a whole project file next to ``filename`` and
+        returns its name and the new index entries.
+        """
+        tmp_filename = filename + ".tmp"
+        f = open(tmp_filename, 'wb')
+        try:
+            f.write(ProjectFile.magic)
+            f.write(ProjectFile.header.pack(0, 0))
+            entries = self._write_objects(f, items, progress, copy_blobs=True)
+            index_offset, index_length = ProjectFile._write_index(f, entries, index)
+
+            f.seek(len(ProjectFile.magic))
+            f.write(ProjectFile.header.pack(index_offset, index_length))
+
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+        return tmp_filename, entries
+
+    @staticmethod
+    def _replace(tmp_filename, filename):
+        # Atomic except on Windows, where rename
+        # does not replace an existing file.
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+
+    def _rewrite(self, filename, items, index, progress):
+        tmp_filename, entries = self._write_new(filename, items, index, progress)
+
+        with self.lock:
+            old_filename = self.filename
+            self.close()
+
+            try:
+                ProjectFile._replace(tmp_filename, filename)
+            except:
+                if old_filename is not None and os.path.exists(old_filename):
+                    self._open(old_filename)
+                raise
+
+            self._open(filename)
+            self._commit(items, entries)
@@ -1,6 +1,7 @@
 from PyQt4 import QtGui, QtCore
 from shapely.geometry import Point
 from shapely import affinity
+from numpy import array
 from math import sqrt
 
 import FlatCAMApp
@@ -136,13 +137,13 @@ class DblSidedTool(FlatCAMTool):
         tools = {"1": {"C": dia}}
 
         holes = self.alignment_holes.get_value()
-        drills = []
+        points = []
 
         for hole in holes:
-            point = Point(hole)
-            point_mirror = affinity.scale(point, xscale, yscale, origin=(px, py))
-            drills.append({"point": point, "tool": "1"})
-            drills.append({"point": point_mirror, "tool": "1"})
+            points.append(hole)
+            points.append((px + xscale*(hole[0] - px), py + yscale*(hole[1] - py)))
+
+        drills = {"1": array(points, dtype=float).reshape(-1, 2)}
 
         def obj_init(obj_inst, app_inst):
             obj_inst.tools = tools
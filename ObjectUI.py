@@ -133,6 +133,15 @@ class CNCObjectUI(ObjectUI):
         self.tooldia_entry = LengthEntry()
         grid0.addWidget(self.tooldia_entry, 1, 1)
 
+        # Swept area
+        self.sweptarea_cb = FCCheckBox(label='Swept area')
+        self.sweptarea_cb.setToolTip(
+            "Plot the exact area swept by\n"
+            "the tool. Slower to draw the\n"
+            "first time for large jobs."
+        )
+        grid0.addWidget(self.sweptarea_cb, 2, 0, 1, 2)
+
         # Update plot button
         self.updateplot_button = QtGui.QPushButton('Update Plot')
         self.updateplot_button.setToolTip(
@@ -239,6 +248,24 @@ class GeometryObjectUI(ObjectUI):
         self.cnctooldia_entry = LengthEntry()
         grid1.addWidget(self.cnctooldia_entry, 3, 1)
 
+        # Link moves
+        self.linkcleared_cb = FCCheckBox(label="Link in cleared area")
+        self.linkcleared_cb.setToolTip(
+            "Cut straight to the next path instead\n"
+            "of lifting the tool, when the move stays\n"
+            "inside the area cut by the tool."
+        )
+        grid1.addWidget(self.linkcleared_cb, 4, 0, 1, 2)
+
+        # Arcs
+        self.arcs_cb = FCCheckBox(label="Cut arcs")
+        self.arcs_cb.setToolTip(
+            "Cut runs of short segments that\n"
+            "follow a circle as arcs (G02/G03)\n"
+            "instead of line by line."
+        )
+        grid1.addWidget(self.arcs_cb, 5, 0, 1, 2)
+
         self.generate_cnc_button = QtGui.QPushButton('Generate')
         self.generate_cnc_button.setToolTip(
             "Generate the CNC Job object."
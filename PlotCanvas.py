@@ -9,6 +9,8 @@
 from PyQt4 import QtGui, QtCore
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt4agg import FigureCanvasQTAgg as FigureCanvas
+from numpy import argsort, concatenate, floor, flatnonzero, minimum, maximum, arange
+from camlib import GridIndex
 import FlatCAMApp
 
 
@@ -66,6 +68,10 @@ class PlotCanvas:
         self.mouse = [0, 0]
         self.key = None
 
+        # Called with (xmin, ymin, xmax, ymax) when the view changes.
+        # See view_changed().
+        self.view_callbacks = []
+
     def on_key_down(self, event):
         """
 
@@ -193,6 +199,7 @@ class PlotCanvas:
             ax.set_position([x_ratio, y_ratio, 1 - 2 * x_ratio, 1 - 2 * y_ratio])
 
         # Re-draw
+        self.view_changed()
         self.canvas.draw()
 
     def auto_adjust_axes(self, *args):
@@ -245,6 +252,7 @@ class PlotCanvas:
             ax.set_ylim((ymin, ymax))
 
         # Re-draw
+        self.view_changed()
         self.canvas.draw()
 
     def pan(self, x, y):
@@ -259,8 +267,21 @@ class PlotCanvas:
             ax.set_ylim((ymin + y*height, ymax + y*height))
 
         # Re-draw
+        self.view_changed()
         self.canvas.draw()
 
+    def view_changed(self):
+        """
+        Calls the functions in ``self.view_callbacks`` with
+        the limits of the view: xmin, ymin, xmax, ymax.
+
+        :return: None
+        """
+        xmin, xmax = self.axes.get_xlim()
+        ymin, ymax = self.axes.get_ylim()
+        for callback in self.view_callbacks:
+            callback(xmin, ymin, xmax, ymax)
+
     def new_axes(self, name):
         """
         Creates and returns an Axes object attached to this object's Figure.
@@ -320,3 +341,96 @@ class PlotCanvas:
         """
         self.mouse = [event.xdata, event.ydata]
 
+
+class ViewCulling:
+    """
+    Shows in an artist only the parts of an object around the view.
+    The parts are grouped in tiles kept in a spatial index. When the
+    limits of the axes change, the artist is made again from the tiles
+    around the view, but only if the view is no longer covered by the
+    ones loaded, or is much smaller than them. Parts far from the view
+    are left out until then.
+
+    Nothing is shown until the limits of the axes are first set, which
+    objects do with ``PlotCanvas.auto_adjust_axes()`` after plotting,
+    so the first artist is made for the actual view.
+    """
+
+    # Loaded around the view on each side, as a fraction of its size.
+    margin = 0.5
+
+    # Load again when the view is smaller than this
+    # fraction of the loaded area.
+    min_fill = 1.0 / 16
+
+    def __init__(self, axes, bounds, make_artist, tiles=32):
+        """
+
+        :param axes: Matplotlib axes of the object.
+        :param bounds: Bounds of each part, array of shape (n, 4).
+        :type bounds: numpy.ndarray
+        :param make_artist: Called with an array of the indices of
+            the parts to show. Adds an artist with them to ``axes``
+            and returns it.
+        :type make_artist: function
+        :param tiles: Number of tiles along the larger side.
+        :type tiles: int
+        :return: ViewCulling
+        """
+        self.axes = axes
+        self.make_artist = make_artist
+        self.artist = None
+        self.loaded = None  # (xmin, ymin, xmax, ymax)
+
+        # Parts by tile of the center of their bounds.
+        self.tiles = []
+        self.index = GridIndex(1.0)
+        if len(bounds) > 0:
+            xmin, ymin = bounds[:, 0].min(), bounds[:, 1].min()
+            size = max(bounds[:, 2].max() - xmin, bounds[:, 3].max() - ymin, 1e-9) / tiles
+            col = floor(((bounds[:, 0] + bounds[:, 2]) / 2 - xmin) / size)
+            row = floor(((bounds[:, 1] + bounds[:, 3]) / 2 - ymin) / size)
+            keys = row * (tiles + 1) + col
+            order = argsort(keys, kind='mergesort')
+            starts = concatenate([[0], flatnonzero(keys[order][1:] != keys[order][:-1]) + 1])
+
+            self.index = GridIndex(size)
+            tile_min = minimum.reduceat(bounds[order, :2], starts)
+            tile_max = maximum.reduceat(bounds[order, 2:], starts)
+            ends = list(starts[1:]) + [len(order)]
+            for k in range(len(starts)):
+                self.tiles.append(order[starts[k]:ends[k]])
+                self.index.insert(k, tuple(tile_min[k]) + tuple(tile_max[k]))
+
+        # Limits are always set X first, so this
+        # is enough to follow zooming and panning.
+        axes.callbacks.connect('ylim_changed', self.update)
+
+    def update(self, *args):
+        """
+        Makes the artist again if the view is not
+        well covered by the parts loaded.
+
+        :return: None
+        """
+        xmin, xmax = self.axes.get_xlim()
+        ymin, ymax = self.axes.get_ylim()
+
+        if self.loaded is not None:
+            lxmin, lymin, lxmax, lymax = self.loaded
+            inside = lxmin <= xmin and lymin <= ymin and xmax <= lxmax and ymax <= lymax
+            area = (xmax - xmin) * (ymax - ymin)
+            if inside and area >= ViewCulling.min_fill * (lxmax - lxmin) * (lymax - lymin):
+                return
+
+        dx = ViewCulling.margin * (xmax - xmin)
+        dy = ViewCulling.margin * (ymax - ymin)
+        self.loaded = (xmin - dx, ymin - dy, xmax + dx, ymax + dy)
+
+        keys = sorted(self.index.intersection(self.loaded))
+        parts = concatenate([self.tiles[k] for k in keys] + [arange(0)])
+
+        if self.artist is not None:
+            self.artist.remove()
+        self.artist = self.make_artist(parts)
+
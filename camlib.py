@@ -6,18 +6,41 @@
 # MIT Licence                                              #
 ############################################################
 
-from numpy import arctan2, Inf, array, sqrt, pi, ceil, sin, cos
+from numpy import arctan2, Inf, array, sqrt, pi, ceil, sin, cos, newaxis
+from numpy import zeros, arange, arccos, empty, concatenate
+from numpy import dtype, isnan, where, maximum, flatnonzero, full, cumsum
+from numpy import floor, repeat, clip, minimum
+from numpy import ndarray, generic, ascontiguousarray, frombuffer, prod
 from matplotlib.figure import Figure
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path as MPLPath
+from matplotlib.collections import LineCollection, EllipseCollection
 import re
+import operator
+import multiprocessing
+import bisect
+import os
+import time
+import zlib
+import struct
+import hashlib
+import base64
+import threading
+import mmap
+import tempfile
+from math import hypot
 
 # See: http://toblerity.org/shapely/manual.html
 from shapely.geometry import Polygon, LineString, Point, LinearRing
 from shapely.geometry import MultiPoint, MultiPolygon
 from shapely.geometry import box as shply_box
-from shapely.ops import cascaded_union
+from shapely.ops import cascaded_union, unary_union
+from shapely.prepared import prep
 import shapely.affinity as affinity
 from shapely.wkt import loads as sloads
 from shapely.wkt import dumps as sdumps
+from shapely.wkb import loads as wkb_loads
+from shapely.wkb import dumps as wkb_dumps
 from shapely.geometry.base import BaseGeometry
 
 # Used for solid polygons in Matplotlib
@@ -42,6 +65,14 @@ class Geometry(object):
     def __init__(self):
         # Units (in or mm)
         self.units = 'in'
+
+        # Largest distance between an arc and the straight
+        # segments approximating it, in self.units.
+        self.arc_tolerance = 0.0001
+
+        # Incremented whenever the geometry changes after being
+        # created. See ``changed()``.
+        self.revision = 0
         
         # Final geometry: MultiPolygon
         self.solid_geometry = None
@@ -71,8 +102,13 @@ class Geometry(object):
             return (0, 0, 0, 0)
             
         if type(self.solid_geometry) == list:
-            # TODO: This can be done faster. See comment from Shapely mailing lists.
-            return cascaded_union(self.solid_geometry).bounds
+            # No need to union anything, the bounds of the
+            # union are the bounds of all the bounds.
+            bounds = [geo.bounds for geo in self.solid_geometry if not geo.is_empty]
+            if len(bounds) == 0:
+                return (0, 0, 0, 0)
+            return (min([b[0] for b in bounds]), min([b[1] for b in bounds]),
+                    max([b[2] for b in bounds]), max([b[3] for b in bounds]))
         else:
             return self.solid_geometry.bounds
         
@@ -157,9 +193,37 @@ class Geometry(object):
             return 1.0
 
         self.units = units
+        self.arc_tolerance *= factor
         self.scale(factor)
+        self.changed()
         return factor
 
+    def changed(self):
+        """
+        Records that the object's data changed. Call it from
+        methods that modify it, like ``scale()`` and ``offset()``.
+        Used to save only what changed in a project.
+
+        :return: None
+        """
+        self.revision += 1
+
+    def set_units(self, units):
+        """
+        Sets the units in which the object's data is expressed
+        without scaling any geometry, like when they are found
+        while parsing a file. Settings given in units, like
+        ``arc_tolerance``, are kept at the same real size.
+
+        :param units: "IN" or "MM"
+        :type units: str
+        :return: None
+        """
+
+        factors = {"IN": 1.0, "MM": 25.4}
+        self.arc_tolerance *= factors[units.upper()] / factors[self.units.upper()]
+        self.units = units
+
     def to_dict(self):
         """
         Returns a respresentation of the object as a dictionary.
@@ -187,8 +251,66 @@ class Geometry(object):
         :return: None
         """
         for attr in self.ser_attrs:
+            if attr == 'units':
+                self.set_units(d[attr])
+                continue
             setattr(self, attr, d[attr])
 
+    # Held while loading lazy attributes.
+    lazy_lock = threading.RLock()
+
+    def set_lazy(self, attrs, loader):
+        """
+        Defers setting some attributes until one of them is first
+        used. Then ``loader()`` is called and all of them are set
+        from the dictionary it returns. Attributes set in the
+        meantime are left as they are. Attributes still deferred
+        by an earlier call are loaded together with these.
+
+        :param attrs: Names of the attributes.
+        :type attrs: list
+        :param loader: Returns {attribute: value, ...}
+        :type loader: function
+        :return: None
+        """
+        for attr in attrs:
+            self.__dict__.pop(attr, None)
+
+        pending = self.__dict__.get('_lazy')
+        if pending is not None:
+            previous = [attr for attr in pending[0] if attr not in attrs]
+            if len(previous) > 0:
+                self.__dict__['_lazy'] = (previous + list(attrs),
+                                          lambda: dict(pending[1](), **loader()))
+                return
+
+        self.__dict__['_lazy'] = (list(attrs), loader)
+
+    def load_lazy(self):
+        """
+        Sets the attributes deferred with ``set_lazy()``
+        now, if they have not been set yet.
+
+        :return: None
+        """
+        with Geometry.lazy_lock:
+            lazy = self.__dict__.get('_lazy')
+            if lazy is None:
+                return
+            attrs, loader = lazy
+            d = loader()
+            for attr in attrs:
+                if attr not in self.__dict__:
+                    setattr(self, attr, d[attr])
+            del self.__dict__['_lazy']
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not found.
+        if name in self.__dict__.get('_lazy', ([], None))[0]:
+            self.load_lazy()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
 
 class ApertureMacro:
 
@@ -199,10 +321,24 @@ class ApertureMacro:
     amprim_re = re.compile(r'^[1-9].*')
     amvar_re = re.compile(r'^\$([0-9a-zA-z]+)=(.*)')
 
+    # Tokens in arithmetic expressions: number, variable or operator.
+    amtoken_re = re.compile(r'\s*(?:(\d+\.?\d*|\.\d+)|\$(\d+)|([-+xX/()]))')
+
+    # Binary operators in arithmetic expressions.
+    amoperators = {'+': operator.add, '-': operator.sub, 'x': operator.mul,
+                   'X': operator.mul, '/': operator.truediv}
+
     def __init__(self, name=None):
         self.name = name
         self.raw = ""
 
+        ## Compiled macro. See self.compile(). Built
+        ## from self.raw the first time it is used.
+        self.program = None
+
+        ## Geometry resulting from each set of modifiers.
+        self.geometry_cache = {}
+
         ## These below are recomputed for every aperture
         ## definition, in other words, are temporary variables.
         self.primitives = []
@@ -234,18 +370,112 @@ class ApertureMacro:
         for attr in ['name', 'raw']:
             setattr(self, attr, d[attr])
 
-    def parse_content(self):
+        self.program = None
+        self.geometry_cache = {}
+
+    @staticmethod
+    def compile_expression(expr):
         """
-        Creates numerical lists for all primitives in the aperture
-        macro (in ``self.raw``) by replacing all variables by their
-        values iteratively and evaluating expressions. Results
-        are stored in ``self.primitives``.
+        Compiles an arithmetic expression from an aperture macro into
+        a function that takes a dictionary of variable values and
+        returns the value of the expression. Supports numbers,
+        variables (``$n``), ``+``, ``-``, ``x`` or ``X`` (multiplication),
+        ``/`` and parenthesis. Undefined variables are 0.
+
+        :param expr: The expression.
+        :type expr: str
+        :return: Function computing the expression.
+        :rtype: function
+        """
+
+        ## Tokenize
+        tokens = []
+        pos = 0
+        expr = expr.strip()
+        while pos < len(expr):
+            match = ApertureMacro.amtoken_re.match(expr, pos)
+            if match is None:
+                raise ValueError("Invalid aperture macro expression: %s" % expr)
+            tokens.append(match.groups())
+            pos = match.end()
+
+        # Position in tokens. In a list so the nested
+        # functions below can modify it.
+        idx = [0]
+
+        def peek():
+            if idx[0] < len(tokens):
+                return tokens[idx[0]][2]
+            return None
+
+        def factor():
+            if idx[0] >= len(tokens):
+                raise ValueError("Invalid aperture macro expression: %s" % expr)
+            number, var, op = tokens[idx[0]]
+            idx[0] += 1
+
+            if number is not None:
+                # Integers stay integers. Some are counts.
+                value = float(number) if '.' in number else int(number)
+                return lambda v: value
+
+            if var is not None:
+                return lambda v: v.get(var, 0.0)
+
+            if op == '-':
+                f = factor()
+                return lambda v: -f(v)
+
+            if op == '+':
+                return factor()
+
+            if op == '(':
+                f = sum_()
+                if peek() != ')':
+                    raise ValueError("Invalid aperture macro expression: %s" % expr)
+                idx[0] += 1
+                return f
+
+            raise ValueError("Invalid aperture macro expression: %s" % expr)
+
+        def binary(op, a, b):
+            fn = ApertureMacro.amoperators[op]
+            return lambda v: fn(a(v), b(v))
+
+        def term():
+            f = factor()
+            while peek() in ('x', 'X', '/'):
+                op = peek()
+                idx[0] += 1
+                f = binary(op, f, factor())
+            return f
+
+        def sum_():
+            f = term()
+            while peek() in ('+', '-'):
+                op = peek()
+                idx[0] += 1
+                f = binary(op, f, term())
+            return f
+
+        result = sum_()
+        if idx[0] != len(tokens):
+            raise ValueError("Invalid aperture macro expression: %s" % expr)
+        return result
+
+    def compile(self):
+        """
+        Compiles the macro in ``self.raw`` into ``self.program``, a list
+        of variable definitions ``('var', name, function)`` and primitives
+        ``('prim', None, [function, ...])``, where the functions compute the
+        expressions in the macro. See ``ApertureMacro.compile_expression()``.
+        This is done only once per macro and not for every use.
 
         :return: None
         """
         # Cleanup
         self.raw = self.raw.replace('\n', '').replace('\r', '').strip(" *")
-        self.primitives = []
+        self.program = []
 
         # Separate parts
         parts = self.raw.split('*')
@@ -261,24 +491,11 @@ class ApertureMacro:
             # These are variables defined locally inside the macro. They can be
             # numerical constant or defind in terms of previously define
             # variables, which can be defined locally or in an aperture
-            # definition. All replacements ocurr here.
+            # definition.
             match = ApertureMacro.amvar_re.search(part)
             if match:
-                var = match.group(1)
-                val = match.group(2)
-
-                # Replace variables in value
-                for v in self.locvars:
-                    val = re.sub(r'\$'+str(v)+r'(?![0-9a-zA-Z])', str(self.locvars[v]), val)
-
-                # Make all others 0
-                val = re.sub(r'\$[0-9a-zA-Z](?![0-9a-zA-Z])', "0", val)
-
-                # Change x with *
-                val = re.sub(r'[xX]', "*", val)
-
-                # Eval() and store.
-                self.locvars[var] = eval(val)
+                self.program.append(('var', match.group(1),
+                                     ApertureMacro.compile_expression(match.group(2))))
                 continue
 
             ### Primitives
@@ -288,22 +505,31 @@ class ApertureMacro:
             # variables are defined in an aperture definition.
             match = ApertureMacro.amprim_re.search(part)
             if match:
-                ## Replace all variables
-                for v in self.locvars:
-                    part = re.sub(r'\$'+str(v)+r'(?![0-9a-zA-Z])', str(self.locvars[v]), part)
+                self.program.append(('prim', None,
+                                     [ApertureMacro.compile_expression(x) for x in part.split(",")]))
+                continue
+
+            log.warning("Unknown syntax of aperture macro part: %s" % str(part))
 
-                # Make all others 0
-                part = re.sub(r'\$[0-9a-zA-Z](?![0-9a-zA-Z])', "0", part)
+    def parse_content(self):
+        """
+        Creates numerical lists for all primitives in the aperture
+        macro (in ``self.raw``) by running the compiled macro (see
+        ``self.compile()``) with the variables in ``self.locvars``.
+        Results are stored in ``self.primitives``.
 
-                # Change x with *
-                part = re.sub(r'[xX]', "*", part)
+        :return: None
+        """
+        if self.program is None:
+            self.compile()
 
-                ## Store
-                elements = part.split(",")
-                self.primitives.append([eval(x) for x in elements])
-                continue
+        self.primitives = []
 
-            log.warning("Unknown syntax of aperture macro part: %s" % str(part))
+        for kind, name, code in self.program:
+            if kind == 'var':
+                self.locvars[name] = code(self.locvars)
+            else:
+                self.primitives.append([f(self.locvars) for f in code])
 
     def append(self, data):
         """
@@ -314,6 +540,8 @@ class ApertureMacro:
         :return: None
         """
         self.raw += data
+        self.program = None
+        self.geometry_cache = {}
 
     @staticmethod
     def default2zero(n, mods):
@@ -402,7 +630,7 @@ class ApertureMacro:
         """
 
         pol = mods[0]
-        n = mods[1]
+        n = int(mods[1])
         points = [(0, 0)]*(n+1)
 
         for i in range(n+1):
@@ -427,6 +655,7 @@ class ApertureMacro:
         """
 
         pol, nverts, x, y, dia, angle = ApertureMacro.default2zero(6, mods)
+        nverts = int(nverts)
         points = [(0, 0)]*nverts
 
         for i in range(nverts):
@@ -465,13 +694,13 @@ class ApertureMacro:
             if r <= 0:
                 break
             ring = Point((x, y)).buffer(r).exterior.buffer(thickness/2.0)
-            result = cascaded_union([result, ring])
+            result = union_all([result, ring])
             i += 1
 
         ## Crosshair
         hor = LineString([(x - cross_len, y), (x + cross_len, y)]).buffer(cross_th/2.0, cap_style=2)
         ver = LineString([(x, y-cross_len), (x, y + cross_len)]).buffer(cross_th/2.0, cap_style=2)
-        result = cascaded_union([result, hor, ver])
+        result = union_all([result, hor, ver])
 
         return {"pol": 1, "geometry": result}
 
@@ -519,7 +748,13 @@ class ApertureMacro:
 
         ## Store modifiers as local variables
         modifiers = modifiers or []
-        modifiers = [float(m) for m in modifiers]
+        modifiers = tuple([float(m) for m in modifiers])
+
+        ## Made before with these modifiers?
+        if modifiers in self.geometry_cache:
+            self.geometry = self.geometry_cache[modifiers]
+            return self.geometry
+
         self.locvars = {}
         for i in range(0, len(modifiers)):
             self.locvars[str(i+1)] = modifiers[i]
@@ -545,6 +780,7 @@ class ApertureMacro:
                 self.geometry = self.geometry.difference(prim_geo['geometry'])
                 continue
 
+        self.geometry_cache[modifiers] = self.geometry
         return self.geometry
 
 
@@ -621,84 +857,38 @@ class Gerber (Geometry):
         self.ser_attrs += ['int_digits', 'frac_digits', 'apertures',
                            'aperture_macros', 'solid_geometry']
 
+        # Attributes resulting from parsing a file. These are
+        # what GeometryCache stores.
+        self.parsed_attrs = ['units', 'int_digits', 'frac_digits', 'apertures',
+                             'aperture_macros', 'solid_geometry']
+
         #### Parser patterns ####
+        # The source is split into blocks by ``Gerber.gerber_blocks()``
+        # and each block is dispatched on its leading letter(s), so
+        # these are only ever matched against a single command word
+        # without the trailing "*" and enclosing "%".
+
         # FS - Format Specification
         # The format of X and Y must be the same!
         # L-omit leading zeros, T-omit trailing zeros
         # A-absolute notation, I-incremental notation
-        self.fmt_re = re.compile(r'%FS([LT])([AI])X(\d)(\d)Y\d\d\*%$')
+        self.fmt_re = re.compile(r'^FS([LT])([AI])X(\d)(\d)Y\d\d$')
 
         # Mode (IN/MM)
-        self.mode_re = re.compile(r'^%MO(IN|MM)\*%$')
-
-        # Comment G04|G4
-        self.comm_re = re.compile(r'^G0?4(.*)$')
+        self.mode_re = re.compile(r'^MO(IN|MM)$')
 
         # AD - Aperture definition
-        self.ad_re = re.compile(r'^%ADD(\d\d+)([a-zA-Z0-9]*)(?:,(.*))?\*%$')
-
-        # AM - Aperture Macro
-        # Beginning of macro (Ends with *%):
-        self.am_re = re.compile(r'^%AM([a-zA-Z0-9]*)\*')
-
-        # Tool change
-        # May begin with G54 but that is deprecated
-        self.tool_re = re.compile(r'^(?:G54)?D(\d\d+)\*$')
-
-        # G01... - Linear interpolation plus flashes with coordinates
-        # Operation code (D0x) missing is deprecated... oh well I will support it.
-        self.lin_re = re.compile(r'^(?:G0?(1))?(?=.*X(-?\d+))?(?=.*Y(-?\d+))?[XY][^DIJ]*(?:D0?([123]))?\*$')
-
-        # Operation code alone, usually just D03 (Flash)
-        self.opcode_re = re.compile(r'^D0?([123])\*$')
-
-        # G02/3... - Circular interpolation with coordinates
-        # 2-clockwise, 3-counterclockwise
-        # Operation code (D0x) missing is deprecated... oh well I will support it.
-        # Optional start with G02 or G03, optional end with D01 or D02 with
-        # optional coordinates but at least one in any order.
-        self.circ_re = re.compile(r'^(?:G0?([23]))?(?=.*X(-?\d+))?(?=.*Y(-?\d+))' +
-                                  '?(?=.*I(-?\d+))?(?=.*J(-?\d+))?[XYIJ][^D]*(?:D0([12]))?\*$')
-
-        # G01/2/3 Occurring without coordinates
-        self.interp_re = re.compile(r'^(?:G0?([123]))\*')
-
-        # Single D74 or multi D75 quadrant for circular interpolation
-        self.quad_re = re.compile(r'^G7([45])\*$')
-
-        # Region mode on
-        # In region mode, D01 starts a region
-        # and D02 ends it. A new region can be started again
-        # with D01. All contours must be closed before
-        # D02 or G37.
-        self.regionon_re = re.compile(r'^G36\*$')
-
-        # Region mode off
-        # Will end a region and come off region mode.
-        # All contours must be closed before D02 or G37.
-        self.regionoff_re = re.compile(r'^G37\*$')
-
-        # End of file
-        self.eof_re = re.compile(r'^M02\*')
-
-        # IP - Image polarity
-        self.pol_re = re.compile(r'^%IP(POS|NEG)\*%$')
+        self.ad_re = re.compile(r'^ADD(\d\d+)([^,]*)(?:,(.*))?$')
 
         # LP - Level polarity
-        self.lpol_re = re.compile(r'^%LP([DC])\*%$')
-
-        # Units (OBSOLETE)
-        self.units_re = re.compile(r'^G7([01])\*$')
-
-        # Absolute/Relative G90/1 (OBSOLETE)
-        self.absrel_re = re.compile(r'^G9([01])\*$')
-
-        # Aperture macros
-        self.am1_re = re.compile(r'^%AM([^\*]+)\*(.+)?(%)?$')
-        self.am2_re = re.compile(r'(.*)%$')
+        self.lpol_re = re.compile(r'^LP([DC])$')
 
-        # TODO: This is bad.
-        self.steps_per_circ = 40
+        # Coordinate data: X, Y, I, J and D in the order required
+        # by the specification. Out-of-order words go through
+        # coordword_re instead.
+        self.coord_re = re.compile(r'^(?:X([+-]?\d+))?(?:Y([+-]?\d+))?' +
+                                   r'(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D0*(\d+))?$')
+        self.coordword_re = re.compile(r'([XYIJD])([+-]?\d+)')
 
     def scale(self, factor):
         """
@@ -724,6 +914,7 @@ class Gerber (Geometry):
         #  It's a cascaded union of objects.
         self.solid_geometry = affinity.scale(self.solid_geometry, factor,
                                              factor, origin=(0, 0))
+        self.changed()
 
         # # Now buffered_paths, flash_geometry and solid_geometry
         # self.create_geometry()
@@ -752,6 +943,7 @@ class Gerber (Geometry):
 
         ## Solid geometry
         self.solid_geometry = affinity.translate(self.solid_geometry, xoff=dx, yoff=dy)
+        self.changed()
 
     def mirror(self, axis, point):
         """
@@ -782,6 +974,7 @@ class Gerber (Geometry):
         #  It's a cascaded union of objects.
         self.solid_geometry = affinity.scale(self.solid_geometry,
                                              xscale, yscale, origin=(px, py))
+        self.changed()
 
     def aperture_parse(self, apertureId, apertureType, apParameters):
         """
@@ -847,28 +1040,104 @@ class Gerber (Geometry):
         log.warning("Aperture not implemented: %s" % str(apertureType))
         return None
         
-    def parse_file(self, filename):
+    def parse_file(self, filename, processes=1):
         """
-        Calls Gerber.parse_lines() with array of lines
-        read from the given file.
+        Calls Gerber.parse_lines() with the lines of the given
+        file as they are read. The file is read in chunks and
+        never held in memory as a whole. See ``file_lines()``.
 
         :param filename: Gerber file to parse.
         :type filename: str
+        :param processes: Number of processes creating the geometry.
+            See ``Gerber.parse_lines()``.
+        :type processes: int
         :return: None
         """
-        gfile = open(filename, 'r')
-        gstr = gfile.readlines()
-        gfile.close()
-        self.parse_lines(gstr)
+        # Gerber may come without line breaks. Long lines
+        # are handed over in pieces ending in a block.
+        self.parse_lines(file_lines(filename, split_long='*'), processes=processes)
 
-    def parse_lines(self, glines):
+    @staticmethod
+    def gerber_blocks(glines):
         """
-        Main Gerber parser. Reads Gerber and populates ``self.paths``, ``self.apertures``,
-        ``self.flashes``, ``self.regions`` and ``self.units``.
+        Splits Gerber source into blocks. Data blocks are terminated
+        by ``*`` and extended (parameter) blocks are enclosed in ``%``.
+        Blocks can share a line or span several lines.
+
+        :param glines: Gerber code as an iterable of strings, each element
+            being one line of the source file.
+        :type glines: iterable
+        :return: Generator of ``(line_num, block)`` tuples. Data blocks come
+            without the trailing ``*``. Extended blocks come with the leading
+            ``%`` and without the closing one, but keep the ``*`` separating
+            their commands.
+        """
+
+        buf = ""  # Part of a block carried over from previous lines.
+        extended = False  # Within %...%
+        line_num = 0
+
+        for gline in glines:
+            line_num += 1
+            gline = gline.strip()
+
+            ### Data blocks only. Most lines go through here.
+            if not extended and '%' not in gline:
+                parts = (buf + gline).split('*')
+                buf = parts.pop()
+                for part in parts:
+                    if part:
+                        yield line_num, part
+                continue
+
+            ### Extended blocks
+            pieces = gline.split('%')
+            for k in range(len(pieces)):
+                if k > 0:  # Crossed a %
+                    if extended:
+                        yield line_num, '%' + buf
+                    elif buf:
+                        log.warning("Unterminated block (%d): %s" % (line_num, buf))
+                    buf = ""
+                    extended = not extended
+
+                if extended:
+                    buf += pieces[k]
+                    continue
+
+                parts = (buf + pieces[k]).split('*')
+                buf = parts.pop()
+                for part in parts:
+                    if part:
+                        yield line_num, part
 
-        :param glines: Gerber code as list of strings, each element being
-            one line of the source file.
-        :type glines: list
+        if buf:
+            log.warning("Unterminated block at end of file: %s" % buf)
+            if not extended:
+                yield line_num, buf
+
+    def parse_lines(self, glines, processes=1):
+        """
+        Main Gerber parser. Reads Gerber and populates ``self.solid_geometry``,
+        ``self.apertures``, ``self.aperture_macros`` and ``self.units``.
+
+        The source is split into blocks by ``Gerber.gerber_blocks()`` and
+        every block is dispatched on its leading letters to the code that
+        handles it.
+
+        Parsing is done in two phases. The first goes through the source
+        in order, keeping track of the state, and records primitives:
+        tracks, regions and flashes for each polarity level. The second,
+        ``self.make_geometry()``, creates the geometry from the primitives,
+        which is where most of the time goes. This can be split among
+        ``processes`` worker processes.
+
+        :param glines: Gerber code as strings, each element being
+            one line of the source file. Can be any iterable, like
+            the generator returned by ``file_lines()``.
+        :type glines: iterable
+        :param processes: Number of processes creating the geometry.
+        :type processes: int
         :return: None
         :rtype: None
         """
@@ -876,12 +1145,18 @@ class Gerber (Geometry):
         # Coordinates of the current path, each is [x, y]
         path = []
 
-        # Polygons are stored here until there is a change in polarity.
-        # Only then they are combined via cascaded_union and added or
-        # subtracted from solid_geometry. This is ~100 times faster than
-        # applyng a union for every new polygon.
+        # Primitives of the current polarity level:
+        # ('track', width, path) and ('region', path).
+        # Their geometry is created by self.make_geometry().
         poly_buffer = []
 
+        # Flash locations [(x, y), ...] by aperture id
+        # for the current polarity level.
+        flashes = {}
+
+        # Every polarity level in order: (polarity, poly_buffer, flashes)
+        levels = []
+
         last_path_aperture = None
         current_aperture = None
 
@@ -904,399 +1179,550 @@ class Gerber (Geometry):
         # How to interpret circular interpolation: SINGLE or MULTI
         quadrant_mode = None
 
-        # Indicates we are parsing an aperture macro
-        current_macro = None
-
         # Indicates the current polarity: D-Dark, C-Clear
         current_polarity = 'D'
 
         # If a region is being defined
         making_region = False
 
-        #### Parsing starts here ####
-        line_num = 0
-        for gline in glines:
-            line_num += 1
-
-            ### Cleanup
-            gline = gline.strip(' \r\n')
+        # Aperture selected in a block with coordinates. It
+        # takes effect after the coordinates are done with.
+        next_aperture = None
 
-            ### Aperture Macros
-            # Having this at the beggining will slow things down
-            # but macros can have complicated statements than could
-            # be caught by other ptterns.
-            if current_macro is None:  # No macro started yet
-                match = self.am1_re.search(gline)
-                # Start macro if match, else not an AM, carry on.
-                if match:
-                    current_macro = match.group(1)
-                    self.aperture_macros[current_macro] = ApertureMacro(name=current_macro)
-                    if match.group(2):  # Append
-                        self.aperture_macros[current_macro].append(match.group(2))
-                    if match.group(3):  # Finish macro
-                        #self.aperture_macros[current_macro].parse_content()
-                        current_macro = None
+        #### Parsing starts here ####
+        for line_num, block in Gerber.gerber_blocks(glines):
+
+            if next_aperture is not None:
+                current_aperture = next_aperture
+                next_aperture = None
+
+            ### Extended blocks: %FS, %MO, %AD, %AM, %LP...
+            if block[0] == '%':
+
+                ## Aperture Macros
+                # The body of the macro is stored as is and
+                # the name is whatever comes before the first *.
+                # Example: %AMOC8*5,1,8,0,0,1.08239X$1,22.5*%
+                if block[1:3] == 'AM':
+                    name, _, body = block[3:].partition('*')
+                    self.aperture_macros[name] = ApertureMacro(name=name)
+                    self.aperture_macros[name].append(body)
                     continue
-            else:  # Continue macro
-                match = self.am2_re.search(gline)
-                if match:  # Finish macro
-                    self.aperture_macros[current_macro].append(match.group(1))
-                    #self.aperture_macros[current_macro].parse_content()
-                    current_macro = None
-                else:  # Append
-                    self.aperture_macros[current_macro].append(gline)
-                continue
-
-            ### G01 - Linear interpolation plus flashes
-            # Operation code (D0x) missing is deprecated... oh well I will support it.
-            # REGEX: r'^(?:G0?(1))?(?:X(-?\d+))?(?:Y(-?\d+))?(?:D0([123]))?\*$'
-            match = self.lin_re.search(gline)
-            if match:
-                # Dxx alone?
-                # if match.group(1) is None and match.group(2) is None and match.group(3) is None:
-                #     try:
-                #         current_operation_code = int(match.group(4))
-                #     except:
-                #         pass  # A line with just * will match too.
-                #     continue
-                # NOTE: Letting it continue allows it to react to the
-                #       operation code.
-
-                # Parse coordinates
-                if match.group(2) is not None:
-                    current_x = parse_gerber_number(match.group(2), self.frac_digits)
-                if match.group(3) is not None:
-                    current_y = parse_gerber_number(match.group(3), self.frac_digits)
-
-                # Parse operation code
-                if match.group(4) is not None:
-                    current_operation_code = int(match.group(4))
-
-                # Pen down: add segment
-                if current_operation_code == 1:
-                    path.append([current_x, current_y])
-                    last_path_aperture = current_aperture
-
-                elif current_operation_code == 2:
-                    if len(path) > 1:
 
-                        ## --- BUFFERED ---
-                        if making_region:
-                            geo = Polygon(path)
-                        else:
-                            if last_path_aperture is None:
-                                log.warning("No aperture defined for curent path. (%d)" % line_num)
-                            width = self.apertures[last_path_aperture]["size"]
-                            geo = LineString(path).buffer(width/2)
-                        poly_buffer.append(geo)
-
-                    path = [[current_x, current_y]]  # Start new path
-
-                # Flash
-                elif current_operation_code == 3:
-
-                    # --- BUFFERED ---
-                    flash = Gerber.create_flash_geometry(Point([current_x, current_y]),
-                                                         self.apertures[current_aperture])
-                    poly_buffer.append(flash)
+                # There can be several commands in one block.
+                for param in block[1:].split('*'):
+                    if not param:
+                        continue
+                    code = param[:2]
+
+                    ## Aperture definitions
+                    # Example: %ADD11C,0.1*%
+                    if code == 'AD':
+                        match = self.ad_re.search(param)
+                        if match:
+                            self.aperture_parse(match.group(1), match.group(2), match.group(3))
+                            continue
+
+                    ## Polarity change
+                    # Example: %LPD*% or %LPC*%
+                    elif code == 'LP':
+                        match = self.lpol_re.search(param)
+                        if match:
+                            if current_polarity == match.group(1):
+                                continue
+
+                            if len(path) > 1:
+                                # --- Buffered ----
+                                width = self.apertures[last_path_aperture]["size"]
+                                poly_buffer.append(('track', width, path))
+
+                                path = [path[-1]]
+
+                            # --- Apply buffer ---
+                            levels.append((current_polarity, poly_buffer, flashes))
+                            poly_buffer = []
+                            flashes = {}
+
+                            current_polarity = match.group(1)
+                            continue
+
+                    ## Number format
+                    # Example: %FSLAX24Y24*%
+                    # TODO: This is ignoring most of the format. Implement the rest.
+                    elif code == 'FS':
+                        match = self.fmt_re.search(param)
+                        if match:
+                            absolute = match.group(2) == 'A'
+                            self.int_digits = int(match.group(3))
+                            self.frac_digits = int(match.group(4))
+                            continue
+
+                    ## Mode (IN/MM)
+                    # Example: %MOIN*%
+                    elif code == 'MO':
+                        match = self.mode_re.search(param)
+                        if match:
+                            self.set_units(match.group(1))
+                            continue
+
+                    log.warning("Line ignored (%d): %%%s*%%" % (line_num, param))
 
                 continue
 
-            ### G02/3 - Circular interpolation
-            # 2-clockwise, 3-counterclockwise
-            match = self.circ_re.search(gline)
-            if match:
-
-                mode, x, y, i, j, d = match.groups()
-                try:
-                    x = parse_gerber_number(x, self.frac_digits)
-                except:
-                    x = current_x
-                try:
-                    y = parse_gerber_number(y, self.frac_digits)
-                except:
-                    y = current_y
-                try:
-                    i = parse_gerber_number(i, self.frac_digits)
-                except:
-                    i = 0
+            ### G-codes
+            # Can be alone, as in G01* or G36*, or be followed by
+            # coordinate data, as in G01X100Y200D01* or G54D10*.
+            if block[0] == 'G':
+                n = 1
+                while n < len(block) and block[n].isdigit():
+                    n += 1
                 try:
-                    j = parse_gerber_number(j, self.frac_digits)
-                except:
-                    j = 0
-
-                if quadrant_mode is None:
-                    log.error("Found arc without preceding quadrant specification G74 or G75. (%d)" % line_num)
-                    log.error(gline)
+                    gcode = int(block[1:n])
+                except ValueError:
+                    log.warning("Line ignored (%d): %s" % (line_num, block))
                     continue
 
-                if mode is None and current_interpolation_mode not in [2, 3]:
-                    log.error("Found arc without circular interpolation mode defined. (%d)" % line_num)
-                    log.error(gline)
+                ## G04 - Comment
+                if gcode == 4:
                     continue
-                elif mode is not None:
-                    current_interpolation_mode = int(mode)
 
-                # Set operation code if provided
-                if d is not None:
-                    current_operation_code = int(d)
+                ## G01/2/3 - Interpolation mode
+                if gcode in (1, 2, 3):
+                    current_interpolation_mode = gcode
 
-                # Nothing created! Pen Up.
-                if current_operation_code == 2:
-                    log.warning("Arc with D2. (%d)" % line_num)
+                ## G36 - Begin region
+                elif gcode == 36:
                     if len(path) > 1:
-                        if last_path_aperture is None:
-                            log.warning("No aperture defined for curent path. (%d)" % line_num)
+                        # Take care of what is left in the path
 
-                        # --- BUFFERED ---
+                        ## --- Buffered ---
                         width = self.apertures[last_path_aperture]["size"]
-                        buffered = LineString(path).buffer(width/2)
-                        poly_buffer.append(buffered)
+                        poly_buffer.append(('track', width, path))
 
-                    current_x = x
-                    current_y = y
-                    path = [[current_x, current_y]]  # Start new path
-                    continue
+                        path = [path[-1]]
 
-                # Flash should not happen here
-                if current_operation_code == 3:
-                    log.error("Trying to flash within arc. (%d)" % line_num)
-                    continue
+                    making_region = True
 
-                if quadrant_mode == 'MULTI':
-                    center = [i + current_x, j + current_y]
-                    radius = sqrt(i**2 + j**2)
-                    start = arctan2(-j, -i)
-                    stop = arctan2(-center[1] + y, -center[0] + x)
-                    arcdir = [None, None, "cw", "ccw"]
-                    this_arc = arc(center, radius, start, stop,
-                                   arcdir[current_interpolation_mode],
-                                   self.steps_per_circ)
+                ## G37 - End region
+                elif gcode == 37:
+                    making_region = False
 
-                    # Last point in path is current point
-                    current_x = this_arc[-1][0]
-                    current_y = this_arc[-1][1]
+                    # Only one path defines region?
+                    # This can happen if D02 happened before G37 and
+                    # is not and error.
+                    if len(path) >= 3:
+                        # --- Buffered ---
+                        poly_buffer.append(('region', path))
 
-                    # Append
-                    path += this_arc
+                        path = [[current_x, current_y]]  # Start new path
 
-                    last_path_aperture = current_aperture
+                ## G74/75 - Single or multiple quadrant arcs
+                elif gcode in (74, 75):
+                    quadrant_mode = {74: 'SINGLE', 75: 'MULTI'}[gcode]
 
-                    continue
+                ## G70/1 - Units OBSOLETE
+                elif gcode in (70, 71):
+                    self.set_units({70: 'IN', 71: 'MM'}[gcode])
 
-                if quadrant_mode == 'SINGLE':
-                    log.warning("Single quadrant arc are not implemented yet. (%d)" % line_num)
+                ## G90/1 - Absolute/relative coordinates OBSOLETE
+                elif gcode in (90, 91):
+                    absolute = gcode == 90
 
-            ### Operation code alone
-            match = self.opcode_re.search(gline)
-            if match:
-                current_operation_code = int(match.group(1))
-                if current_operation_code == 3:
+                ## G54/55 - Aperture select/flash prefixes OBSOLETE
+                elif gcode not in (54, 55):
+                    log.warning("Line ignored (%d): %s" % (line_num, block))
+                    continue
 
-                    ## --- Buffered ---
-                    flash = Gerber.create_flash_geometry(Point(path[-1]),
-                                                         self.apertures[current_aperture])
-                    poly_buffer.append(flash)
+                block = block[n:]
+                if not block:
+                    continue
 
+            ### M02 - End of file, M00/M01 - Stops (Ignored)
+            if block[0] == 'M':
+                if block[1:] not in ('02', '2', '00', '0', '01', '1'):
+                    log.warning("Line ignored (%d): %s" % (line_num, block))
                 continue
 
-            ### G74/75* - Single or multiple quadrant arcs
-            match = self.quad_re.search(gline)
+            ### Coordinate data and D-codes
+            match = self.coord_re.search(block)
             if match:
-                if match.group(1) == '4':
-                    quadrant_mode = 'SINGLE'
+                x, y, i, j, d = match.groups()
+            else:
+                words = dict(self.coordword_re.findall(block))
+                if len(words) == 0:
+                    log.warning("Line ignored (%d): %s" % (line_num, block))
+                    continue
+                x, y, i, j, d = [words.get(w) for w in "XYIJD"]
+
+            if d is not None:
+                d = int(d)
+
+                ## Tool/aperture change
+                # Example: D12*
+                # With coordinates, as in X100Y200D12*, these are
+                # done first with the current operation code.
+                if d >= 10:
+                    if x is None and y is None and i is None and j is None:
+                        current_aperture = str(d)
+                        continue
+                    next_aperture = str(d)
                 else:
-                    quadrant_mode = 'MULTI'
-                continue
+                    current_operation_code = d
 
-            ### G36* - Begin region
-            if self.regionon_re.search(gline):
-                if len(path) > 1:
-                    # Take care of what is left in the path
+            ## Operation code alone, usually just D03 (Flash)
+            if x is None and y is None and i is None and j is None:
+                if current_operation_code == 3:
 
                     ## --- Buffered ---
-                    width = self.apertures[last_path_aperture]["size"]
-                    geo = LineString(path).buffer(width/2)
-                    poly_buffer.append(geo)
-
-                    path = [path[-1]]
+                    flashes.setdefault(current_aperture, []).append((current_x, current_y))
 
-                making_region = True
                 continue
 
-            ### G37* - End region
-            if self.regionoff_re.search(gline):
-                making_region = False
-
-                # Only one path defines region?
-                # This can happen if D02 happened before G37 and
-                # is not and error.
-                if len(path) < 3:
-                    # print "ERROR: Path contains less than 3 points:"
-                    # print path
-                    # print "Line (%d): " % line_num, gline
-                    # path = []
-                    #path = [[current_x, current_y]]
-                    continue
+            ## Linear interpolation plus flashes
+            # Operation code (D0x) missing is deprecated... oh well I will support it.
+            # I and J are ignored in G01 mode.
+            if (i is None and j is None) or current_interpolation_mode not in [2, 3]:
+                if x is not None:
+                    current_x = parse_gerber_number(x, self.frac_digits)
+                if y is not None:
+                    current_y = parse_gerber_number(y, self.frac_digits)
+
+                # Pen down: add segment
+                if current_operation_code == 1:
+                    path.append([current_x, current_y])
+                    last_path_aperture = current_aperture
+
+                elif current_operation_code == 2:
+                    if len(path) > 1:
 
-                # For regions we may ignore an aperture that is None
-                # self.regions.append({"polygon": Polygon(path),
-                #                      "aperture": last_path_aperture})
+                        ## --- BUFFERED ---
+                        if making_region:
+                            poly_buffer.append(('region', path))
+                        else:
+                            if last_path_aperture is None:
+                                log.warning("No aperture defined for curent path. (%d)" % line_num)
+                            width = self.apertures[last_path_aperture]["size"]
+                            poly_buffer.append(('track', width, path))
 
-                # --- Buffered ---
-                region = Polygon(path)
-                if not region.is_valid:
-                    region = region.buffer(0)
-                poly_buffer.append(region)
+                    path = [[current_x, current_y]]  # Start new path
 
-                path = [[current_x, current_y]]  # Start new path
-                continue
-            
-            ### Aperture definitions %ADD...
-            match = self.ad_re.search(gline)
-            if match:
-                self.aperture_parse(match.group(1), match.group(2), match.group(3))
-                continue
+                # Flash
+                elif current_operation_code == 3:
+
+                    # --- BUFFERED ---
+                    flashes.setdefault(current_aperture, []).append((current_x, current_y))
 
-            ### G01/2/3* - Interpolation mode change
-            # Can occur along with coordinates and operation code but
-            # sometimes by itself (handled here).
-            # Example: G01*
-            match = self.interp_re.search(gline)
-            if match:
-                current_interpolation_mode = int(match.group(1))
                 continue
 
-            ### Tool/aperture change
-            # Example: D12*
-            match = self.tool_re.search(gline)
-            if match:
-                current_aperture = match.group(1)
+            ## G02/3 - Circular interpolation
+            # 2-clockwise, 3-counterclockwise
+            x = parse_gerber_number(x, self.frac_digits) if x is not None else current_x
+            y = parse_gerber_number(y, self.frac_digits) if y is not None else current_y
+            i = parse_gerber_number(i, self.frac_digits) if i is not None else 0
+            j = parse_gerber_number(j, self.frac_digits) if j is not None else 0
+
+            if quadrant_mode is None:
+                log.error("Found arc without preceding quadrant specification G74 or G75. (%d)" % line_num)
+                log.error(block)
                 continue
 
-            ### Polarity change
-            # Example: %LPD*% or %LPC*%
-            match = self.lpol_re.search(gline)
-            if match:
-                if len(path) > 1 and current_polarity != match.group(1):
+            # Nothing created! Pen Up.
+            if current_operation_code == 2:
+                log.warning("Arc with D2. (%d)" % line_num)
+                if len(path) > 1:
+                    if last_path_aperture is None:
+                        log.warning("No aperture defined for curent path. (%d)" % line_num)
 
-                    # --- Buffered ----
+                    # --- BUFFERED ---
                     width = self.apertures[last_path_aperture]["size"]
-                    geo = LineString(path).buffer(width/2)
-                    poly_buffer.append(geo)
+                    poly_buffer.append(('track', width, path))
 
-                    path = [path[-1]]
-
-                # --- Apply buffer ---
-                if current_polarity == 'D':
-                    self.solid_geometry = self.solid_geometry.union(cascaded_union(poly_buffer))
-                else:
-                    self.solid_geometry = self.solid_geometry.difference(cascaded_union(poly_buffer))
-                poly_buffer = []
-
-                current_polarity = match.group(1)
+                current_x = x
+                current_y = y
+                path = [[current_x, current_y]]  # Start new path
                 continue
 
-            ### Number format
-            # Example: %FSLAX24Y24*%
-            # TODO: This is ignoring most of the format. Implement the rest.
-            match = self.fmt_re.search(gline)
-            if match:
-                absolute = {'A': True, 'I': False}
-                self.int_digits = int(match.group(3))
-                self.frac_digits = int(match.group(4))
+            # Flash should not happen here
+            if current_operation_code == 3:
+                log.error("Trying to flash within arc. (%d)" % line_num)
                 continue
 
-            ### Mode (IN/MM)
-            # Example: %MOIN*%
-            match = self.mode_re.search(gline)
-            if match:
-                self.units = match.group(1)
-                continue
+            if quadrant_mode == 'MULTI':
+                center = [i + current_x, j + current_y]
+                radius = sqrt(i**2 + j**2)
+                start = arctan2(-j, -i)
+                stop = arctan2(-center[1] + y, -center[0] + x)
+                arcdir = [None, None, "cw", "ccw"]
+                this_arc = arc(center, radius, start, stop,
+                               arcdir[current_interpolation_mode],
+                               self.arc_tolerance)
 
-            ### Units (G70/1) OBSOLETE
-            match = self.units_re.search(gline)
-            if match:
-                self.units = {'0': 'IN', '1': 'MM'}[match.group(1)]
-                continue
+                # Last point in path is current point
+                current_x = this_arc[-1][0]
+                current_y = this_arc[-1][1]
 
-            ### Absolute/relative coordinates G90/1 OBSOLETE
-            match = self.absrel_re.search(gline)
-            if match:
-                absolute = {'0': True, '1': False}[match.group(1)]
-                continue
+                # Append
+                path += this_arc
 
-            #### Ignored lines
-            ## Comments
-            match = self.comm_re.search(gline)
-            if match:
-                continue
+                last_path_aperture = current_aperture
 
-            ## EOF
-            match = self.eof_re.search(gline)
-            if match:
                 continue
 
-            ### Line did not match any pattern. Warn user.
-            log.warning("Line ignored (%d): %s" % (line_num, gline))
-        
+            if quadrant_mode == 'SINGLE':
+                log.warning("Single quadrant arc are not implemented yet. (%d)" % line_num)
+
         if len(path) > 1:
             # EOF, create shapely LineString if something still in path
 
             ## --- Buffered ---
             width = self.apertures[last_path_aperture]["size"]
-            geo = LineString(path).buffer(width/2)
-            poly_buffer.append(geo)
+            poly_buffer.append(('track', width, path))
 
         # --- Apply buffer ---
-        if current_polarity == 'D':
-            self.solid_geometry = self.solid_geometry.union(cascaded_union(poly_buffer))
+        levels.append((current_polarity, poly_buffer, flashes))
+
+        #### Second phase: Geometry ####
+        self.solid_geometry = self.compose_layers(self.make_geometry(levels, processes=processes))
+
+    def make_geometry(self, levels, processes=1, chunk_size=2000):
+        """
+        Creates the geometry of the primitives recorded by
+        ``self.parse_lines()`` for each polarity level.
+
+        When running in parallel, the primitives of a level are split
+        into vertical strips of about ``chunk_size`` primitives or flashes
+        each, at most one strip per process, and ``gerber_geometry()``
+        creates the union of each strip in a pool of ``processes``
+        worker processes. Strips barely overlap, so joining them at the
+        end is cheap. Otherwise each level is done in one piece.
+
+        :param levels: List of (polarity, primitives, flashes). See
+            ``self.parse_lines()``.
+        :type levels: list
+        :param processes: Number of worker processes.
+        :type processes: int
+        :param chunk_size: Least number of primitives or flashes
+            in a strip.
+        :type chunk_size: int
+        :return: List of (polarity, geometry) for ``self.compose_layers()``.
+        :rtype: list
+        """
+
+        ## The shape of each aperture is made only once.
+        templates = {}
+        for polarity, primitives, flashes in levels:
+            for apid in flashes:
+                if apid not in templates:
+                    templates[apid] = Gerber.aperture_geometry(self.apertures[apid])
+                    if templates[apid] is None:
+                        log.warning("Cannot flash aperture: %s" % str(apid))
+
+        ## Work for each level, in strips if in parallel.
+        chunks = []  # Lists of primitives
+        chunk_level = []  # Level of each chunk
+        for i in range(len(levels)):
+            polarity, primitives, flashes = levels[i]
+
+            count = len(primitives) + sum([len(flashes[apid]) for apid in flashes])
+            nstrips = min(processes, int(ceil(float(count) / chunk_size)))
+            if nstrips <= 1:
+                chunks.append(primitives + [('flash', templates[apid], flashes[apid])
+                                            for apid in flashes])
+                chunk_level.append(i)
+                continue
+
+            # Strip limits so every strip gets about the same
+            # number of primitives, by their first x coordinate.
+            xs = [prim[-1][0][0] for prim in primitives]
+            for apid in flashes:
+                xs += [x for x, y in flashes[apid]]
+            xs.sort()
+            limits = [xs[count * k // nstrips] for k in range(1, nstrips)]
+
+            strips = [[] for k in range(nstrips)]
+            for prim in primitives:
+                strips[bisect.bisect(limits, prim[-1][0][0])].append(prim)
+            for apid in flashes:
+                locations = [[] for k in range(nstrips)]
+                for loc in flashes[apid]:
+                    locations[bisect.bisect(limits, loc[0])].append(loc)
+                for k in range(nstrips):
+                    if len(locations[k]) > 0:
+                        strips[k].append(('flash', templates[apid], locations[k]))
+
+            chunks += strips
+            chunk_level += [i] * nstrips
+
+        ## Create
+        if processes > 1 and len(chunks) > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(gerber_geometry, chunks)
+            finally:
+                pool.close()
+                pool.join()
         else:
-            self.solid_geometry = self.solid_geometry.difference(cascaded_union(poly_buffer))
+            results = [gerber_geometry(chunk) for chunk in chunks]
+
+        ## Union the chunks of each level
+        geometry = [[] for level in levels]
+        for i in range(len(results)):
+            geometry[chunk_level[i]].append(results[i])
+
+        for i in range(len(levels)):
+            if len(geometry[i]) == 1:
+                geometry[i] = geometry[i][0]
+            else:
+                geometry[i] = union_all(geometry[i])
+
+        return [(levels[i][0], geometry[i]) for i in range(len(levels))]
+
+    def compose_layers(self, layers):
+        """
+        Combines ``self.solid_geometry`` with polarity levels. Dark
+        levels are added and clear levels removed from everything that
+        came before them.
+
+        The polygons of each dark level, already unioned by
+        ``self.make_geometry()``, are kept apart in a ``GridIndex``.
+        Each polygon of a clear level is matched only against the
+        polygons whose bounds it overlaps, and all that must be removed
+        from a polygon is removed at once at the end, since removing
+        several clear levels one after the other is the same as removing
+        their union. Only polygons whose bounds overlap are then unioned,
+        pairing neighbouring levels until one is left. Polygons of the
+        same level never overlap, so each of these unions is a single
+        overlay, and the rest of the board is left as it is.
+
+        :param layers: List of (polarity, geometry) in the order they
+            appear in the file. Polarity is "D" (dark) or "C" (clear).
+        :type layers: list
+        :return: The resulting geometry.
+        :rtype: Shapely.Polygon or Shapely.MultiPolygon
+        """
+
+        layers = [(polarity, geo) for polarity, geo in [('D', self.solid_geometry)] + layers
+                  if not geo.is_empty]
+
+        ## Nothing to compose
+        if len(layers) == 0:
+            return Polygon()
+        if len(layers) == 1 and layers[0][0] == 'D':
+            return layers[0][1]
+
+        ## Index cell size from the overall size of the geometry.
+        bounds = [geo.bounds for polarity, geo in layers]
+        size = max(max([b[2] for b in bounds]) - min([b[0] for b in bounds]),
+                   max([b[3] for b in bounds]) - min([b[1] for b in bounds]))
+
+        index = GridIndex(size / 64.0 or 1.0)
+        pieces = []  # (level, polygon). Their index is the key in the GridIndex.
+        clears = []  # Clear polygons hitting each piece.
+
+        for level in range(len(layers)):
+            polarity, geo = layers[level]
+            if polarity == 'D':
+                for poly in polygons_of(geo):
+                    index.insert(len(pieces), poly.bounds)
+                    pieces.append((level, poly))
+                    clears.append([])
+                continue
+
+            for clear in polygons_of(geo):
+                for key in index.intersection(clear.bounds):
+                    clears[key].append(clear)
+
+        for key in range(len(pieces)):
+            if len(clears[key]) > 0:
+                level, poly = pieces[key]
+                pieces[key] = (level, poly.difference(union_all(clears[key])))
+
+        ## Groups of pieces with overlapping bounds
+        parent = list(range(len(pieces)))
+
+        def root(key):
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for key in range(len(pieces)):
+            for other in index.intersection(index.bounds[key]):
+                parent[root(other)] = root(key)
+
+        groups = {}  # Root -> {level: [polygons]}
+        for key in range(len(pieces)):
+            level, poly = pieces[key]
+            groups.setdefault(root(key), {}).setdefault(level, []).extend(polygons_of(poly))
+
+        def collect(polygons):
+            # Making a MultiPolygon copies the coordinates.
+            if len(polygons) == 1:
+                return polygons[0]
+            return MultiPolygon(polygons)
+
+        result = []  # Geometry of each group
+        for group in groups.values():
+            # Union of the levels, pairing neighbours until one is left.
+            geos = [collect(group[level]) for level in sorted(group) if len(group[level]) > 0]
+            while len(geos) > 1:
+                geos = [geos[i].union(geos[i + 1]) if i + 1 < len(geos) else geos[i]
+                        for i in range(0, len(geos), 2)]
+            result += geos
+
+        if len(result) == 0:
+            return Polygon()
+        if len(result) == 1:
+            return result[0]
+
+        polygons = []
+        for geo in result:
+            polygons += polygons_of(geo)
+        return collect(polygons)
 
     @staticmethod
-    def create_flash_geometry(location, aperture):
+    def aperture_geometry(aperture):
+        """
+        Creates the shape of an aperture centered at the origin.
+        Flashes are copies of this shape moved to the flash location,
+        so it only needs to be created once per aperture.
 
-        if type(location) == list:
-            location = Point(location)
+        :param aperture: Aperture definition. See ``apertures``.
+        :type aperture: dict
+        :return: The shape of the aperture or None if not supported.
+        :rtype: Shapely.Polygon
+        """
 
         if aperture['type'] == 'C':  # Circles
-            return location.buffer(aperture['size']/2)
+            return Point(0, 0).buffer(aperture['size']/2)
 
         if aperture['type'] == 'R':  # Rectangles
-            loc = location.coords[0]
             width = aperture['width']
             height = aperture['height']
-            minx = loc[0] - width/2
-            maxx = loc[0] + width/2
-            miny = loc[1] - height/2
-            maxy = loc[1] + height/2
-            return shply_box(minx, miny, maxx, maxy)
+            return shply_box(-width/2, -height/2, width/2, height/2)
 
         if aperture['type'] == 'O':  # Obround
-            loc = location.coords[0]
             width = aperture['width']
             height = aperture['height']
             if width > height:
-                p1 = Point(loc[0] + 0.5*(width-height), loc[1])
-                p2 = Point(loc[0] - 0.5*(width-height), loc[1])
+                p1 = Point(0.5*(width-height), 0)
+                p2 = Point(-0.5*(width-height), 0)
                 c1 = p1.buffer(height*0.5)
                 c2 = p2.buffer(height*0.5)
             else:
-                p1 = Point(loc[0], loc[1] + 0.5*(height-width))
-                p2 = Point(loc[0], loc[1] - 0.5*(height-width))
+                p1 = Point(0, 0.5*(height-width))
+                p2 = Point(0, -0.5*(height-width))
                 c1 = p1.buffer(width*0.5)
                 c2 = p2.buffer(width*0.5)
-            return cascaded_union([c1, c2]).convex_hull
+            return union_all([c1, c2]).convex_hull
 
         if aperture['type'] == 'P':  # Regular polygon
-            loc = location.coords[0]
             diam = aperture['diam']
             n_vertices = aperture['nVertices']
             points = []
             for i in range(0, n_vertices):
-                x = loc[0] + diam * (cos(2 * pi * i / n_vertices))
-                y = loc[1] + diam * (sin(2 * pi * i / n_vertices))
+                x = diam * (cos(2 * pi * i / n_vertices))
+                y = diam * (sin(2 * pi * i / n_vertices))
                 points.append((x, y))
             ply = Polygon(points)
             if 'rotation' in aperture:
@@ -1304,12 +1730,69 @@ class Gerber (Geometry):
             return ply
 
         if aperture['type'] == 'AM':  # Aperture Macro
-            loc = location.coords[0]
-            flash_geo = aperture['macro'].make_geometry(aperture['modifiers'])
-            return affinity.translate(flash_geo, xoff=loc[0], yoff=loc[1])
+            return aperture['macro'].make_geometry(aperture['modifiers'])
 
         return None
-    
+
+    @staticmethod
+    def create_flash_geometry(location, aperture):
+        """
+        Creates the geometry of a single flash. When flashing
+        an aperture many times use ``Gerber.flash_instances()``.
+
+        :param location: Center of the flash.
+        :type location: Shapely.Point or list
+        :param aperture: Aperture definition. See ``apertures``.
+        :type aperture: dict
+        :return: The flashed shape or None if not supported.
+        """
+
+        if type(location) == list:
+            location = Point(location)
+
+        flash_geo = Gerber.aperture_geometry(aperture)
+        if flash_geo is None:
+            return None
+
+        loc = location.coords[0]
+        return affinity.translate(flash_geo, xoff=loc[0], yoff=loc[1])
+
+    @staticmethod
+    def flash_instances(template, locations):
+        """
+        Copies of ``template`` moved to each of the ``locations``.
+        The coordinates of all copies are computed at once by
+        adding the locations to the template's coordinate arrays.
+
+        :param template: Shape of the aperture centered at the origin.
+            See ``Gerber.aperture_geometry()``.
+        :type template: Shapely.Polygon or Shapely.MultiPolygon
+        :param locations: Flash locations, each is (x, y).
+        :type locations: list
+        :return: List of Shapely.Polygon
+        :rtype: list
+        """
+
+        if template is None or template.is_empty or len(locations) == 0:
+            return []
+
+        if type(template) == Polygon:
+            parts = [template]
+        elif type(template) == MultiPolygon:
+            parts = list(template.geoms)
+        else:
+            return [affinity.translate(template, xoff=x, yoff=y) for x, y in locations]
+
+        offsets = array(locations, dtype=float)[:, newaxis, :]
+        instances = []
+        for part in parts:
+            exteriors = array(part.exterior.coords)[newaxis, :, :] + offsets
+            interiors = [array(ring.coords)[newaxis, :, :] + offsets for ring in part.interiors]
+            for i in range(len(offsets)):
+                instances.append(Polygon(exteriors[i], [ring[i] for ring in interiors]))
+
+        return instances
+
     def create_geometry(self):
         """
         Geometry from a Gerber file is made up entirely of polygons.
@@ -1366,14 +1849,11 @@ class Excellon(Geometry):
     Others            Not supported (Ignored).
     ================  ====================================
 
-    * ``drills`` (list): Each is a dictionary:
-
-    ================  ====================================
-    Key               Value
-    ================  ====================================
-    point             (Shapely.Point) Where to drill
-    tool              (str) A key in ``tools``
-    ================  ====================================
+    * ``drills`` (dict): The key is the tool name, a key in
+      ``tools``, and the value is a NumPy array of shape (n, 2)
+      with the coordinates of the n places to drill with it.
+      Transformations work on whole arrays. Arrays are replaced,
+      never modified in place.
     """
 
     def __init__(self):
@@ -1388,7 +1868,7 @@ class Excellon(Geometry):
         
         self.tools = {}
         
-        self.drills = []
+        self.drills = {}
 
         # Trailing "T" or leading "L" (default)
         self.zeros = "L"
@@ -1398,6 +1878,11 @@ class Excellon(Geometry):
         # from Geometry.
         self.ser_attrs += ['tools', 'drills', 'zeros']
 
+        # Attributes resulting from parsing a file. These are
+        # what GeometryCache stores. The geometry is cheap
+        # to create again, see create_geometry().
+        self.parsed_attrs = ['units', 'tools', 'drills', 'zeros']
+
         #### Patterns ####
         # Regex basics:
         # ^ - beginning
@@ -1468,24 +1953,22 @@ class Excellon(Geometry):
         
     def parse_file(self, filename):
         """
-        Reads the specified file as array of lines as
-        passes it to ``parse_lines()``.
+        Passes the lines of the specified file to ``parse_lines()``
+        as they are read. The file is read in chunks and never held
+        in memory as a whole. See ``file_lines()``.
 
         :param filename: The file to be read and parsed.
         :type filename: str
         :return: None
         """
-        efile = open(filename, 'r')
-        estr = efile.readlines()
-        efile.close()
-        self.parse_lines(estr)
+        self.parse_lines(file_lines(filename))
 
     def parse_lines(self, elines):
         """
         Main Excellon parser.
 
-        :param elines: List of strings, each being a line of Excellon code.
-        :type elines: list
+        :param elines: Strings, each being a line of Excellon code.
+        :type elines: iterable
         :return: None
         """
 
@@ -1495,6 +1978,9 @@ class Excellon(Geometry):
         current_x = None
         current_y = None
 
+        # Drill coordinates by tool, [x0, y0, x1, y1, ...]
+        drills = {}
+
         line_num = 0  # Line number
         for eline in elines:
             line_num += 1
@@ -1541,7 +2027,7 @@ class Excellon(Geometry):
                         log.error("Missing coordinates")
                         continue
 
-                    self.drills.append({'point': Point((x, y)), 'tool': current_tool})
+                    drills.setdefault(current_tool, []).extend((x, y))
                     continue
 
                 ## Coordinates with period: Use literally. ##
@@ -1563,7 +2049,7 @@ class Excellon(Geometry):
                         log.error("Missing coordinates")
                         continue
 
-                    self.drills.append({'point': Point((x, y)), 'tool': current_tool})
+                    drills.setdefault(current_tool, []).extend((x, y))
                     continue
 
             #### Header ####
@@ -1588,12 +2074,63 @@ class Excellon(Geometry):
                 match = self.units_re.match(eline)
                 if match:
                     self.zeros = match.group(2)  # "T" or "L"
-                    self.units = {"INCH": "IN", "METRIC": "MM"}[match.group(1)]
+                    self.set_units({"INCH": "IN", "METRIC": "MM"}[match.group(1)])
                     continue
 
             log.warning("Line ignored: %s" % eline)
-        
-    def parse_number(self, number_str):
+
+        self.drills = dict([(tool, array(drills[tool], dtype=float).reshape(-1, 2))
+                            for tool in drills])
+
+    @staticmethod
+    def drills_from_list(drill_list):
+        """
+        Drills in the format of ``Excellon.drills`` from a list of
+        ``{'point': Shapely.Point, 'tool': str}``, as in projects
+        saved by older versions.
+
+        :param drill_list: List of drills.
+        :type drill_list: list
+        :return: Drills by tool.
+        :rtype: dict
+        """
+        coords = {}
+        for drill in drill_list:
+            coords.setdefault(drill['tool'], []).extend(drill['point'].coords[0][:2])
+        return dict([(tool, array(coords[tool], dtype=float).reshape(-1, 2))
+                     for tool in coords])
+
+    def from_dict(self, d):
+        """
+        Like ``Geometry.from_dict()``. Converts drills from
+        projects saved by older versions.
+
+        :param d: Dictionary of attributes to set in the object.
+        :type d: dict
+        :return: None
+        """
+        Geometry.from_dict(self, d)
+
+        if type(self.drills) == list:
+            self.drills = Excellon.drills_from_list(self.drills)
+
+    def drill_points(self, tools=None):
+        """
+        Coordinates of the drills with the given tools.
+
+        :param tools: Tool names. All if None.
+        :type tools: list
+        :return: Array of shape (n, 2), in the order of ``tools``.
+        :rtype: numpy.ndarray
+        """
+        if tools is None:
+            tools = sorted(self.drills.keys())
+        arrays = [self.drills[tool] for tool in tools if tool in self.drills]
+        if len(arrays) == 0:
+            return empty((0, 2))
+        return concatenate(arrays)
+
+    def parse_number(self, number_str):
         """
         Parses coordinate numbers without period.
 
@@ -1611,17 +2148,65 @@ class Excellon(Geometry):
     def create_geometry(self):
         """
         Creates circles of the tool diameter at every point
-        specified in ``self.drills``.
+        specified in ``self.drills``. This is deferred until
+        ``self.solid_geometry`` is used. See ``drill_geometry()``.
 
         :return: None
         """
-        self.solid_geometry = []
+        # Using them loads any attributes still pending
+        # from a project before replacing what is deferred.
+        tools = self.tools
+        drills = self.drills
+
+        self.set_lazy(['solid_geometry'],
+                      lambda: {'solid_geometry': Excellon.drill_geometry(tools, drills)})
+
+    @staticmethod
+    def drill_geometry(tools, drills):
+        """
+        Circles of the tool diameter at every drill. There is a
+        single circle for each diameter, copied to each place
+        with ``Gerber.flash_instances()``.
+
+        :param tools: See ``Excellon.tools``.
+        :type tools: dict
+        :param drills: See ``Excellon.drills``.
+        :type drills: dict
+        :return: List of Shapely.Polygon
+        :rtype: list
+        """
+        templates = {}
+        geometry = []
+        for tool in sorted(drills.keys()):
+            dia = tools[tool]['C']
+            if dia not in templates:
+                templates[dia] = Point(0, 0).buffer(dia/2.0)
+            geometry += Gerber.flash_instances(templates[dia], drills[tool])
+        return geometry
+
+    def bounds(self):
+        """
+        Returns coordinates of rectangular bounds
+        of the drill holes, from the drills without
+        creating their geometry.
+
+        :return: (xmin, ymin, xmax, ymax)
+        :rtype: tuple
+        """
+        xmin, ymin, xmax, ymax = Inf, Inf, -Inf, -Inf
+        for tool in self.drills:
+            points = self.drills[tool]
+            if len(points) == 0:
+                continue
+            r = self.tools[tool]['C'] / 2.0
+            xmin = min(xmin, points[:, 0].min() - r)
+            ymin = min(ymin, points[:, 1].min() - r)
+            xmax = max(xmax, points[:, 0].max() + r)
+            ymax = max(ymax, points[:, 1].max() + r)
 
-        for drill in self.drills:
-            #poly = drill['point'].buffer(self.tools[drill['tool']]["C"]/2.0)
-            tooldia = self.tools[drill['tool']]['C']
-            poly = drill['point'].buffer(tooldia/2.0)
-            self.solid_geometry.append(poly)
+        if xmin == Inf:
+            return (0, 0, 0, 0)
+        return (xmin, ymin, xmax, ymax)
 
     def scale(self, factor):
         """
@@ -1635,10 +2220,10 @@ class Excellon(Geometry):
         """
 
         # Drills
-        for drill in self.drills:
-            drill['point'] = affinity.scale(drill['point'], factor, factor, origin=(0, 0))
+        self.drills = dict([(tool, self.drills[tool] * factor) for tool in self.drills])
 
         self.create_geometry()
+        self.changed()
 
     def offset(self, vect):
         """
@@ -1652,11 +2237,11 @@ class Excellon(Geometry):
         dx, dy = vect
 
         # Drills
-        for drill in self.drills:
-            drill['point'] = affinity.translate(drill['point'], xoff=dx, yoff=dy)
+        self.drills = dict([(tool, self.drills[tool] + array([dx, dy])) for tool in self.drills])
 
         # Recreate geometry
         self.create_geometry()
+        self.changed()
 
     def mirror(self, axis, point):
         """
@@ -1672,18 +2257,21 @@ class Excellon(Geometry):
         xscale, yscale = {"X": (1.0, -1.0), "Y": (-1.0, 1.0)}[axis]
 
         # Modify data
-        for drill in self.drills:
-            drill['point'] = affinity.scale(drill['point'], xscale, yscale, origin=(px, py))
+        origin = array([px, py])
+        scale = array([xscale, yscale])
+        self.drills = dict([(tool, (self.drills[tool] - origin) * scale + origin)
+                            for tool in self.drills])
 
         # Recreate geometry
         self.create_geometry()
+        self.changed()
 
     def convert_units(self, units):
         factor = Geometry.convert_units(self, units)
 
-        # Tools
-        for tname in self.tools:
-            self.tools[tname]["C"] *= factor
+        # Tools, made anew as a project may be being saved from them.
+        self.tools = dict([(tname, dict(self.tools[tname], C=self.tools[tname]["C"] * factor))
+                           for tname in self.tools])
 
         self.create_geometry()
 
@@ -1696,22 +2284,41 @@ class CNCjob(Geometry):
 
     *ATTRIBUTES*
 
-    * ``gcode_parsed`` (list): Each is a dictionary:
+    * ``gcode_parsed`` (numpy.ndarray): One element for each move
+      in the XY plane, of type ``CNCjob.segment_dtype``:
 
     =====================  =========================================
-    Key                    Value
+    Field                  Value
     =====================  =========================================
-    geom                   (Shapely.LineString) Tool path (XY plane)
-    kind                   (string) "AB", A is "T" (travel) or
-                           "C" (cut). B is "F" (fast) or "S" (slow).
+    line                   (int) Index of the line in the G-code.
+    path                   (int) Consecutive moves of the same kind,
+                           not separated by moves along Z only,
+                           have the same path.
+    g                      (int) Motion mode: 0 rapid, 1 linear, 2
+                           clockwise arc, 3 counter-clockwise arc.
+    x0, y0                 (float) Start point.
+    x1, y1                 (float) End point.
+    z                      (float) Height of the tool.
+    i, j                   (float) Center of arcs, relative to
+                           the start point.
     =====================  =========================================
+
+    The kind of a move is "AB", A is "T" (travel) when z > 0 or "C"
+    (cut), and B is "F" (fast) for rapid moves or "S" (slow). Shapely
+    geometry of the paths is made only when needed, by
+    ``gcode_geometry()``.
     """
+
+    segment_dtype = dtype([('line', 'i4'), ('path', 'i4'), ('g', 'i1'),
+                           ('x0', 'f8'), ('y0', 'f8'), ('x1', 'f8'), ('y1', 'f8'),
+                           ('z', 'f8'), ('i', 'f8'), ('j', 'f8')])
+
     def __init__(self, units="in", kind="generic", z_move=0.1,
                  feedrate=3.0, z_cut=-0.002, tooldia=0.0):
 
         Geometry.__init__(self)
         self.kind = kind
-        self.units = units
+        self.set_units(units)
         self.z_cut = z_cut
         self.z_move = z_move
         self.feedrate = feedrate
@@ -1720,17 +2327,26 @@ class CNCjob(Geometry):
         self.pausecode = "G04 P1"
         self.feedminutecode = "G94"
         self.absolutecode = "G90"
+        # Text, bytes or a memory map. See gcode_map().
         self.gcode = ""
         self.input_geometry_bounds = None
         self.gcode_parsed = None
-        self.steps_per_circ = 20  # Used when parsing G-code arcs
+
+        # Decimated paths for display. See gcode_pyramid().
+        self.pyramid = None
+
+        # ((tooldia, tolerance), area, {kind: Matplotlib path}).
+        # See swept_area().
+        self.swept = None
+
+        # Digits after the decimal point by units, for GCodeWriter.
+        self.decimals = GCodeWriter.decimals
 
         # Attributes to be included in serialization
         # Always append to it because it carries contents
         # from Geometry.
         self.ser_attrs += ['kind', 'z_cut', 'z_move', 'feedrate', 'tooldia',
-                           'gcode', 'input_geometry_bounds', 'gcode_parsed',
-                           'steps_per_circ']
+                           'gcode', 'input_geometry_bounds', 'gcode_parsed']
 
     def convert_units(self, units):
         factor = Geometry.convert_units(self, units)
@@ -1743,6 +2359,45 @@ class CNCjob(Geometry):
 
         return factor
 
+    @staticmethod
+    def drill_path(exobj, tools, time_budget=2.0):
+        """
+        Drill points of the given tools in a short order to drill
+        them, starting and ending at the origin. Tools are drilled
+        one after the other, each along its own path from where the
+        previous one ended. See ``optimize_path()``.
+
+        :param exobj: Excellon object with the drills.
+        :type exobj: Excellon
+        :param tools: Names of the tools, in the order to use them.
+        :type tools: list
+        :param time_budget: Seconds to spend improving the paths,
+            shared among the tools by their number of drills.
+        :type time_budget: float
+        :return: (points, rapid travel saved). Points are an (n, 2)
+            array. The travel saved is the difference with the order
+            in the file, in the units of the object.
+        :rtype: tuple
+        """
+        total = max(sum([len(exobj.drills.get(tool, [])) for tool in tools]), 1)
+
+        position = (0, 0)
+        paths = [empty((0, 2))]
+        for n, tool in enumerate(tools):
+            points = exobj.drill_points([tool])
+            end = (0, 0) if n == len(tools) - 1 else None
+            order = optimize_path(points, start=position, end=end,
+                                  time_budget=time_budget*len(points)/total)
+            points = points[order]
+            if len(points) > 0:
+                position = tuple(points[-1])
+            paths.append(points)
+
+        points = concatenate(paths)
+        saved = path_length(exobj.drill_points(tools), end=(0, 0)) - \
+            path_length(points, end=(0, 0))
+        return points, saved
+
     def generate_from_excellon(self, exobj):
         """
         Generates G-code for drilling from Excellon object.
@@ -1751,90 +2406,84 @@ class CNCjob(Geometry):
         """
         self.kind = "drill"
         self.gcode = []
-        
-        t = "G00 X%.4fY%.4f\n"
-        down = "G01 Z%.4f\n" % self.z_cut
-        up = "G01 Z%.4f\n" % self.z_move
 
         for tool in exobj.tools:
-            
-            points = []
-            
-            for drill in exobj.drill:
-                if drill['tool'] == tool:
-                    points.append(drill['point'])
-            
-            gcode = self.unitcode[self.units.upper()] + "\n"
-            gcode += self.absolutecode + "\n"
-            gcode += self.feedminutecode + "\n"
-            gcode += "F%.2f\n" % self.feedrate
-            gcode += "G00 Z%.4f\n" % self.z_move  # Move to travel height
-            gcode += "M03\n"  # Spindle start
-            gcode += self.pausecode + "\n"
-            
-            for point in points:
-                gcode += t % point
-                gcode += down + up
-            
-            gcode += t % (0, 0)
-            gcode += "M05\n"  # Spindle stop
-            
-            self.gcode.append(gcode)
 
-    def generate_from_excellon_by_tool(self, exobj, tools="all"):
+            points, saved = CNCjob.drill_path(exobj, [tool])
+
+            writer = self.writer()
+            self.write_start(writer)
+            self.write_drills(writer, points)
+            writer.move(0, 0, 0)
+            writer.write("M05")  # Spindle stop
+
+            self.gcode.append(writer.text())
+
+    def write_drills(self, writer, points):
+        """
+        Writes G-code to drill at each of the points.
+
+        :param writer: Where to write.
+        :type writer: GCodeWriter
+        :param points: Array of shape (n, 2).
+        :type points: numpy.ndarray
+        :return: None
+        """
+        for x, y in points.tolist():
+            writer.move(0, x, y)
+            writer.move(1, z=self.z_cut)   # Down
+            writer.move(1, z=self.z_move)  # Up
+
+    def generate_from_excellon_by_tool(self, exobj, tools="all", time_budget=2.0):
         """
         Creates gcode for this object from an Excellon object
-        for the specified tools.
+        for the specified tools. It is written to a temporary
+        file, mapped into ``self.gcode``. See ``gcode_map()``.
 
         :param exobj: Excellon object to process
         :type exobj: Excellon
         :param tools: Comma separated tool names
         :type: tools: str
-        :return: None
-        :rtype: None
+        :param time_budget: Seconds to spend ordering the drills.
+            See ``CNCjob.drill_path()``.
+        :type time_budget: float
+        :return: Estimate of the rapid travel saved by ordering
+            the drills, in the units of the object.
+        :rtype: float
         """
         log.debug("Creating CNC Job from Excellon...")
         if tools == "all":
             tools = [tool for tool in exobj.tools]
         else:
             tools = [x.strip() for x in tools.split(",")]
-            tools = filter(lambda i: i in exobj.tools, tools)
+            tools = [i for i in tools if i in exobj.tools]
         log.debug("Tools are: %s" % str(tools))
 
-        points = []
-        for drill in exobj.drills:
-            if drill['tool'] in tools:
-                points.append(drill['point'])
+        points, saved = CNCjob.drill_path(exobj, tools, time_budget)
 
-        log.debug("Found %d drills." % len(points))
+        log.debug("Found %d drills. Ordering saves %.4f of rapid travel." % (len(points), saved))
         #self.kind = "drill"
-        self.gcode = []
-
-        t = "G00 X%.4fY%.4f\n"
-        down = "G01 Z%.4f\n" % self.z_cut
-        up = "G01 Z%.4f\n" % self.z_move
-
-        gcode = self.unitcode[self.units.upper()] + "\n"
-        gcode += self.absolutecode + "\n"
-        gcode += self.feedminutecode + "\n"
-        gcode += "F%.2f\n" % self.feedrate
-        gcode += "G00 Z%.4f\n" % self.z_move  # Move to travel height
-        gcode += "M03\n"  # Spindle start
-        gcode += self.pausecode + "\n"
 
-        for point in points:
-            x, y = point.coords.xy
-            gcode += t % (x[0], y[0])
-            gcode += down + up
+        f = tempfile.TemporaryFile(mode='w+')
+        try:
+            writer = self.writer(f)
+            self.write_start(writer)
+            self.write_drills(writer, points)
+            writer.move(0, 0, 0)
+            writer.write("M05")  # Spindle stop
 
-        gcode += t % (0, 0)
-        gcode += "M05\n"  # Spindle stop
+            f.flush()
+            self.gcode = gcode_map(f)
+        finally:
+            f.close()
 
-        self.gcode = gcode
+        return saved
 
-    def generate_from_geometry(self, geometry, append=True, tooldia=None, tolerance=0):
+    def generate_from_geometry(self, geometry, append=True, tooldia=None, tolerance=0,
+                               safe_region=None, arcs=False):
         """
-        Generates G-Code from a Geometry object. Stores in ``self.gcode``.
+        Generates G-Code from a Geometry object. It is written to a
+        temporary file, mapped into ``self.gcode``. See ``gcode_map()``.
 
         :param geometry: Geometry defining the toolpath
         :type geometry: Geometry
@@ -1845,8 +2494,17 @@ class CNCjob(Geometry):
         :type tooldia: bool
         :param tolerance: All points in the simplified object will be within the
             tolerance distance of the original geometry.
-        :return: None
-        :rtype: None
+        :param safe_region: Where the tool can move at cutting depth.
+            Paths are joined by a cut when the move between them is
+            inside it, instead of lifting the tool, moving and
+            plunging again. See ``CNCjob.cleared_region()``.
+        :type safe_region: Shapely.Polygon or Shapely.MultiPolygon
+        :param arcs: Cut runs of segments close to circular arcs as arcs,
+            within ``tolerance``, or ``self.arc_tolerance`` if it is 0.
+        :type arcs: bool
+        :return: Length of travel between paths before and
+            after sequencing them. See ``sequence_paths()``.
+        :rtype: tuple
         """
         if tooldia is not None:
             self.tooldia = tooldia
@@ -1856,185 +2514,583 @@ class CNCjob(Geometry):
         if not append:
             self.gcode = ""
 
-        self.gcode = self.unitcode[self.units.upper()] + "\n"
-        self.gcode += self.absolutecode + "\n"
-        self.gcode += self.feedminutecode + "\n"
-        self.gcode += "F%.2f\n" % self.feedrate
-        self.gcode += "G00 Z%.4f\n" % self.z_move  # Move to travel height
-        self.gcode += "M03\n"  # Spindle start
-        self.gcode += self.pausecode + "\n"
-        
-        for geo in geometry.solid_geometry:
-            
+        paths = CNCjob.toolpaths(geometry.solid_geometry, tolerance=tolerance)
+        before = travel_length([coords for coords, closed in paths])
+        paths = sequence_paths(paths)
+        after = travel_length(paths)
+        log.debug("Sequenced %d paths. Travel from %.4f to %.4f." % (len(paths), before, after))
+
+        # Whether each path is reached cutting from the previous one.
+        links = [False]*(len(paths) + 1)
+        if safe_region is not None and not safe_region.is_empty:
+            safe = prep(safe_region)
+            for i in range(1, len(paths)):
+                a = paths[i - 1][-1]
+                b = paths[i][0]
+                move = Point(a) if a == b else LineString([a, b])
+                links[i] = safe.covers(move)
+            log.debug("Linked %d of %d paths without lifting the tool." % (sum(links), len(paths)))
+
+        arc_tolerance = 0
+        if arcs:
+            arc_tolerance = tolerance if tolerance > 0 else self.arc_tolerance
+
+        f = tempfile.TemporaryFile(mode='w+')
+        try:
+            writer = self.writer(f)
+            self.write_start(writer)
+            for i, path in enumerate(paths):
+                self.write_path(writer, path, link=links[i], retract=not links[i + 1],
+                                arc_tolerance=arc_tolerance)
+            self.write_end(writer)
+
+            f.flush()
+            self.gcode = gcode_map(f)
+        finally:
+            f.close()
+
+        return before, after
+
+    @staticmethod
+    def cleared_region(geometry, tooldia):
+        """
+        Where a tool can move at cutting depth without removing
+        anything that cutting along the paths of the geometry
+        does not remove. That is, where the tool's center can be
+        with the tool inside the area swept along the paths. This
+        includes the paths themselves and the space between passes
+        closer than the tool's diameter, as in painted areas.
+
+        :param geometry: Shapely geometry or list of it.
+        :param tooldia: Diameter of the tool.
+        :type tooldia: float
+        :return: The region.
+        :rtype: Shapely.Polygon or Shapely.MultiPolygon
+        """
+        radius = tooldia/2.0
+        swept = []
+        for coords, closed in CNCjob.toolpaths(geometry):
+            if len(coords) == 1:
+                swept.append(Point(coords[0]).buffer(radius))
+            else:
+                swept.append(LineString(coords).buffer(radius))
+
+        # Buffers are polygons inscribed in the exact outline, up to
+        # 0.5% of the radius inside it. Shrinking by a little less
+        # than the radius keeps the paths themselves in the region.
+        return union_all(swept).buffer(-radius*0.99)
+
+    @staticmethod
+    def toolpaths(geometry, tolerance=0):
+        """
+        Paths to cut along the given geometry: the exterior and
+        interiors of polygons, and lines. Points become paths of
+        a single point, where the tool only plunges.
+
+        :param geometry: Shapely geometry or list of it.
+        :param tolerance: All points in the simplified paths will be within the
+            tolerance distance of the original geometry.
+        :type tolerance: float
+        :return: List of (coordinates, closed). Closed paths end
+            at their first point.
+        :rtype: list
+        """
+        if type(geometry) != list:
+            geometry = [geometry]
+
+        paths = []
+        for geo in geometry:
+
+            if geo is None or geo.is_empty:
+                continue
+
+            if type(geo) == MultiPolygon:
+                paths += CNCjob.toolpaths(list(geo.geoms), tolerance=tolerance)
+                continue
+
+            if tolerance > 0 and type(geo) != Point:
+                geo = geo.simplify(tolerance)
+
             if type(geo) == Polygon:
-                self.gcode += self.polygon2gcode(geo, tolerance=tolerance)
+                paths.append((list(geo.exterior.coords), True))
+                for ints in geo.interiors:
+                    paths.append((list(ints.coords), True))
                 continue
-            
+
             if type(geo) == LineString or type(geo) == LinearRing:
-                self.gcode += self.linear2gcode(geo, tolerance=tolerance)
-                continue
-            
-            if type(geo) == Point:
-                self.gcode += self.point2gcode(geo)
+                coords = list(geo.coords)
+                paths.append((coords, len(coords) > 2 and coords[0] == coords[-1]))
                 continue
 
-            if type(geo) == MultiPolygon:
-                for poly in geo:
-                    self.gcode += self.polygon2gcode(poly, tolerance=tolerance)
+            if type(geo) == Point:
+                paths.append((list(geo.coords), False))
                 continue
 
             log.warning("G-code generation not implemented for %s" % (str(type(geo))))
 
-        self.gcode += "G00 Z%.4f\n" % self.z_move  # Stop cutting
-        self.gcode += "G00 X0Y0\n"
-        self.gcode += "M05\n"  # Spindle stop
+        return paths
+
+    def gcode_parse(self, data=None, progress=None):
+        """
+        G-Code parser (from self.gcode). Sets ``self.gcode_parsed``
+        with the moves in the XY plane, and the units from the last
+        G20 or G21 before the first move. The text is parsed in chunks
+        of whole lines. See ``gcode_columns()``.
+
+        :param data: G-code to parse instead of ``self.gcode``, as
+            text, bytes or a memory map.
+        :param progress: Called with the fraction of the text parsed.
+        :type progress: function
+        :return: ``self.gcode_parsed``
+        :rtype: numpy.ndarray
+        """
+        if data is None:
+            data = self.gcode
+
+        state = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'g': 0, 'line': 0,
+                 'plunges': 0, 'path': -1, 'last': None,
+                 'units': None, 'moved': False}
+        parts = [zeros(0, dtype=CNCjob.segment_dtype)]
+        for chunk, done in gcode_chunks(data):
+            parts.append(CNCjob.gcode_moves(gcode_columns(chunk), state))
+            if progress is not None:
+                progress(done)
+
+        if state['units'] is not None:
+            self.set_units(state['units'])
+        self.gcode_parsed = concatenate(parts)
+        self.pyramid = None
+        self.swept = None
+        return self.gcode_parsed
+
+    @staticmethod
+    def gcode_moves(columns, state):
+        """
+        Moves in the XY plane in a chunk of G-code.
+
+        :param columns: From ``gcode_columns()``.
+        :type columns: dict
+        :param state: Modal state at the start of the chunk, updated
+            to that at its end. Keys 'x', 'y', 'z', 'g' (motion mode),
+            'line' (of the start of the chunk), 'plunges' (number of
+            moves along Z only so far), 'path' (of the last move),
+            'last' (plunges, travel and slow at the last move, or None),
+            'moved' (whether any move was found) and 'units' ("IN" or
+            "MM" from the last G20 or G21 before the first move, or None).
+        :type state: dict
+        :return: Array of ``CNCjob.segment_dtype``.
+        :rtype: numpy.ndarray
+        """
+        nlines = len(columns['G'])
+
+        # Modal values: the last one given up to each line.
+        def modal(values, known, initial):
+            last = maximum.accumulate(where(known, arange(nlines), -1))
+            return where(last >= 0, values[last], initial)
+
+        x = modal(columns['X'], ~isnan(columns['X']), state['x'])
+        y = modal(columns['Y'], ~isnan(columns['Y']), state['y'])
+        z = modal(columns['Z'], ~isnan(columns['Z']), state['z'])
+        g = modal(columns['G'], columns['G'] >= 0, state['g'])
+        inplane = ~isnan(columns['X']) | ~isnan(columns['Y'])
+        plunge = ~isnan(columns['Z']) & ~inplane
+        plunges = cumsum(plunge) + state['plunges']
+
+        # Units given before the first move.
+        if not state['moved']:
+            given = flatnonzero(columns['U'] >= 0)
+            moving = flatnonzero(inplane | plunge)
+            if len(moving) > 0:
+                given = given[given < moving[0]]
+                state['moved'] = True
+            if len(given) > 0:
+                state['units'] = {20: "IN", 21: "MM"}[int(columns['U'][given[-1]])]
+
+        moves = flatnonzero(inplane)
+        previous = moves - 1
+
+        segments = zeros(len(moves), dtype=CNCjob.segment_dtype)
+        segments['line'] = moves + state['line']
+        segments['g'] = g[moves]
+        segments['x0'] = where(previous >= 0, x[previous], state['x'])
+        segments['y0'] = where(previous >= 0, y[previous], state['y'])
+        segments['x1'] = x[moves]
+        segments['y1'] = y[moves]
+        segments['z'] = z[moves]
+        arcs = segments['g'] >= 2
+        segments['i'] = where(arcs & ~isnan(columns['I'][moves]), columns['I'][moves], 0.0)
+        segments['j'] = where(arcs & ~isnan(columns['J'][moves]), columns['J'][moves], 0.0)
+
+        # A new path starts after moves along Z only,
+        # and when the kind of move changes.
+        if len(moves) > 0:
+            plunges = plunges[moves]
+            travel = segments['z'] > 0
+            slow = segments['g'] > 0
+            new_path = zeros(len(moves), dtype=bool)
+            new_path[0] = state['last'] != (plunges[0], travel[0], slow[0])
+            new_path[1:] = (plunges[1:] != plunges[:-1]) | (travel[1:] != travel[:-1]) | \
+                (slow[1:] != slow[:-1])
+            segments['path'] = cumsum(new_path) + state['path']
+            state['path'] = int(segments['path'][-1])
+            state['last'] = (plunges[-1], travel[-1], slow[-1])
+
+        # The last line is the start of the next chunk.
+        state['x'], state['y'], state['z'] = x[-1], y[-1], z[-1]
+        state['g'] = g[-1]
+        state['plunges'] += int(plunge.sum())
+        state['line'] += nlines - 1
+
+        return segments
+
+    def parse_file(self, filename, progress=None):
+        """
+        Parses a G-code file. The file is memory-mapped into
+        ``self.gcode`` and parsed in chunks. Exporting and saving
+        the project read it from there, so the text is never held
+        in memory as a whole. See ``gcode_map()``.
 
-    def pre_parse(self, gtext):
+        :param filename: G-code file.
+        :type filename: str
+        :param progress: Called with the fraction of the file parsed.
+        :type progress: function
+        :return: None
         """
-        Separates parts of the G-Code text into a list of dictionaries.
-        Used by ``self.gcode_parse()``.
+        f = open(filename, 'rb')
+        try:
+            self.gcode = gcode_map(f)
+        finally:
+            f.close()
 
-        :param gtext: A single string with g-code
+        self.gcode_parse(progress=progress)
+
+    def segments(self):
         """
+        ``self.gcode_parsed``, parsing the G-code again if it
+        was saved by an older version as a list.
 
-        # Units: G20-inches, G21-mm
-        units_re = re.compile(r'^G2([01])')
+        :rtype: numpy.ndarray
+        """
+        if type(self.gcode_parsed) == list:
+            self.gcode_parse()
+        return self.gcode_parsed
 
-        # TODO: This has to be re-done
-        gcmds = []
-        lines = gtext.split("\n")  # TODO: This is probably a lot of work!
-        for line in lines:
-            # Clean up
-            line = line.strip()
+    def gcode_geometry(self):
+        """
+        Shapely geometry of the paths in ``self.gcode_parsed``.
 
-            # Remove comments
-            # NOTE: Limited to 1 bracket pair
-            op = line.find("(")
-            cl = line.find(")")
-            #if op > -1 and  cl > op:
-            if cl > op > -1:
-                #comment = line[op+1:cl]
-                line = line[:op] + line[(cl+1):]
+        :return: List of {"geom": Shapely.LineString, "kind": str}.
+            See ``CNCjob`` for the kind.
+        :rtype: list
+        """
+        segments = self.segments()
+        if segments is None or len(segments) == 0:
+            return []
+
+        breaks = flatnonzero(segments['path'][1:] != segments['path'][:-1]) + 1
+        starts = concatenate([[0], breaks])
+        ends = concatenate([breaks, [len(segments)]])
+        arcs = (segments['g'] >= 2) & ((segments['i'] != 0) | (segments['j'] != 0))
+        arcdir = [None, None, "cw", "ccw"]
+
+        geometry = []
+        for first, stop in zip(starts.tolist(), ends.tolist()):
+            part = segments[first:stop]
+            if arcs[first:stop].any():
+                path = [(part['x0'][0], part['y0'][0])]
+                for seg in part.tolist():
+                    line, p, g, x0, y0, x1, y1, z, i, j = seg
+                    if g >= 2 and (i != 0 or j != 0):
+                        center = [x0 + i, y0 + j]
+                        path += arc(center, sqrt(i**2 + j**2), arctan2(-j, -i),
+                                    arctan2(y1 - center[1], x1 - center[0]),
+                                    arcdir[g], self.arc_tolerance)[1:]
+                    else:
+                        path.append((x1, y1))
+            else:
+                path = concatenate([[[part['x0'][0], part['y0'][0]]],
+                                    zeros((len(part), 2))])
+                path[1:, 0] = part['x1']
+                path[1:, 1] = part['y1']
 
-            # Units
-            match = units_re.match(line)
-            if match:
-                self.units = {'0': "IN", '1': "MM"}[match.group(1)]
-
-            # Parse GCode
-            # 0   4       12
-            # G01 X-0.007 Y-0.057
-            # --> codes_idx = [0, 4, 12]
-            codes = "NMGXYZIJFP"
-            codes_idx = []
-            i = 0
-            for ch in line:
-                if ch in codes:
-                    codes_idx.append(i)
-                i += 1
-            n_codes = len(codes_idx)
-            if n_codes == 0:
-                continue
+            last = part[-1]
+            kind = ("T" if last['z'] > 0 else "C") + ("S" if last['g'] > 0 else "F")
+            geometry.append({"geom": LineString(path), "kind": kind})
 
-            # Separate codes in line
-            parts = []
-            for p in range(n_codes-1):
-                parts.append(line[codes_idx[p]:codes_idx[p+1]].strip())
-            parts.append(line[codes_idx[-1]:].strip())
+        return geometry
 
-            # Separate codes from values
-            cmds = {}
-            for part in parts:
-                cmds[part[0]] = float(part[1:])
-            gcmds.append(cmds)
-        return gcmds
+    def bounds(self):
+        """
+        Bounds of the moves in the XY plane. Arcs count as their
+        whole circle.
 
-    def gcode_parse(self):
+        :return: (xmin, ymin, xmax, ymax)
+        :rtype: tuple
         """
-        G-Code parser (from self.gcode). Generates dictionary with
-        single-segment LineString's and "kind" indicating cut or travel,
-        fast or feedrate speed.
+        segments = self.segments()
+        if segments is None or len(segments) == 0:
+            return Geometry.bounds(self)
+
+        xs = concatenate([segments['x0'], segments['x1']])
+        ys = concatenate([segments['y0'], segments['y1']])
+        arcs = segments[segments['g'] >= 2]
+        if len(arcs) > 0:
+            radius = sqrt(arcs['i']**2 + arcs['j']**2)
+            cx = arcs['x0'] + arcs['i']
+            cy = arcs['y0'] + arcs['j']
+            xs = concatenate([xs, cx - radius, cx + radius])
+            ys = concatenate([ys, cy - radius, cy + radius])
+        return xs.min(), ys.min(), xs.max(), ys.max()
+
+    ## Display
+    # Levels of the display pyramid, each 4 times finer than the
+    # one before, starting from 1/256th of the size of the job.
+    pyramid_levels = 8
+    pyramid_start = 256
+
+    @staticmethod
+    def gcode_vertices(segments, tolerance):
         """
+        Vertices of the polylines made by consecutive moves. Arcs
+        are approximated with chords within ``tolerance``.
 
-        kind = ["C", "F"]  # T=travel, C=cut, F=fast, S=slow
+        :param segments: Array of ``CNCjob.segment_dtype``.
+        :type segments: numpy.ndarray
+        :param tolerance: Largest distance from arcs to their chords.
+        :type tolerance: float
+        :return: (x, y, first, travel): Coordinates, whether each vertex
+            starts a polyline and whether it is on a travel move.
+        :rtype: tuple
+        """
+        n = len(segments)
+        x0, y0 = segments['x0'], segments['y0']
+        x1, y1 = segments['x1'], segments['y1']
+        i, j = segments['i'], segments['j']
+
+        # A polyline starts at each path and where
+        # a move does not start at the end of the last.
+        starts = full(n, True)
+        starts[1:] = (segments['path'][1:] != segments['path'][:-1]) | \
+            (x0[1:] != x1[:-1]) | (y0[1:] != y1[:-1])
+
+        arcs = (segments['g'] >= 2) & ((i != 0) | (j != 0))
+        radius = sqrt(i**2 + j**2)
+        a0 = arctan2(-j, -i)
+        a1 = arctan2(y1 - y0 - j, x1 - x0 - i)
+        direction = where(segments['g'] == 2, -1.0, 1.0)
+        sweep = (direction * (a1 - a0)) % (2 * pi)
+        sweep[sweep == 0] = 2 * pi  # Full circle
+        step = 2 * arccos(clip(1 - tolerance / maximum(radius, 1e-12), -1, 1))
+        steps = where(arcs, clip(ceil(sweep / maximum(step, 1e-12)), 1, 256), 1).astype(int)
+
+        counts = steps + starts
+        seg = repeat(arange(n), counts)
+        pos = arange(counts.sum()) - repeat(cumsum(counts) - counts, counts) - starts[seg]
+
+        # pos is -1 for the start of a polyline and
+        # k for the end of the k-th chord of a move.
+        angle = a0[seg] + direction[seg] * sweep[seg] * (pos + 1) / steps[seg]
+        inside = arcs[seg] & (pos >= 0) & (pos < steps[seg] - 1)
+        x = where(pos < 0, x0[seg], where(inside, x0[seg] + i[seg] + radius[seg] * cos(angle), x1[seg]))
+        y = where(pos < 0, y0[seg], where(inside, y0[seg] + j[seg] + radius[seg] * sin(angle), y1[seg]))
+
+        return x, y, pos < 0, segments['z'][seg] > 0
 
-        # Results go here
-        geometry = []        
-        
-        # TODO: Merge into single parser?
-        gobjs = self.pre_parse(self.gcode)
-        
-        # Last known instruction
-        current = {'X': 0.0, 'Y': 0.0, 'Z': 0.0, 'G': 0}
-
-        # Current path: temporary storage until tool is
-        # lifted or lowered.
-        path = [(0, 0)]
-
-        # Process every instruction
-        for gobj in gobjs:
-
-            ## Changing height
-            if 'Z' in gobj:
-                if ('X' in gobj or 'Y' in gobj) and gobj['Z'] != current['Z']:
-                    log.warning("Non-orthogonal motion: From %s" % str(current))
-                    log.warning("  To: %s" % str(gobj))
-                current['Z'] = gobj['Z']
-                # Store the path into geometry and reset path
-                if len(path) > 1:
-                    geometry.append({"geom": LineString(path),
-                                     "kind": kind})
-                    path = [path[-1]]  # Start with the last point of last path.
-
-            if 'G' in gobj:
-                current['G'] = int(gobj['G'])
-                
-            if 'X' in gobj or 'Y' in gobj:
-                
-                if 'X' in gobj:
-                    x = gobj['X']
-                else:
-                    x = current['X']
-                
-                if 'Y' in gobj:
-                    y = gobj['Y']
-                else:
-                    y = current['Y']
+    @staticmethod
+    def decimate(x, y, first, resolution):
+        """
+        Keeps one vertex of each run of vertices in the same cell of
+        a grid of the given resolution. A polyline starting in the
+        cell where the one before ends is joined to it. Polylines are
+        kept with at least two vertices, so they remain visible.
+
+        :param x: X coordinates of the vertices of polylines.
+        :type x: numpy.ndarray
+        :param y: Y coordinates.
+        :type y: numpy.ndarray
+        :param first: Whether each vertex starts a polyline.
+        :type first: numpy.ndarray
+        :param resolution: Size of the cells.
+        :type resolution: float
+        :return: (keep, first): Whether each vertex is kept, and
+            whether it starts a polyline after decimating.
+        :rtype: tuple
+        """
+        n = len(x)
+        if n == 0:
+            return first.copy(), first.copy()
 
-                kind = ["C", "F"]  # T=travel, C=cut, F=fast, S=slow
+        cx = floor(x / resolution)
+        cy = floor(y / resolution)
+        keep = full(n, True)
+        keep[1:] = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+        first = first & keep
+        first[0] = True
 
-                if current['Z'] > 0:
-                    kind[0] = 'T'
-                if current['G'] > 0:
-                    kind[1] = 'S'
-                   
-                arcdir = [None, None, "cw", "ccw"]
-                if current['G'] in [0, 1]:  # line
-                    path.append((x, y))
-
-                if current['G'] in [2, 3]:  # arc
-                    center = [gobj['I'] + current['X'], gobj['J'] + current['Y']]
-                    radius = sqrt(gobj['I']**2 + gobj['J']**2)
-                    start = arctan2(-gobj['J'], -gobj['I'])
-                    stop = arctan2(-center[1]+y, -center[0]+x)
-                    path += arc(center, radius, start, stop,
-                                arcdir[current['G']],
-                                self.steps_per_circ)
-
-            # Update current instruction
-            for code in gobj:
-                current[code] = gobj[code]
-
-        # There might not be a change in height at the
-        # end, therefore, see here too if there is
-        # a final path.
-        if len(path) > 1:
-            geometry.append({"geom": LineString(path),
-                             "kind": kind})
+        starts = flatnonzero(first)
+        ends = concatenate([starts[1:], [n]]) - 1
+        kept = cumsum(keep)
+        counts = kept[ends] - kept[starts] + 1
+        keep[ends[counts < 2]] = True
+
+        return keep, first
+
+    @staticmethod
+    def polylines(x, y, first, travel, resolution=None):
+        """
+        Coordinates for plotting the polylines of each kind as a single
+        line, with NaN between polylines.
+
+        :param resolution: Decimate to this resolution if given. See
+            ``CNCjob.decimate()``.
+        :type resolution: float
+        :return: {"T": (x, y), "C": (x, y)}
+        :rtype: dict
+        """
+        lines = {}
+        for kind, sel in [("T", travel), ("C", ~travel)]:
+            kx, ky, kfirst = x[sel], y[sel], first[sel]
+            if resolution is not None:
+                keep, kfirst = CNCjob.decimate(kx, ky, kfirst, resolution)
+                kx, ky, kfirst = kx[keep], ky[keep], kfirst[keep]
+
+            gaps = cumsum(kfirst) - 1
+            gaps[gaps < 0] = 0
+            px = full(len(kx) + (gaps[-1] if len(gaps) > 0 else 0), float('nan'))
+            py = px.copy()
+            px[arange(len(kx)) + gaps] = kx
+            py[arange(len(ky)) + gaps] = ky
+            lines[kind] = (px, py)
+        return lines
+
+    def gcode_pyramid(self):
+        """
+        Decimated copies of the paths for display, from the
+        coarsest, made when first needed. Levels stop when they
+        would have about as many vertices as there are moves.
+
+        :return: List of (resolution, lines), lines as
+            from ``CNCjob.polylines()``.
+        :rtype: list
+        """
+        if self.pyramid is not None:
+            return self.pyramid
+
+        segments = self.segments()
+        self.pyramid = []
+        if segments is None or len(segments) == 0:
+            return self.pyramid
+
+        xmin, ymin, xmax, ymax = self.bounds()
+        resolution = max(xmax - xmin, ymax - ymin, 1e-9) / CNCjob.pyramid_start
+        for level in range(CNCjob.pyramid_levels):
+            x, y, first, travel = CNCjob.gcode_vertices(segments, resolution)
+            lines = CNCjob.polylines(x, y, first, travel, resolution)
+            if len(lines["T"][0]) + len(lines["C"][0]) > 0.5 * len(segments):
+                break
+            self.pyramid.append((resolution, lines))
+            resolution /= 4.0
+
+        return self.pyramid
+
+    def view_lines(self, xmin, ymin, xmax, ymax, resolution):
+        """
+        Paths to display in a view. The coarsest level of the pyramid
+        with details at least as fine as ``resolution`` is used, and
+        when there is none, the moves in the view at full resolution.
+
+        :param resolution: Size of a pixel.
+        :type resolution: float
+        :return: {"T": (x, y), "C": (x, y)}. See ``CNCjob.polylines()``.
+        :rtype: dict
+        """
+        for level_resolution, lines in self.gcode_pyramid():
+            if level_resolution <= resolution:
+                return lines
+
+        segments = self.segments()
+        if segments is None:
+            segments = zeros(0, dtype=CNCjob.segment_dtype)
+
+        # Arcs may go around their center.
+        radius = where(segments['g'] >= 2, sqrt(segments['i']**2 + segments['j']**2), 0)
+        cx = segments['x0'] + segments['i']
+        cy = segments['y0'] + segments['j']
+        inview = (minimum(minimum(segments['x0'], segments['x1']), cx - radius) <= xmax) & \
+                 (maximum(maximum(segments['x0'], segments['x1']), cx + radius) >= xmin) & \
+                 (minimum(minimum(segments['y0'], segments['y1']), cy - radius) <= ymax) & \
+                 (maximum(maximum(segments['y0'], segments['y1']), cy + radius) >= ymin)
+
+        x, y, first, travel = CNCjob.gcode_vertices(segments[inview], resolution / 2.0)
+        return CNCjob.polylines(x, y, first, travel)
+
+    def plot_view(self, axes, tooldia=0, color={"T": "#B5AB3A", "C": "#4650BD"},
+                  alpha={"T": 1.0, "C": 1.0}):
+        """
+        Plots the paths with one line for each kind of move, with
+        the detail needed at the current zoom. Lines are as wide as
+        the tool, in data units, or thin if ``tooldia`` is 0. They
+        are drawn again when the limits of ``axes`` change.
+
+        :param axes: Matplotlib axes on which to plot.
+        :param tooldia: Tool diameter.
+        :type tooldia: float
+        :param color: Color of travel ("T") and cut ("C") moves.
+        :type color: dict
+        :param alpha: Transparency of each kind of move.
+        :type alpha: dict
+        :return: None
+        """
+        if tooldia == 0:
+            lines = {"T": axes.plot([], [], '--', color=color["T"], alpha=alpha["T"])[0],
+                     "C": axes.plot([], [], '-', color=color["C"], alpha=alpha["C"])[0]}
+        else:
+            lines = dict([(kind, axes.plot([], [], '-', color=color[kind], alpha=alpha[kind],
+                                           solid_capstyle='round', solid_joinstyle='round',
+                                           zorder=2)[0])
+                          for kind in ["T", "C"]])
+
+        def update(*args):
+            xmin, xmax = axes.get_xlim()
+            ymin, ymax = axes.get_ylim()
+            pixels = max(axes.get_window_extent().width, 1)
+            view = self.view_lines(xmin, ymin, xmax, ymax, (xmax - xmin) / pixels)
+            for kind in lines:
+                lines[kind].set_data(*view[kind])
+                if tooldia != 0:
+                    # Points are 1/72 inch.
+                    points = tooldia * pixels / (xmax - xmin) * 72.0 / axes.figure.dpi
+                    lines[kind].set_linewidth(points)
+
+        update()
+
+        # Limits are always set X first, so this
+        # is enough to follow zooming and panning.
+        axes.callbacks.connect('ylim_changed', update)
+
+    def swept_area(self, tooldia, tolerance=0.0005):
+        """
+        Area swept by the tool along the paths of each kind,
+        kept until the paths change.
+
+        :param tooldia: Tool diameter.
+        :type tooldia: float
+        :param tolerance: Tolerance when simplifying the area.
+        :type tolerance: float
+        :return: {"T": geometry, "C": geometry}
+        :rtype: dict
+        """
+        if self.swept is not None and self.swept[0] == (tooldia, tolerance):
+            return self.swept[1]
+
+        area = {}
+        for kind in ["T", "C"]:
+            paths = [geo['geom'] for geo in self.gcode_geometry() if geo['kind'][0] == kind]
+            area[kind] = union_all([path.buffer(tooldia / 2.0).simplify(tolerance) for path in paths])
+
+        self.swept = ((tooldia, tolerance), area, {})
+        return area
 
-        self.gcode_parsed = geometry
-        return geometry
-        
     # def plot(self, tooldia=None, dpi=75, margin=0.1,
     #          color={"T": ["#F0E24D", "#B5AB3A"], "C": ["#5E6CFF", "#4650BD"]},
     #          alpha={"T": 0.3, "C": 1.0}):
@@ -2072,9 +3128,11 @@ class CNCjob(Geometry):
         
     def plot2(self, axes, tooldia=None, dpi=75, margin=0.1,
              color={"T": ["#F0E24D", "#B5AB3A"], "C": ["#5E6CFF", "#4650BD"]},
-             alpha={"T": 0.3, "C": 1.0}, tool_tolerance=0.0005):
+             alpha={"T": 0.3, "C": 1.0}, tool_tolerance=0.0005, swept=False):
         """
-        Plots the G-code job onto the given axes.
+        Plots the G-code job onto the given axes. Paths are drawn as
+        lines as wide as the tool, see ``plot_view()``, or as the
+        area swept by the tool, see ``swept_area()``.
 
         :param axes: Matplotlib axes on which to plot.
         :param tooldia: Tool diameter.
@@ -2083,30 +3141,137 @@ class CNCjob(Geometry):
         :param color: Color specification.
         :param alpha: Transparency specification.
         :param tool_tolerance: Tolerance when drawing the toolshape.
+        :param swept: Plot the swept area.
+        :type swept: bool
         :return: None
         """
         if tooldia is None:
             tooldia = self.tooldia
-        
+
         if tooldia == 0:
-            for geo in self.gcode_parsed:
-                linespec = '--'
-                linecolor = color[geo['kind'][0]][1]
-                if geo['kind'][0] == 'C':
-                    linespec = 'k-'
-                x, y = geo['geom'].coords.xy
-                axes.plot(x, y, linespec, color=linecolor)
+            self.plot_view(axes, color=dict([(kind, color[kind][1]) for kind in color]))
+        elif not swept:
+            self.plot_view(axes, tooldia=tooldia, alpha=alpha,
+                           color=dict([(kind, color[kind][0]) for kind in color]))
         else:
-            for geo in self.gcode_parsed:
-                poly = geo['geom'].buffer(tooldia/2.0).simplify(tool_tolerance)
-                patch = PolygonPatch(poly, facecolor=color[geo['kind'][0]][0],
-                                     edgecolor=color[geo['kind'][0]][1],
-                                     alpha=alpha[geo['kind'][0]], zorder=2)
-                axes.add_patch(patch)
-        
+            area = self.swept_area(tooldia, tool_tolerance)
+            paths = self.swept[2]  # Kept with the area
+            for kind in area:
+                if area[kind].is_empty:
+                    continue
+                if kind not in paths:
+                    paths[kind] = PolygonPatch(area[kind]).get_path()
+                patch = PathPatch(paths[kind], facecolor=color[kind][0],
+                                  edgecolor=color[kind][1],
+                                  alpha=alpha[kind], zorder=2)
+
+                # Not add_patch(): limits are set from bounds() and
+                # finding them from the path is slow when it is large.
+                axes.add_artist(patch)
+
     def create_geometry(self):
-        # TODO: This takes forever. Too much data?
-        self.solid_geometry = cascaded_union([geo['geom'] for geo in self.gcode_parsed])
+        """
+        Defers making ``self.solid_geometry``, the paths of the
+        job, until it is used. See ``gcode_geometry()``.
+
+        :return: None
+        """
+        # Loads any attributes still pending from a
+        # project before replacing what is deferred.
+        self.segments()
+        self.pyramid = None
+        self.swept = None
+
+        self.set_lazy(['solid_geometry'],
+                      lambda: {'solid_geometry': [geo['geom'] for geo in self.gcode_geometry()]})
+
+    def write_path(self, writer, path, link=False, retract=True, arc_tolerance=0):
+        """
+        Writes G-code to cut along a path: move to its first point,
+        plunge, cut to the rest of the points and retract.
+
+        :param writer: Where to write.
+        :type writer: GCodeWriter
+        :param path: List of (x, y).
+        :type path: list
+        :param link: Cut to the first point from where the tool
+            is, at cutting depth, instead of moving and plunging.
+        :type link: bool
+        :param retract: Lift the tool at the end.
+        :type retract: bool
+        :param arc_tolerance: If more than 0, runs of segments within
+            this distance of an arc are cut as arcs (G02/G03).
+            See ``fit_arcs()``.
+        :type arc_tolerance: float
+        :return: None
+        """
+        if link:
+            writer.move(1, path[0][0], path[0][1])  # Cut to first point
+        else:
+            writer.move(0, path[0][0], path[0][1])  # Move to first point
+            writer.move(1, z=self.z_cut)            # Start cutting
+
+        if arc_tolerance > 0:
+            # Runs of linear motion are written at once.
+            run = []
+            start = path[0]
+            for k, center, direction in fit_arcs(path, arc_tolerance):
+                pt = path[k]
+                if center is None:
+                    run.append(pt)
+                else:
+                    writer.cut_along(run)
+                    run = []
+                    # Arc to point, center relative to the start.
+                    writer.move({"cw": 2, "ccw": 3}[direction], pt[0], pt[1],
+                                i=center[0] - start[0], j=center[1] - start[1])
+                start = pt
+            writer.cut_along(run)
+        else:
+            writer.cut_along(path[1:])  # Linear motion to each point
+
+        if retract:
+            writer.move(0, z=self.z_move)  # Stop cutting
+
+    def writer(self, target=None):
+        """
+        A ``GCodeWriter`` for the units and decimals of this job.
+
+        :param target: File-like object to write to, or None to
+            keep the G-code in memory.
+        :return: GCodeWriter
+        """
+        return GCodeWriter(target, units=self.units, decimals=self.decimals)
+
+    def write_start(self, writer):
+        """
+        Writes the G-code that goes before cutting: units, modes,
+        feed rate, move to travel height and spindle start.
+
+        :param writer: Where to write.
+        :type writer: GCodeWriter
+        :return: None
+        """
+        writer.write(self.unitcode[self.units.upper()])
+        writer.write(self.absolutecode)
+        writer.write(self.feedminutecode)
+        writer.feedrate(self.feedrate)
+        writer.move(0, z=self.z_move)  # Move to travel height
+        writer.write("M03")  # Spindle start
+        writer.write(self.pausecode)
+
+    def write_end(self, writer):
+        """
+        Writes the G-code that goes after cutting: lift the tool,
+        return to the origin and stop the spindle.
+
+        :param writer: Where to write.
+        :type writer: GCodeWriter
+        :return: None
+        """
+        writer.move(0, z=self.z_move)  # Stop cutting
+        writer.move(0, 0, 0)
+        writer.write("M05")  # Spindle stop
 
     def polygon2gcode(self, polygon, tolerance=0):
         """
@@ -2121,28 +3286,10 @@ class CNCjob(Geometry):
         :return: G-code to cut along polygon.
         :rtype: str
         """
-
-        if tolerance > 0:
-            target_polygon = polygon.simplify(tolerance)
-        else:
-            target_polygon = polygon
-
-        gcode = ""
-        t = "G0%d X%.4fY%.4f\n"
-        path = list(target_polygon.exterior.coords)             # Polygon exterior
-        gcode += t % (0, path[0][0], path[0][1])  # Move to first point
-        gcode += "G01 Z%.4f\n" % self.z_cut       # Start cutting
-        for pt in path[1:]:
-            gcode += t % (1, pt[0], pt[1])    # Linear motion to point
-        gcode += "G00 Z%.4f\n" % self.z_move  # Stop cutting
-        for ints in target_polygon.interiors:               # Polygon interiors
-            path = list(ints.coords)
-            gcode += t % (0, path[0][0], path[0][1])  # Move to first point
-            gcode += "G01 Z%.4f\n" % self.z_cut       # Start cutting
-            for pt in path[1:]:
-                gcode += t % (1, pt[0], pt[1])    # Linear motion to point
-            gcode += "G00 Z%.4f\n" % self.z_move  # Stop cutting
-        return gcode
+        writer = self.writer()
+        for path, closed in CNCjob.toolpaths(polygon, tolerance=tolerance):
+            self.write_path(writer, path)
+        return writer.text()
 
     def linear2gcode(self, linear, tolerance=0):
         """
@@ -2156,30 +3303,49 @@ class CNCjob(Geometry):
         :return: G-code to cut alon the linear feature.
         :rtype: str
         """
-
-        if tolerance > 0:
-            target_linear = linear.simplify(tolerance)
-        else:
-            target_linear = linear
-
-        gcode = ""
-        t = "G0%d X%.4fY%.4f\n"
-        path = list(target_linear.coords)
-        gcode += t % (0, path[0][0], path[0][1])  # Move to first point
-        gcode += "G01 Z%.4f\n" % self.z_cut       # Start cutting
-        for pt in path[1:]:
-            gcode += t % (1, pt[0], pt[1])    # Linear motion to point
-        gcode += "G00 Z%.4f\n" % self.z_move  # Stop cutting
-        return gcode
+        writer = self.writer()
+        for path, closed in CNCjob.toolpaths(linear, tolerance=tolerance):
+            self.write_path(writer, path)
+        return writer.text()
 
     def point2gcode(self, point):
-        # TODO: This is not doing anything.
-        gcode = ""
-        t = "G0%d X%.4fY%.4f\n"
-        path = list(point.coords)
-        gcode += t % (0, path[0][0], path[0][1])  # Move to first point
-        gcode += "G01 Z%.4f\n" % self.z_cut       # Start cutting
-        gcode += "G00 Z%.4f\n" % self.z_move      # Stop cutting
+        writer = self.writer()
+        self.write_path(writer, list(point.coords))
+        return writer.text()
+
+    def export_gcode(self, filename, postamble=""):
+        """
+        Writes the G-code to a file, followed by ``postamble``. It
+        is copied in chunks from ``self.gcode``, which may be mapped
+        from a file. See ``gcode_chunks()``.
+
+        :param filename: Path to the file.
+        :type filename: str
+        :param postamble: Text to add at the end.
+        :type postamble: str
+        :return: None
+        """
+        if not isinstance(postamble, bytes):
+            postamble = postamble.encode('utf-8')
+
+        # Written next to it and renamed, as the G-code may be
+        # mapped from the very file being replaced.
+        temporary = filename + ".tmp"
+        f = open(temporary, 'wb')
+        try:
+            last = b"\n"
+            for chunk, done in gcode_chunks(self.gcode):
+                f.write(chunk)
+                last = chunk[-1:]
+            if last != b"\n":
+                f.write(b"\n")
+            f.write(postamble)
+        finally:
+            f.close()
+
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temporary, filename)
 
     def scale(self, factor):
         """
@@ -2193,10 +3359,14 @@ class CNCjob(Geometry):
         :rtype: None
         """
 
-        for g in self.gcode_parsed:
-            g['geom'] = affinity.scale(g['geom'], factor, factor, origin=(0, 0))
+        # A new array, as a project may be being saved from the old one.
+        segments = self.segments().copy()
+        for field in ['x0', 'y0', 'x1', 'y1', 'i', 'j']:
+            segments[field] *= factor
+        self.gcode_parsed = segments
 
         self.create_geometry()
+        self.changed()
 
     def offset(self, vect):
         """
@@ -2209,43 +3379,721 @@ class CNCjob(Geometry):
         """
         dx, dy = vect
 
-        for g in self.gcode_parsed:
-            g['geom'] = affinity.translate(g['geom'], xoff=dx, yoff=dy)
+        # A new array, as a project may be being saved from the old one.
+        segments = self.segments().copy()
+        segments['x0'] += dx
+        segments['x1'] += dx
+        segments['y0'] += dy
+        segments['y1'] += dy
+        self.gcode_parsed = segments
 
         self.create_geometry()
+        self.changed()
 
 
-# def get_bounds(geometry_set):
-#     xmin = Inf
-#     ymin = Inf
-#     xmax = -Inf
-#     ymax = -Inf
-#
-#     #print "Getting bounds of:", str(geometry_set)
-#     for gs in geometry_set:
-#         try:
-#             gxmin, gymin, gxmax, gymax = geometry_set[gs].bounds()
-#             xmin = min([xmin, gxmin])
-#             ymin = min([ymin, gymin])
-#             xmax = max([xmax, gxmax])
-#             ymax = max([ymax, gymax])
-#         except:
-#             print "DEV WARNING: Tried to get bounds of empty geometry."
-#
-#     return [xmin, ymin, xmax, ymax]
+class GCodeWriter(object):
+    """
+    Writes G-code line by line to a file-like object, or keeps it
+    in memory. Words that would not change anything are left out:
+    the motion mode (G00, G01, G02, G03) and feed rate when they are
+    the same as before, and coordinates where the tool already is,
+    once formatted. Numbers are written without trailing zeros.
+    """
 
-def get_bounds(geometry_list):
-    xmin = Inf
-    ymin = Inf
-    xmax = -Inf
-    ymax = -Inf
+    # Digits after the decimal point, by units.
+    decimals = {"IN": 4, "MM": 3}
 
-    #print "Getting bounds of:", str(geometry_set)
-    for gs in geometry_list:
-        try:
-            gxmin, gymin, gxmax, gymax = gs.bounds()
-            xmin = min([xmin, gxmin])
-            ymin = min([ymin, gymin])
+    def __init__(self, target=None, units="IN", decimals=None):
+        """
+
+        :param target: File-like object to write to. If None, the
+            G-code is kept and can be had from ``text()``.
+        :param units: "IN" or "MM".
+        :type units: str
+        :param decimals: Digits after the decimal point, by units.
+            ``GCodeWriter.decimals`` if None.
+        :type decimals: dict
+        :return: GCodeWriter
+        """
+        self.target = target
+        self.chunks = []
+        self.digits = (decimals or GCodeWriter.decimals)[units.upper()]
+
+        # Modal state as written. None is unknown.
+        self.mode = None
+        self.feed = None
+        self.position = {'X': None, 'Y': None, 'Z': None}
+
+        # Number of lines written.
+        self.lines = 0
+
+    def number(self, value):
+        text = "%.*f" % (self.digits, value)
+        if '.' in text:
+            text = text.rstrip('0').rstrip('.')
+        if text == "-0":
+            text = "0"
+        return text
+
+    def write(self, line):
+        """
+        Writes a line as it is. It must not move the tool, or change
+        the motion mode or feed rate.
+
+        :param line: The line, without line terminator.
+        :type line: str
+        :return: None
+        """
+        if self.target is None:
+            self.chunks.append(line + "\n")
+        else:
+            self.target.write(line + "\n")
+        self.lines += 1
+
+    def feedrate(self, feedrate):
+        """
+        Sets the feed rate.
+
+        :param feedrate: Feed rate in units per minute.
+        :type feedrate: float
+        :return: None
+        """
+        feed = self.number(feedrate)
+        if feed != self.feed:
+            self.write("F" + feed)
+            self.feed = feed
+
+    def move(self, mode, x=None, y=None, z=None, i=None, j=None):
+        """
+        Moves the tool. Nothing is written for rapid and linear
+        moves that would not move it. Arcs ending where they start
+        are full circles and are written with their end point.
+
+        :param mode: 0 rapid, 1 linear, 2 clockwise arc or
+            3 counter-clockwise arc.
+        :type mode: int
+        :param x: X coordinate or None to leave it as is.
+        :param y: Y coordinate or None to leave it as is.
+        :param z: Z coordinate or None to leave it as is.
+        :param i: X of the center of arcs, relative to the start.
+        :param j: Y of the center of arcs, relative to the start.
+        :return: None
+        """
+        words = []
+        for axis, value in (('X', x), ('Y', y), ('Z', z)):
+            if value is None:
+                continue
+            text = self.number(value)
+            if text != self.position[axis]:
+                words.append(axis + text)
+                self.position[axis] = text
+
+        if mode in (2, 3):
+            if len(words) == 0:
+                if self.number(i) == "0" and self.number(j) == "0":
+                    return
+                words = [axis + self.position[axis] for axis in ('X', 'Y')
+                         if self.position[axis] is not None]
+            words.append('I' + self.number(i))
+            words.append('J' + self.number(j))
+        elif len(words) == 0:
+            return
+
+        line = "".join(words)
+        if mode != self.mode:
+            line = "G0%d %s" % (mode, line)
+            self.mode = mode
+
+        self.write(line)
+
+    def cut_along(self, points):
+        """
+        Linear moves (G01) to each of the points in turn. The
+        same as ``move(1, x, y)`` for each, but faster.
+
+        :param points: List of (x, y).
+        :type points: list
+        :return: None
+        """
+        if self.digits == 0:
+            for x, y in points:
+                self.move(1, x, y)
+            return
+
+        fmt = "%%.%df" % self.digits
+        x0 = self.position['X']
+        y0 = self.position['Y']
+        lines = []
+        for x, y in points:
+            tx = (fmt % x).rstrip('0').rstrip('.')
+            ty = (fmt % y).rstrip('0').rstrip('.')
+            if tx == "-0":
+                tx = "0"
+            if ty == "-0":
+                ty = "0"
+            if tx != x0:
+                if ty != y0:
+                    lines.append("X%sY%s\n" % (tx, ty))
+                else:
+                    lines.append("X%s\n" % tx)
+            elif ty != y0:
+                lines.append("Y%s\n" % ty)
+            x0 = tx
+            y0 = ty
+
+        if len(lines) == 0:
+            return
+        if self.mode != 1:
+            lines[0] = "G01 " + lines[0]
+            self.mode = 1
+
+        self.position['X'] = x0
+        self.position['Y'] = y0
+        self.lines += len(lines)
+        text = "".join(lines)
+        if self.target is None:
+            self.chunks.append(text)
+        else:
+            self.target.write(text)
+
+    def text(self):
+        """
+        The G-code written, if kept in memory.
+
+        :rtype: str
+        """
+        return "".join(self.chunks)
+
+
+class GridIndex(object):
+    """
+    Spatial index of rectangular bounds on a uniform grid. Keys can
+    be inserted and removed at any time, as opposed to a tree that has
+    to be built at once. Items spanning too many cells are kept apart
+    and checked on every query.
+    """
+
+    def __init__(self, cell_size, max_cells=256):
+        """
+
+        :param cell_size: Width and height of each cell.
+        :type cell_size: float
+        :param max_cells: Items spanning more cells than this are
+            not placed on the grid.
+        :type max_cells: int
+        :return: GridIndex
+        """
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+
+        # (i, j) -> set of keys
+        self.cells = {}
+
+        # key -> bounds
+        self.bounds = {}
+
+        # Keys not on the grid
+        self.large = set()
+
+    def _cell_range(self, bounds):
+        xmin, ymin, xmax, ymax = bounds
+        return (int(xmin // self.cell_size), int(ymin // self.cell_size),
+                int(xmax // self.cell_size), int(ymax // self.cell_size))
+
+    def insert(self, key, bounds):
+        """
+        Adds an item to the index.
+
+        :param key: Identifies the item. Must be hashable.
+        :param bounds: (xmin, ymin, xmax, ymax) of the item.
+        :type bounds: tuple
+        :return: None
+        """
+        self.bounds[key] = bounds
+        imin, jmin, imax, jmax = self._cell_range(bounds)
+
+        if (imax - imin + 1) * (jmax - jmin + 1) > self.max_cells:
+            self.large.add(key)
+            return
+
+        for i in range(imin, imax + 1):
+            for j in range(jmin, jmax + 1):
+                self.cells.setdefault((i, j), set()).add(key)
+
+    def remove(self, key):
+        """
+        Removes an item from the index.
+
+        :param key: Key used when inserting the item.
+        :return: None
+        """
+        bounds = self.bounds.pop(key)
+
+        if key in self.large:
+            self.large.remove(key)
+            return
+
+        imin, jmin, imax, jmax = self._cell_range(bounds)
+        for i in range(imin, imax + 1):
+            for j in range(jmin, jmax + 1):
+                cell = self.cells[(i, j)]
+                cell.discard(key)
+                if len(cell) == 0:
+                    del self.cells[(i, j)]
+
+    def intersection(self, bounds):
+        """
+        Keys of the items whose bounds intersect the given bounds.
+
+        :param bounds: (xmin, ymin, xmax, ymax)
+        :type bounds: tuple
+        :return: Set of keys.
+        :rtype: set
+        """
+        xmin, ymin, xmax, ymax = bounds
+        imin, jmin, imax, jmax = self._cell_range(bounds)
+
+        candidates = set(self.large)
+        if (imax - imin + 1) * (jmax - jmin + 1) > len(self.cells):
+            for cell in self.cells:
+                if imin <= cell[0] <= imax and jmin <= cell[1] <= jmax:
+                    candidates.update(self.cells[cell])
+        else:
+            for i in range(imin, imax + 1):
+                for j in range(jmin, jmax + 1):
+                    if (i, j) in self.cells:
+                        candidates.update(self.cells[(i, j)])
+
+        result = set()
+        for key in candidates:
+            kxmin, kymin, kxmax, kymax = self.bounds[key]
+            if kxmin <= xmax and kxmax >= xmin and kymin <= ymax and kymax >= ymin:
+                result.add(key)
+        return result
+
+    def __len__(self):
+        return len(self.bounds)
+
+
+class GeometryCache(object):
+    """
+    Content-addressed cache of parsed files on disk.
+
+    Entries are keyed by a hash of the file's contents plus the
+    class of the object and the settings that affect the result of
+    parsing, so a file is found again wherever it is and whatever
+    its name, and changing a setting just misses the cache. Each
+    entry holds the object's ``parsed_attrs`` in binary form (see
+    ``pack()``). When the entries take more than ``max_size`` bytes
+    the least recently used are removed.
+
+    Usage::
+
+        key = cache.key(filename, gerber)
+        if not cache.load(key, gerber):
+            gerber.parse_file(filename)
+            cache.store(key, gerber)
+    """
+
+    # Change whenever the parsers or parsed_attrs change
+    # what is stored, so old entries are not used.
+    version = 3
+
+    def __init__(self, path, max_size=256*1024*1024):
+        """
+
+        :param path: Directory for the cache. Created if missing.
+        :type path: str
+        :param max_size: Total size of the entries in bytes.
+        :type max_size: int
+        :return: GeometryCache
+        """
+        self.path = path
+        self.max_size = max_size
+
+    @staticmethod
+    def file_hash(filename, chunk_size=1024*1024):
+        """
+        SHA-1 of the contents of a file, read in chunks.
+
+        :param filename: File to hash.
+        :type filename: str
+        :return: Hex digest.
+        :rtype: str
+        """
+        sha = hashlib.sha1()
+        f = open(filename, 'rb')
+        try:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                sha.update(chunk)
+        finally:
+            f.close()
+        return sha.hexdigest()
+
+    def key(self, filename, obj):
+        """
+        Key for the result of parsing ``filename`` into ``obj``.
+
+        :param filename: File to be parsed.
+        :type filename: str
+        :param obj: Object into which the file would be parsed,
+            before parsing.
+        :type obj: Geometry
+        :return: Key
+        :rtype: str
+        """
+        settings = [GeometryCache.version, type(obj).__name__,
+                    obj.units.upper(), repr(obj.arc_tolerance)]
+        sha = hashlib.sha1(GeometryCache.file_hash(filename).encode('ascii'))
+        for setting in settings:
+            sha.update(str(setting).encode('ascii'))
+        return sha.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ".cache")
+
+    def load(self, key, obj):
+        """
+        Sets the ``parsed_attrs`` of ``obj`` from the cache.
+
+        :param key: See ``key()``.
+        :type key: str
+        :param obj: Object to populate.
+        :type obj: Geometry
+        :return: Whether the entry was found. If not, ``obj`` is unchanged.
+        :rtype: bool
+        """
+        filename = self.entry_path(key)
+        try:
+            f = open(filename, 'rb')
+            try:
+                d = unpack(zlib.decompress(f.read()))
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return False
+        except Exception as e:
+            log.warning("Discarding unreadable cache entry %s: %s" % (key, str(e)))
+            self.remove(filename)
+            return False
+
+        if any([attr not in d for attr in obj.parsed_attrs]):
+            return False
+
+        for attr in obj.parsed_attrs:
+            if attr == 'units':
+                obj.set_units(d[attr])
+                continue
+            setattr(obj, attr, d[attr])
+
+        # Most recently used
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        return True
+
+    def store(self, key, obj):
+        """
+        Stores the ``parsed_attrs`` of ``obj`` and evicts
+        old entries if needed. Failures are only logged.
+
+        :param key: See ``key()``.
+        :type key: str
+        :param obj: Parsed object.
+        :type obj: Geometry
+        :return: None
+        """
+        d = dict([(attr, getattr(obj, attr)) for attr in obj.parsed_attrs])
+        data = zlib.compress(pack(d))
+
+        if len(data) > self.max_size:
+            return
+
+        filename = self.entry_path(key)
+        tmp_filename = filename + ".%d.tmp" % os.getpid()
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            f = open(tmp_filename, 'wb')
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            if os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmp_filename, filename)
+        except (IOError, OSError) as e:
+            log.warning("Could not write cache entry %s: %s" % (key, str(e)))
+            self.remove(tmp_filename)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the
+        rest take no more than ``self.max_size`` bytes.
+
+        :return: None
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+
+        entries = []
+        for name in names:
+            if not name.endswith(".cache"):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+
+        total = sum([entry[1] for entry in entries])
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            self.remove(filename)
+            total -= size
+
+    def clear(self):
+        """
+        Removes all entries.
+
+        :return: None
+        """
+        self.max_size, max_size = 0, self.max_size
+        try:
+            self.evict()
+        finally:
+            self.max_size = max_size
+
+    @staticmethod
+    def remove(filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def polygons_of(geometry):
+    """
+    The polygons in any Shapely geometry, recursing into multi-part
+    geometry and collections. Anything else is dropped.
+
+    :param geometry: Shapely geometry.
+    :return: List of Shapely.Polygon
+    :rtype: list
+    """
+    if geometry is None or geometry.is_empty:
+        return []
+
+    if type(geometry) == Polygon:
+        return [geometry]
+
+    try:
+        parts = geometry.geoms
+    except AttributeError:
+        return []
+
+    result = []
+    for part in parts:
+        result += polygons_of(part)
+    return result
+
+
+def signed_area(ring):
+    """
+    Signed area of a ring, positive if counter-clockwise.
+
+    :param ring: Coordinates, shape (n, 2).
+    :type ring: numpy.ndarray
+    :rtype: float
+    """
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * ((x[:-1] * y[1:]).sum() - (x[1:] * y[:-1]).sum())
+
+
+def rings_of(geometry):
+    """
+    Coordinates of the lines in any Shapely geometry: the rings of
+    polygons, line strings and linear rings, recursing into multi-part
+    geometry and collections. Exteriors of polygons are counter-clockwise
+    and their interiors clockwise, so the holes are left out when filled.
+
+    :param geometry: Shapely geometry, or a list of them.
+    :return: List of arrays of shape (n, 2).
+    :rtype: list
+    """
+    if type(geometry) == list:
+        rings = []
+        for geo in geometry:
+            rings += rings_of(geo)
+        return rings
+
+    if geometry is None or geometry.is_empty:
+        return []
+
+    if type(geometry) == Polygon:
+        rings = []
+        for ring, ccw in [(geometry.exterior, True)] + [(ring, False) for ring in geometry.interiors]:
+            coords = array(ring.coords)[:, :2]
+            if (signed_area(coords) > 0) != ccw:
+                coords = coords[::-1]
+            rings.append(coords)
+        return rings
+
+    if type(geometry) in [LineString, LinearRing]:
+        return [array(geometry.coords)[:, :2]]
+
+    try:
+        parts = geometry.geoms
+    except AttributeError:
+        return []
+
+    return rings_of(list(parts))
+
+
+def compound_path(rings):
+    """
+    A single Matplotlib path made of many lines, for drawing
+    them all with one artist.
+
+    :param rings: From ``rings_of()``.
+    :type rings: list
+    :rtype: matplotlib.path.Path
+    """
+    rings = [ring for ring in rings if len(ring) > 0]
+    if len(rings) == 0:
+        return MPLPath(empty((0, 2)))
+
+    vertices = concatenate(rings)
+    codes = full(len(vertices), MPLPath.LINETO, dtype=MPLPath.code_type)
+    starts = cumsum([0] + [len(ring) for ring in rings[:-1]])
+    codes[starts] = MPLPath.MOVETO
+    return MPLPath(vertices, codes)
+
+
+def rings_bounds(rings):
+    """
+    Bounds of each of a list of rings.
+
+    :param rings: From ``rings_of()``.
+    :type rings: list
+    :return: Array of shape (n, 4): xmin, ymin, xmax, ymax.
+    :rtype: numpy.ndarray
+    """
+    bounds = empty((len(rings), 4))
+    for k, ring in enumerate(rings):
+        bounds[k, :2] = ring.min(axis=0)
+        bounds[k, 2:] = ring.max(axis=0)
+    return bounds
+
+
+def plot_rings(axes, rings, solid=False, color="k", facecolor=None, alpha=1.0, zorder=2):
+    """
+    Plots lines with a single artist: a patch with all of them, or
+    filled if ``solid``. ``color`` can be a list of colors, used in
+    turn for each line, instead.
+
+    :param axes: Matplotlib axes on which to plot.
+    :param rings: From ``rings_of()``.
+    :type rings: list
+    :param solid: Fill polygons.
+    :type solid: bool
+    :param color: Color of the lines, or list of colors.
+    :param facecolor: Color of filled polygons.
+    :param alpha: Transparency.
+    :type alpha: float
+    :param zorder: Matplotlib z-order.
+    :type zorder: int
+    :return: The artist.
+    """
+    if type(color) == list:
+        artist = LineCollection(rings, colors=color, alpha=alpha, zorder=zorder)
+    else:
+        artist = PathPatch(compound_path(rings), fill=solid, edgecolor=color,
+                           facecolor=facecolor, alpha=alpha, zorder=zorder)
+
+    # Not add_patch(): limits are set from the bounds of
+    # the objects and finding them here is slow.
+    axes.add_artist(artist)
+    return artist
+
+
+def plot_circles(axes, centers, diameters, solid=False, color="r", facecolor=None,
+                 alpha=1.0, zorder=3):
+    """
+    Plots circles, sized in data units, with a single artist.
+
+    :param axes: Matplotlib axes on which to plot.
+    :param centers: Array of shape (n, 2).
+    :type centers: numpy.ndarray
+    :param diameters: Array of n diameters.
+    :type diameters: numpy.ndarray
+    :param solid: Fill the circles.
+    :type solid: bool
+    :return: The artist.
+    """
+    artist = EllipseCollection(diameters, diameters, zeros(len(diameters)), units='xy',
+                               offsets=centers, transOffset=axes.transData,
+                               facecolors=facecolor if solid else 'none',
+                               edgecolors=color, alpha=alpha, zorder=zorder)
+    axes.add_collection(artist, autolim=False)
+    return artist
+
+
+def union_all(geometries):
+    """
+    Union of a list of geometry. This is what should be used
+    instead of calling ``cascaded_union()`` directly.
+
+    :param geometries: Shapely geometry. None is skipped.
+    :type geometries: list
+    :return: The union.
+    """
+    return unary_union([geo for geo in geometries if geo is not None])
+
+
+# def get_bounds(geometry_set):
+#     xmin = Inf
+#     ymin = Inf
+#     xmax = -Inf
+#     ymax = -Inf
+#
+#     #print "Getting bounds of:", str(geometry_set)
+#     for gs in geometry_set:
+#         try:
+#             gxmin, gymin, gxmax, gymax = geometry_set[gs].bounds()
+#             xmin = min([xmin, gxmin])
+#             ymin = min([ymin, gymin])
+#             xmax = max([xmax, gxmax])
+#             ymax = max([ymax, gymax])
+#         except:
+#             print "DEV WARNING: Tried to get bounds of empty geometry."
+#
+#     return [xmin, ymin, xmax, ymax]
+
+def get_bounds(geometry_list):
+    xmin = Inf
+    ymin = Inf
+    xmax = -Inf
+    ymax = -Inf
+
+    #print "Getting bounds of:", str(geometry_set)
+    for gs in geometry_list:
+        try:
+            gxmin, gymin, gxmax, gymax = gs.bounds()
+            xmin = min([xmin, gxmin])
+            ymin = min([ymin, gymin])
             xmax = max([xmax, gxmax])
             ymax = max([ymax, gymax])
         except:
@@ -2253,10 +4101,467 @@ def get_bounds(geometry_list):
 
     return [xmin, ymin, xmax, ymax]
 
-def arc(center, radius, start, stop, direction, steps_per_circ):
+# Words of G-code used by gcode_columns(), and line ends.
+gcode_word_re = re.compile(br'[GXYZIJ\n][ \t]*[-+]?[0-9.]*', re.IGNORECASE)
+
+# Comments in G-code: (...) and from ; to the end of the line.
+gcode_comment_re = re.compile(br'\([^)\n]*\)|;[^\n]*')
+
+
+def gcode_chunks(data, chunk_size=1 << 22):
+    """
+    Splits G-code into chunks of whole lines.
+
+    :param data: G-code as text, bytes or a memory map.
+    :param chunk_size: Approximate length of each chunk.
+    :type chunk_size: int
+    :return: Generator of (chunk as bytes, fraction of data done).
+    """
+    newline = b"\n" if isinstance(data, (bytes, mmap.mmap)) else u"\n"
+    start = 0
+    while start < len(data):
+        stop = data.find(newline, start + chunk_size)
+        stop = len(data) if stop == -1 else stop + 1
+        chunk = data[start:stop]
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('ascii', 'replace')
+        start = stop
+        yield chunk, float(stop) / len(data)
+
+
+def gcode_map(f):
+    """
+    Memory-maps G-code in a file, to be read from it when used
+    instead of being kept in memory. The map stays valid after
+    the file is closed.
+
+    :param f: File open for reading, flushed.
+    :type f: file
+    :return: The map, or empty bytes if the file is empty.
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def gcode_floats(numbers):
+    """
+    Converts numbers as text. Empty or invalid ones are NaN.
+
+    :param numbers: Numbers as ASCII text.
+    :type numbers: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    numbers[numbers == b''] = b'nan'
+    try:
+        return numbers.astype(float)
+    except ValueError:
+        values = empty(len(numbers))
+        for k, number in enumerate(numbers.tolist()):
+            try:
+                values[k] = float(number)
+            except ValueError:
+                values[k] = float('nan')
+        return values
+
+
+def gcode_columns(chunk):
+    """
+    Reads the words of G-code that define the toolpath. The chunk
+    is tokenized by a single regular expression and the words are
+    placed by line with NumPy, so that no Python code runs for
+    each line.
+
+    :param chunk: G-code, ASCII.
+    :type chunk: bytes
+    :return: Dictionary with arrays of one element for each line:
+        'X', 'Y', 'Z', 'I' and 'J' are the values of those words,
+        NaN where not given, 'G' is the motion mode (0 to 3) or -1,
+        and 'U' is 20 or 21 for lines setting the units (G20 inches,
+        G21 mm) or -1.
+    :rtype: dict
+    """
+    width = 24  # Longest word
+
+    nlines = chunk.count(b"\n") + 1
+    columns = dict([(letter, full(nlines, float('nan'))) for letter in "XYZIJ"])
+    columns['G'] = full(nlines, -1, dtype='i1')
+    columns['U'] = full(nlines, -1, dtype='i1')
+
+    words = gcode_word_re.findall(gcode_comment_re.sub(b'', chunk))
+    if len(words) == 0:
+        return columns
+
+    # First character of each word, in upper case, and the rest.
+    chars = array(words, dtype='S%d' % width).view('u1').reshape(-1, width)
+    codes = chars[:, 0] & ~0x20
+    values = gcode_floats(chars[:, 1:].copy().view('S%d' % (width - 1)).ravel())
+
+    lines = cumsum(codes == ord("\n"))
+
+    for letter in "XYZIJ":
+        sel = codes == ord(letter)
+        columns[letter][lines[sel]] = values[sel]
+
+    sel = codes == ord("G")
+    gvalues = values[sel]
+    motion = (gvalues == 0) | (gvalues == 1) | (gvalues == 2) | (gvalues == 3)
+    columns['G'][lines[sel][motion]] = gvalues[motion]
+    units = (gvalues == 20) | (gvalues == 21)
+    columns['U'][lines[sel][units]] = gvalues[units]
+
+    return columns
+
+
+def path_length(points, start=(0, 0), end=None):
+    """
+    Length of the path from ``start`` through ``points``, in
+    order, and then to ``end``.
+
+    :param points: Points to visit, as an (n, 2) array.
+    :type points: numpy.ndarray
+    :param start: First point of the path.
+    :type start: tuple
+    :param end: Last point of the path. None for ending at
+        the last of ``points``.
+    :type end: tuple
+    :return: Length of the path.
+    :rtype: float
+    """
+    path = [array([start], dtype=float), array(points, dtype=float).reshape(-1, 2)]
+    if end is not None:
+        path.append(array([end], dtype=float))
+    path = concatenate(path)
+    steps = path[1:] - path[:-1]
+    return float(sqrt((steps*steps).sum(axis=1)).sum())
+
+
+def nearest_key(index, coords, x, y, radius):
+    """
+    Key in a ``GridIndex`` of points whose point is nearest to
+    (x, y). The search starts at ``radius`` and doubles it until
+    a point is found within it.
+
+    :param index: Index of points, keyed by their position in ``coords``.
+    :type index: GridIndex
+    :param coords: List of [x, y].
+    :type coords: list
+    :return: The key or None if the index is empty.
+    """
+    while len(index) > 0:
+        best = None
+        best_dist = Inf
+        for key in index.intersection((x - radius, y - radius, x + radius, y + radius)):
+            dist = hypot(coords[key][0] - x, coords[key][1] - y)
+            if dist < best_dist:
+                best = key
+                best_dist = dist
+
+        # Anything outside the box is farther than radius.
+        if best_dist <= radius:
+            return best
+        radius *= 2
+    return None
+
+
+def nearest_neighbor_path(points, start=(0, 0)):
+    """
+    Order of the points in which each is the nearest not yet
+    visited to the previous one, beginning at ``start``.
+
+    :param points: Points to visit, as an (n, 2) array.
+    :type points: numpy.ndarray
+    :param start: Where the path begins.
+    :type start: tuple
+    :return: Indexes of the points in the order to visit them.
+    :rtype: list
+    """
+    coords = array(points, dtype=float).reshape(-1, 2).tolist()
+    if len(coords) == 0:
+        return []
+
+    index = GridIndex(point_cell_size(points))
+    for key, (x, y) in enumerate(coords):
+        index.insert(key, (x, y, x, y))
+
+    order = []
+    x, y = start
+    while len(index) > 0:
+        key = nearest_key(index, coords, x, y, index.cell_size)
+        index.remove(key)
+        order.append(key)
+        x, y = coords[key]
+    return order
+
+
+def point_cell_size(points):
+    """
+    Cell size for a ``GridIndex`` of the points, so that each
+    cell holds a few of them.
+    """
+    points = array(points, dtype=float).reshape(-1, 2)
+    width, height = points.max(axis=0) - points.min(axis=0)
+    side = max(width, height, 1e-6)
+    area = max(width*height, side*side/len(points))
+    return max(2*sqrt(area/len(points)), 1e-6)
+
+
+def optimize_path(points, start=(0, 0), end=None, time_budget=1.0, neighbors=8):
+    """
+    A short path from ``start`` through all ``points``, and to
+    ``end`` if given. The nearest neighbor path is improved with
+    2-opt (reversing part of the path) and Or-opt (moving runs of
+    up to 3 points elsewhere) until no move shortens it or the
+    time is up. Only moves joining a point to one of its nearest
+    ``neighbors`` are tried.
+
+    :param points: Points to visit, as an (n, 2) array.
+    :type points: numpy.ndarray
+    :param start: Where the path begins.
+    :type start: tuple
+    :param end: Where the path ends. None for anywhere.
+    :type end: tuple
+    :param time_budget: Seconds to spend improving the path.
+    :type time_budget: float
+    :param neighbors: Number of candidates for each point.
+    :type neighbors: int
+    :return: Indexes of the points in the order to visit them.
+    :rtype: list
+    """
+    deadline = time.time() + time_budget
+    order = nearest_neighbor_path(points, start)
+    n = len(order)
+    if n < 3:
+        return order
+
+    # start and end are added as points n and n + 1.
+    coords = array(points, dtype=float).reshape(-1, 2).tolist()
+    coords.append(list(start))
+    tour = [n] + order
+    if end is not None:
+        coords.append(list(end))
+        tour.append(n + 1)
+    length = len(tour)
+
+    # Last position that can change.
+    last = n
+
+    ## Candidates
+    index = GridIndex(point_cell_size(points))
+    for key in range(n):
+        x, y = coords[key]
+        index.insert(key, (x, y, x, y))
+    near = []
+    for key, (x, y) in enumerate(coords):
+        radius = index.cell_size
+        keys = index.intersection((x - radius, y - radius, x + radius, y + radius))
+        while len(keys) <= neighbors and len(keys) < n:
+            radius *= 2
+            keys = index.intersection((x - radius, y - radius, x + radius, y + radius))
+        keys.discard(key)
+        keys = sorted(keys, key=lambda k: hypot(coords[k][0] - x, coords[k][1] - y))
+        near.append(keys[:neighbors])
+
+    def dist(a, b):
+        if b is None:
+            return 0.0
+        return hypot(coords[a][0] - coords[b][0], coords[a][1] - coords[b][1])
+
+    pos = [0]*len(coords)
+    for i, key in enumerate(tour):
+        pos[key] = i
+
+    def place(first, stop):
+        for i in range(first, stop):
+            pos[tour[i]] = i
+
+    def reverse(first, stop):
+        tour[first:stop] = tour[first:stop][::-1]
+        place(first, stop)
+
+    def next_of(i):
+        return tour[i + 1] if i + 1 < length else None
+
+    def two_opt(i):
+        a = tour[i]
+        b = next_of(i)
+        for c in near[a]:
+            j = pos[c]
+            if j > i + 1:
+                # a, b ... c, d -> a, c ... b, d
+                d = next_of(j)
+                if dist(a, b) + dist(c, d) - dist(a, c) - dist(b, d) > 1e-9:
+                    reverse(i + 1, j + 1)
+                    return True
+            elif j < i - 1 and i <= last:
+                # c, e ... a, b -> c, a ... e, b
+                e = tour[j + 1]
+                if dist(c, e) + dist(a, b) - dist(c, a) - dist(e, b) > 1e-9:
+                    reverse(j + 1, i + 1)
+                    return True
+        return False
+
+    def or_opt(i, size):
+        if i + size - 1 > last:
+            return False
+        p = tour[i - 1]
+        f = tour[i]
+        l = tour[i + size - 1]
+        x = next_of(i + size - 1)
+        removed = dist(p, f) + dist(l, x) - dist(p, x)
+        if removed <= 1e-9:
+            return False
+
+        for c in near[f] + near[l]:
+            j = pos[c]
+            if i <= j < i + size:
+                continue
+            # Edges (c, after c) and (before c, c).
+            for u, v in [(c, next_of(j)), (tour[j - 1], c)]:
+                if u in (p, l) or v == f:
+                    continue
+                if dist(u, f) + dist(l, v) - dist(u, v) < removed - 1e-9:
+                    flip = False
+                elif dist(u, l) + dist(f, v) - dist(u, v) < removed - 1e-9:
+                    flip = True
+                else:
+                    continue
+
+                run = tour[i:i + size]
+                if flip:
+                    run.reverse()
+                del tour[i:i + size]
+                k = tour.index(u, max(pos[u] - size, 0)) + 1
+                tour[k:k] = run
+                place(min(i, k), max(i + size, k + size))
+                return True
+        return False
+
+    improved = True
+    while improved:
+        improved = False
+        for i in range(length):
+            if time.time() > deadline:
+                return [key for key in tour if key < n]
+            if two_opt(i):
+                improved = True
+            for size in (1, 2, 3):
+                if 1 <= i and or_opt(i, size):
+                    improved = True
+
+    return [key for key in tour if key < n]
+
+
+def travel_length(paths, start=(0, 0), end=(0, 0)):
+    """
+    Length of the moves from ``start`` to the first path, from
+    the end of each path to the beginning of the next and from
+    the last path to ``end``.
+
+    :param paths: Lists of (x, y).
+    :type paths: list
+    :return: Travel length.
+    :rtype: float
+    """
+    position = start
+    length = 0.0
+    for path in paths:
+        length += hypot(path[0][0] - position[0], path[0][1] - position[1])
+        position = path[-1]
+    return length + hypot(end[0] - position[0], end[1] - position[1])
+
+
+def sequence_paths(paths, start=(0, 0)):
+    """
+    Order and entry points for cutting the paths with little
+    travel between them. From where the tool is, the next path is
+    the one that can be entered nearest: closed paths at any of
+    their vertices and open paths at either end, cutting them
+    backwards if entered at the last point. Closed paths keep
+    their direction. Paths are found with a ``GridIndex`` of their
+    bounds.
+
+    :param paths: List of (coordinates, closed), as from
+        ``CNCjob.toolpaths()``.
+    :type paths: list
+    :param start: Where the tool is.
+    :type start: tuple
+    :return: Lists of (x, y), in the order to cut them. Closed
+        paths are rotated to begin and end at their entry point.
+    :rtype: list
+    """
+    if len(paths) == 0:
+        return []
+
+    arrays = [array(coords, dtype=float).reshape(-1, 2) for coords, closed in paths]
+    # Points where each path can be entered.
+    entries = []
+    for (coords, closed), points in zip(paths, arrays):
+        if closed:
+            entries.append(points[:-1])
+        else:
+            entries.append(points[[0, -1]])
+
+    bounds = [tuple(points.min(axis=0).tolist() + points.max(axis=0).tolist())
+              for points in arrays]
+    centers = array([((b[0] + b[2])/2, (b[1] + b[3])/2) for b in bounds])
+    index = GridIndex(point_cell_size(centers))
+    for key in range(len(paths)):
+        index.insert(key, bounds[key])
+
+    result = []
+    x, y = start
+    while len(index) > 0:
+        radius = index.cell_size
+        while True:
+            # Nearest first by distance to their bounds, which no
+            # entry point can be nearer than.
+            candidates = []
+            for key in index.intersection((x - radius, y - radius, x + radius, y + radius)):
+                xmin, ymin, xmax, ymax = bounds[key]
+                dx = max(xmin - x, 0, x - xmax)
+                dy = max(ymin - y, 0, y - ymax)
+                candidates.append((dx*dx + dy*dy, key))
+            candidates.sort()
+
+            best = None
+            best_dist = Inf
+            for lower, key in candidates:
+                if lower >= best_dist:
+                    break
+                steps = entries[key] - (x, y)
+                dists = (steps*steps).sum(axis=1)
+                entry = int(dists.argmin())
+                if dists[entry] < best_dist:
+                    best = (key, entry)
+                    best_dist = dists[entry]
+
+            # Entry points outside the box are farther than radius.
+            if best_dist <= radius*radius:
+                break
+            radius *= 2
+
+        key, entry = best
+        index.remove(key)
+        points = arrays[key]
+        if paths[key][1]:
+            points = concatenate([points[entry:-1], points[:entry + 1]])
+        elif entry == 1:
+            points = points[::-1]
+        result.append(points.tolist())
+        x, y = result[-1][-1]
+
+    return result
+
+
+def arc(center, radius, start, stop, direction, tolerance):
     """
     Creates a list of point along the specified arc.
 
+    The number of segments is the least for which no point of
+    the arc is farther than ``tolerance`` from them, so small
+    arcs get few points and large ones stay accurate.
+
     :param center: Coordinates of the center [x, y]
     :type center: list
     :param radius: Radius of the arc.
@@ -2267,30 +4572,137 @@ def arc(center, radius, start, stop, direction, steps_per_circ):
     :type stop: float
     :param direction: Orientation of the arc, "CW" or "CCW"
     :type direction: string
-    :param steps_per_circ: Number of straight line segments to
-        represent a circle.
-    :type steps_per_circ: int
+    :param tolerance: Largest distance between the arc and the
+        segments representing it, in the units of the coordinates.
+    :type tolerance: float
     :return: The desired arc, as list of tuples
     :rtype: list
     """
-    # TODO: Resolution should be established by fraction of total length, not angle.
 
     da_sign = {"cw": -1.0, "ccw": 1.0}
-    points = []
     if direction == "ccw" and stop <= start:
         stop += 2*pi
     if direction == "cw" and stop >= start:
         stop -= 2*pi
-    
+
     angle = abs(stop - start)
-        
-    #angle = stop-start
-    steps = max([int(ceil(angle/(2*pi)*steps_per_circ)), 2])
-    delta_angle = da_sign[direction]*angle*1.0/steps
-    for i in range(steps+1):
-        theta = start + delta_angle*i
-        points.append((center[0]+radius*cos(theta), center[1]+radius*sin(theta)))
-    return points
+
+    # A chord spanning an angle a is at most r*(1 - cos(a/2)) away
+    # from its arc. No more than 1/8 of a circle per segment.
+    if 0 < tolerance < radius:
+        max_step = min(2*arccos(1 - float(tolerance)/radius), pi/4)
+    else:
+        max_step = pi/4
+    steps = max(int(ceil(angle/max_step)), 2)
+
+    theta = start + da_sign[direction]*angle*arange(steps + 1)/steps
+    return list(zip((center[0] + radius*cos(theta)).tolist(),
+                    (center[1] + radius*sin(theta)).tolist()))
+
+
+def circle_through(a, b, c):
+    """
+    Circle through 3 points.
+
+    :return: (center, radius) or None if the points are collinear.
+    :rtype: tuple
+    """
+    # Relative to a, for precision.
+    bx, by = b[0] - a[0], b[1] - a[1]
+    cx, cy = c[0] - a[0], c[1] - a[1]
+    d = 2*(bx*cy - by*cx)
+    if d == 0:
+        return None
+    b2 = bx*bx + by*by
+    c2 = cx*cx + cy*cy
+    ux = (cy*b2 - by*c2)/d
+    uy = (bx*c2 - cx*b2)/d
+    return (a[0] + ux, a[1] + uy), hypot(ux, uy)
+
+
+def arc_through(points, tolerance, max_radius, max_sweep):
+    """
+    Arc from the first to the last of the points, passing within
+    ``tolerance`` of all of them and of the segments between them.
+    Used by ``fit_arcs()``.
+
+    :param points: Array of shape (n, 2), n >= 3.
+    :type points: numpy.ndarray
+    :return: (center, "cw" or "ccw") or None if there is no such arc.
+    :rtype: tuple
+    """
+    circle = circle_through(points[0], points[len(points)//2], points[-1])
+    if circle is None or circle[1] > max_radius:
+        return None
+    center, radius = circle
+
+    v = points - center
+    if abs(sqrt((v*v).sum(axis=1)) - radius).max() > tolerance:
+        return None
+
+    # Angle from each point to the next, seen from the center.
+    steps = arctan2(v[:-1, 0]*v[1:, 1] - v[:-1, 1]*v[1:, 0],
+                    (v[:-1]*v[1:]).sum(axis=1))
+    if not ((steps > 0).all() or (steps < 0).all()):
+        return None
+    if abs(steps.sum()) > max_sweep:
+        return None
+
+    # The middle of a segment is the farthest from the arc.
+    if radius*(1 - cos(abs(steps).max()/2)) > tolerance:
+        return None
+
+    return center, "ccw" if steps[0] > 0 else "cw"
+
+
+def fit_arcs(path, tolerance, min_segments=3, max_radius=None, max_sweep=pi):
+    """
+    Replaces runs of segments of a path with circular arcs,
+    where the segments are within ``tolerance`` of an arc. Runs
+    are taken greedily from the start of the path, each as long
+    as it can be.
+
+    :param path: List of (x, y).
+    :type path: list
+    :param tolerance: Largest distance between the arcs and
+        the points and segments they replace.
+    :type tolerance: float
+    :param min_segments: Fewest segments replaced by an arc.
+    :type min_segments: int
+    :param max_radius: Largest radius of the arcs. Nearly straight
+        runs are left as segments. 10000 times the tolerance if None.
+    :type max_radius: float
+    :param max_sweep: Largest angle of an arc, in radians.
+    :type max_sweep: float
+    :return: List of (index, center, direction), one for each move
+        along the path, to the point at that index. Center is
+        None for straight moves, and direction is "cw" or "ccw".
+    :rtype: list
+    """
+    if max_radius is None:
+        max_radius = 10000*tolerance
+
+    points = array(path, dtype=float).reshape(-1, 2)
+    moves = []
+    i = 0
+    while i < len(points) - 1:
+        best = None
+        j = i + min_segments
+        while j < len(points):
+            fit = arc_through(points[i:j + 1], tolerance, max_radius, max_sweep)
+            if fit is None:
+                break
+            best = (j, fit[0], fit[1])
+            j += 1
+
+        if best is None:
+            moves.append((i + 1, None, None))
+            i += 1
+        else:
+            moves.append(best)
+            i = best[0]
+
+    return moves
 
 
 def clear_poly(poly, tooldia, overlap=0.1):
@@ -2334,6 +4746,8 @@ def find_polygon(poly_set, point):
 def to_dict(obj):
     """
     Makes a Shapely geometry object into serializeable form.
+    Geometry is stored as base64-encoded WKB, which is exact,
+    smaller and much faster to write and read than WKT.
 
     :param obj: Shapely geometry.
     :type obj: BaseGeometry
@@ -2347,21 +4761,24 @@ def to_dict(obj):
         }
     if isinstance(obj, BaseGeometry):
         return {
-            "__class__": "Shply",
-            "__inst__": sdumps(obj)
+            "__class__": "ShplyWKB",
+            "__inst__": base64.b64encode(wkb_dumps(obj)).decode('ascii')
         }
     return obj
 
 
 def dict2obj(d):
     """
-    Default deserializer.
+    Default deserializer. Reads geometry written as WKB
+    by ``to_dict()`` and as WKT by older versions.
 
     :param d:  Serializable dictionary representation of an object
         to be reconstructed.
     :return: Reconstructed object.
     """
     if '__class__' in d and '__inst__' in d:
+        if d['__class__'] == "ShplyWKB":
+            return wkb_loads(base64.b64decode(d['__inst__']))
         if d['__class__'] == "Shply":
             return sloads(d['__inst__'])
         if d['__class__'] == "ApertureMacro":
@@ -2373,6 +4790,140 @@ def dict2obj(d):
         return d
 
 
+# Unicode strings, both in Python 2 and 3.
+text_type = type(u"")
+
+
+def pack(obj):
+    """
+    Binary form of nested lists, tuples and dictionaries of numbers,
+    strings, Shapely geometry, ApertureMacro and NumPy arrays. Memory
+    maps are read and packed as bytes. The
+    structure is written as JSON and is followed by the geometry as WKB,
+    the arrays and long strings, so reading it back with ``unpack()``
+    never runs anything found in the data, as unpickling would.
+
+    Layout::
+
+        JSON length (unsigned 64-bit, little endian)
+        JSON, with {"__class__": ..., "__blob__": [offset, length]}
+            in place of the binary parts
+        binary parts, offsets counted from here
+
+    :param obj: Object to pack.
+    :return: Packed object.
+    :rtype: bytes
+    """
+    buffers = []
+    position = [0]
+
+    def blob(data):
+        buffers.append(data)
+        position[0] += len(data)
+        return [position[0] - len(data), len(data)]
+
+    def encode(obj):
+        if isinstance(obj, BaseGeometry):
+            return {"__class__": "WKB", "__blob__": blob(wkb_dumps(obj))}
+        if isinstance(obj, ApertureMacro):
+            return {"__class__": "ApertureMacro", "__inst__": encode(obj.to_dict())}
+        if isinstance(obj, ndarray):
+            if obj.dtype.hasobject:
+                raise TypeError("Cannot pack an array of objects.")
+            return {"__class__": "ndarray",
+                    "dtype": obj.dtype.str if obj.dtype.names is None else obj.dtype.descr,
+                    "shape": list(obj.shape),
+                    "__blob__": blob(ascontiguousarray(obj).tobytes())}
+        if isinstance(obj, generic):  # NumPy scalar
+            return obj.item()
+        if isinstance(obj, dict):
+            if all([isinstance(key, (str, text_type)) for key in obj]):
+                return dict([(key, encode(obj[key])) for key in obj])
+            return {"__class__": "dict",
+                    "items": [[encode(key), encode(obj[key])] for key in obj]}
+        if isinstance(obj, list):
+            return [encode(item) for item in obj]
+        if isinstance(obj, tuple):
+            return {"__class__": "tuple", "items": [encode(item) for item in obj]}
+        if isinstance(obj, bytes) and bytes is not str:
+            return {"__class__": "bytes", "__blob__": blob(obj)}
+        if isinstance(obj, mmap.mmap):  # G-code mapped from a file
+            return {"__class__": "bytes", "__blob__": blob(obj[:])}
+        if isinstance(obj, (str, text_type)) and len(obj) > 256:
+            if isinstance(obj, text_type):
+                obj = obj.encode('utf-8')
+            return {"__class__": "text", "__blob__": blob(obj)}
+        return obj
+
+    doc = json.dumps(encode(obj)).encode('utf-8')
+    return b"".join([struct.pack("<Q", len(doc)), doc] + buffers)
+
+
+def unpack(data):
+    """
+    Reverses ``pack()``. Arrays are writable views of a single
+    copy of the binary parts.
+
+    :param data: Packed object.
+    :type data: bytes
+    :return: The object.
+    :raises ValueError: If ``data`` is not a packed object.
+    """
+    if len(data) < 8:
+        raise ValueError("Packed data too short.")
+    length = struct.unpack("<Q", data[:8])[0]
+    doc = json.loads(data[8:8 + length].decode('utf-8'))
+    buffers = bytearray(data[8 + length:])
+
+    def location(obj):
+        offset, size = obj["__blob__"]
+        if offset < 0 or size < 0 or offset + size > len(buffers):
+            raise ValueError("Packed data truncated.")
+        return offset, size
+
+    def part(obj):
+        offset, size = location(obj)
+        return bytes(buffers[offset:offset + size])
+
+    def decode(obj):
+        if isinstance(obj, list):
+            return [decode(item) for item in obj]
+        if not isinstance(obj, dict):
+            return obj
+
+        kind = obj.get("__class__")
+        if kind == "WKB":
+            return wkb_loads(part(obj))
+        if kind == "ApertureMacro":
+            am = ApertureMacro()
+            am.from_dict(decode(obj["__inst__"]))
+            return am
+        if kind == "ndarray":
+            descr = obj["dtype"]
+            if not isinstance(descr, (str, text_type)):
+                descr = [tuple(field) for field in descr]
+            dt = dtype(descr)
+            if dt.hasobject:
+                raise ValueError("Packed array of objects.")
+            offset, size = location(obj)
+            shape = tuple(obj["shape"])
+            count = int(prod(shape))
+            if count * dt.itemsize != size:
+                raise ValueError("Packed array of the wrong size.")
+            return frombuffer(buffers, dtype=dt, count=count, offset=offset).reshape(shape)
+        if kind == "dict":
+            return dict([(decode(key), decode(value)) for key, value in obj["items"]])
+        if kind == "tuple":
+            return tuple([decode(item) for item in obj["items"]])
+        if kind == "bytes":
+            return part(obj)
+        if kind == "text":
+            return part(obj) if bytes is str else part(obj).decode('utf-8')
+        return dict([(key, decode(obj[key])) for key in obj])
+
+    return decode(doc)
+
+
 def plotg(geo):
     try:
         _ = iter(geo)
@@ -2406,6 +4957,83 @@ def plotg(geo):
             continue
 
 
+def gerber_geometry(primitives):
+    """
+    Creates the geometry of Gerber primitives, as recorded by
+    ``Gerber.parse_lines()``, and returns their union. This is a
+    module function so it can be run in a worker process.
+
+    :param primitives: List of ('track', width, path), ('region', path)
+        and ('flash', template, locations).
+    :type primitives: list
+    :return: Union of the geometry.
+    :rtype: Shapely.Polygon or Shapely.MultiPolygon
+    """
+
+    geometry = []
+
+    for prim in primitives:
+        if prim[0] == 'track':
+            geometry.append(LineString(prim[2]).buffer(prim[1]/2))
+            continue
+
+        if prim[0] == 'region':
+            region = Polygon(prim[1])
+            if not region.is_valid:
+                region = region.buffer(0)
+            geometry.append(region)
+            continue
+
+        if prim[0] == 'flash':
+            geometry += Gerber.flash_instances(prim[1], prim[2])
+            continue
+
+    return union_all(geometry)
+
+
+def file_lines(filename, chunk_size=65536, split_long=None):
+    """
+    Generator of the lines in a file. The file is read in chunks
+    of ``chunk_size`` characters so only one chunk and a partial
+    line are in memory at any time, and the consumer can start
+    working before the whole file has been read.
+
+    :param filename: File to read.
+    :type filename: str
+    :param chunk_size: Number of characters read at a time.
+    :type chunk_size: int
+    :param split_long: If given, lines longer than ``chunk_size``
+        are handed over in pieces, each ending in this string.
+        Used for formats that can be written without line breaks.
+    :type split_long: str
+    :return: Generator of lines, without the line break.
+    """
+
+    f = open(filename, 'r')
+    try:
+        tail = ""  # Incomplete line
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                yield line
+
+            if split_long is not None and len(tail) > chunk_size:
+                cut = tail.rfind(split_long) + len(split_long)
+                if cut >= len(split_long):
+                    yield tail[:cut]
+                    tail = tail[cut:]
+
+        if tail:
+            yield tail
+    finally:
+        f.close()
+
+
 def parse_gerber_number(strnumber, frac_digits):
     """
     Parse a single number of Gerber coordinates.
@@ -0,0 +1,232 @@
+"""
+Benchmark of the Gerber and Excellon parsers on a synthetic
+board from ``synthetic_board.py``. Reports, as JSON, the time
+spent in each step, vertex counts of the resulting geometry
+and peak memory.
+
+Each run is done in a fresh worker process so that memory
+figures are not polluted by previous runs. Example::
+
+    python benchmark_parsers.py --pads 20000 --tracks 5000 --repeat 3 -o baseline.json
+"""
+
+import os
+import sys
+import time
+import json
+import resource
+import tempfile
+import argparse
+import platform
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from camlib import Gerber, Excellon, polygons_of, union_all
+from synthetic_board import add_board_arguments, board_from_arguments
+
+
+def vertex_count(geometry):
+    """
+    Number of vertices in the polygons of a geometry or list of them.
+    """
+    if type(geometry) != list:
+        geometry = [geometry]
+
+    count = 0
+    for geo in geometry:
+        for poly in polygons_of(geo):
+            count += len(poly.exterior.coords)
+            count += sum([len(ring.coords) for ring in poly.interiors])
+    return count
+
+
+def peak_rss_kb():
+    """
+    Peak resident memory of this process in kB (Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def timed(obj, name, times):
+    """
+    Replaces the method ``name`` of ``obj`` with one that adds
+    the time it takes to ``times[name]``.
+    """
+    method = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            times[name] = times.get(name, 0.0) + time.time() - start
+
+    setattr(obj, name, wrapper)
+
+
+def run_gerber(filename, processes):
+    rss_start = peak_rss_kb()
+    times = {}
+
+    g = Gerber()
+    timed(g, 'make_geometry', times)
+    timed(g, 'compose_layers', times)
+
+    start = time.time()
+    g.parse_file(filename, processes=processes)
+    times['parse_file'] = time.time() - start
+
+    start = time.time()
+    g.create_geometry()
+    times['create_geometry'] = time.time() - start
+
+    return {
+        "times": {
+            "parse": times['parse_file'] - times.get('make_geometry', 0.0) -
+                     times.get('compose_layers', 0.0),
+            "geometry": times.get('make_geometry', 0.0),
+            "union": times.get('compose_layers', 0.0),
+            "parse_file": times['parse_file'],
+            "create_geometry": times['create_geometry']
+        },
+        "polygons": len(polygons_of(g.solid_geometry)),
+        "vertices": vertex_count(g.solid_geometry),
+        "peak_rss_kb": peak_rss_kb(),
+        "peak_rss_delta_kb": peak_rss_kb() - rss_start
+    }
+
+
+def run_excellon(filename):
+    rss_start = peak_rss_kb()
+
+    ex = Excellon()
+
+    start = time.time()
+    ex.parse_file(filename)
+    parse_time = time.time() - start
+
+    # The circles are made when first used.
+    start = time.time()
+    ex.create_geometry()
+    _ = ex.solid_geometry
+    create_time = time.time() - start
+
+    start = time.time()
+    union = union_all(ex.solid_geometry)
+    union_time = time.time() - start
+
+    return {
+        "times": {
+            "parse_file": parse_time,
+            "create_geometry": create_time,
+            "union": union_time
+        },
+        "drills": len(ex.drill_points()),
+        "polygons": len(polygons_of(union)),
+        "vertices": vertex_count(ex.solid_geometry),
+        "union_vertices": vertex_count(union),
+        "peak_rss_kb": peak_rss_kb(),
+        "peak_rss_delta_kb": peak_rss_kb() - rss_start
+    }
+
+
+def isolated(function, *args):
+    """
+    Runs ``function(*args)`` in a new process and returns the result.
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(function, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def best_of(runs):
+    """
+    Combines several runs of the same benchmark. Times are the
+    least of each, memory the largest.
+    """
+    result = dict(runs[0])
+    result["times"] = dict([(key, min([run["times"][key] for run in runs]))
+                            for key in runs[0]["times"]])
+    for key in ["peak_rss_kb", "peak_rss_delta_kb"]:
+        result[key] = max([run[key] for run in runs])
+    result["runs"] = len(runs)
+    return result
+
+
+def benchmark(board, repeat=1, processes=1, workdir=None):
+    """
+    Writes the board's files and benchmarks them.
+
+    :param board: The board.
+    :type board: SyntheticBoard
+    :param repeat: Number of times each benchmark is run.
+    :type repeat: int
+    :param processes: Passed on to the Gerber parser.
+    :type processes: int
+    :param workdir: Where to write the files. A temporary
+        directory is used and removed if not given.
+    :type workdir: str
+    :return: The report.
+    :rtype: dict
+    """
+    tmpdir = None
+    if workdir is None:
+        tmpdir = tempfile.mkdtemp(prefix="flatcam_bench_")
+        workdir = tmpdir
+
+    gerber_filename = os.path.join(workdir, "board.gbr")
+    excellon_filename = os.path.join(workdir, "board.drl")
+
+    try:
+        board.write_gerber(gerber_filename)
+        board.write_excellon(excellon_filename)
+
+        report = {
+            "board": board.params(),
+            "files": {
+                "gerber_bytes": os.path.getsize(gerber_filename),
+                "excellon_bytes": os.path.getsize(excellon_filename)
+            },
+            "processes": processes,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "gerber": best_of([isolated(run_gerber, gerber_filename, processes)
+                               for _ in range(repeat)]),
+            "excellon": best_of([isolated(run_excellon, excellon_filename)
+                                 for _ in range(repeat)])
+        }
+    finally:
+        if tmpdir is not None:
+            for filename in [gerber_filename, excellon_filename]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+            os.rmdir(tmpdir)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the Gerber and Excellon parsers.")
+    add_board_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--workdir', default=None,
+                        help="Keep the generated files in this directory.")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Write the report to this file instead of stdout.")
+    args = parser.parse_args()
+
+    report = benchmark(board_from_arguments(args), repeat=args.repeat,
+                       processes=args.processes, workdir=args.workdir)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        f = open(args.output, 'w')
+        f.write(text + "\n")
+        f.close()
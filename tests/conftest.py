@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules under test are at the top of the repository.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# Scripts meant to be run by hand, not collected.
+collect_ignore = ["test_excellon_1.py"]
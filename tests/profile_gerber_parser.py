@@ -1,8 +1,21 @@
 import os
-os.chdir('../')
+import sys
+import cProfile
+import pstats
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
 from camlib import *
+from synthetic_board import SyntheticBoard
 
-g = Gerber()
-g.parse_file(r'C:\Users\jpcaram\Dropbox\CNC\pcbcam\test_files\PlacaReles-F_Cu.gtl')
+# A Gerber file can be given, otherwise a synthetic board is used.
+if len(sys.argv) > 1:
+    filename = sys.argv[1]
+else:
+    filename = os.path.join(tempfile.gettempdir(), "flatcam_profile.gbr")
+    SyntheticBoard(pads=5000, tracks=2000, arcs=500, layers=3).write_gerber(filename)
 
+g = Gerber()
+cProfile.run('g.parse_file(filename)', 'gerber_parser.prof')
+pstats.Stats('gerber_parser.prof').sort_stats('cumulative').print_stats(30)
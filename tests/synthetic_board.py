@@ -0,0 +1,246 @@
+"""
+Generator of synthetic RS-274X (Gerber) and Excellon files
+for benchmarking the parsers. The same parameters and seed
+always give the same files.
+
+Run as a script to write a pair of files::
+
+    python synthetic_board.py --pads 5000 --tracks 2000 board
+"""
+
+import random
+import argparse
+
+
+class SyntheticBoard(object):
+    """
+    A random board with pads, tracks, arcs, regions and
+    clear polarity layers, in inches.
+
+    Pads are flashed with circular, rectangular, obround and
+    macro apertures. The ``layers`` polarity layers alternate
+    between dark (LPD) layers, sharing all the primitives, and
+    clear (LPC) layers, sharing a tenth of the pads, so that
+    the polarity handling gets exercised.
+    """
+
+    def __init__(self, pads=1000, tracks=500, arcs=100, macros=100,
+                 regions=20, layers=1, holes=500, width=6.0, height=4.0,
+                 seed=0):
+        """
+        :param pads: Number of flashed pads.
+        :param tracks: Number of tracks (2 to 5 linear segments each).
+        :param arcs: Number of circular arcs.
+        :param macros: Number of pads flashed with macro apertures.
+            These are part of ``pads``.
+        :param regions: Number of G36/G37 regions.
+        :param layers: Number of polarity layers.
+        :param holes: Number of drill holes in the Excellon file.
+        :param width: Board width.
+        :param height: Board height.
+        :param seed: Seed for the random generator.
+        """
+        self.pads = pads
+        self.tracks = tracks
+        self.arcs = arcs
+        self.macros = min(macros, pads)
+        self.regions = regions
+        self.layers = max(layers, 1)
+        self.holes = holes
+        self.width = width
+        self.height = height
+        self.seed = seed
+
+    def params(self):
+        """
+        :return: The parameters of the board.
+        :rtype: dict
+        """
+        return dict(self.__dict__)
+
+    @staticmethod
+    def coord(value):
+        """
+        A coordinate in 2.4 format without the decimal point.
+        """
+        return "%d" % int(round(value * 10000))
+
+    def point(self, rnd, margin=0.1):
+        return (rnd.uniform(margin, self.width - margin),
+                rnd.uniform(margin, self.height - margin))
+
+    @staticmethod
+    def split(count, parts):
+        """
+        ``count`` split in ``parts`` almost equal integers.
+        """
+        return [count // parts + (1 if i < count % parts else 0)
+                for i in range(parts)]
+
+    def gerber_lines(self):
+        """
+        Generates the lines of the Gerber file.
+
+        :return: Lines of Gerber code without line terminators.
+        :rtype: generator
+        """
+        rnd = random.Random(self.seed)
+        c = SyntheticBoard.coord
+
+        yield "G04 Synthetic board*"
+        yield "%FSLAX24Y24*%"
+        yield "%MOIN*%"
+        yield "%AMPADX*21,1,$1,$2,0,0,0*1,1,$3,0,0*%"
+        yield "%AMTHERM*7,0,0,0.0800,0.0600,0.0120,45*%"
+        yield "%ADD10C,0.0100*%"
+        yield "%ADD11C,0.0600*%"
+        yield "%ADD12R,0.0600X0.0400*%"
+        yield "%ADD13O,0.0600X0.0400*%"
+        yield "%ADD14PADX,0.0700X0.0500X0.0300*%"
+        yield "%ADD15THERM*%"
+        yield "G75*"
+
+        # Clear layers only get pads. Whatever is left goes
+        # to the dark layers.
+        nclear = self.layers // 2
+        ndark = self.layers - nclear
+        clear_pads = self.split(self.pads // 10 if nclear > 0 else 0, max(nclear, 1))
+        dark_pads = self.split(self.pads - sum(clear_pads), ndark)
+        dark_macros = self.split(self.macros, ndark)
+        dark_tracks = self.split(self.tracks, ndark)
+        dark_arcs = self.split(self.arcs, ndark)
+        dark_regions = self.split(self.regions, ndark)
+
+        for layer in range(self.layers):
+            if layer % 2 == 1:
+                yield "%LPC*%"
+                yield "D11*"
+                for _ in range(clear_pads[layer // 2]):
+                    x, y = self.point(rnd)
+                    yield "X%sY%sD03*" % (c(x), c(y))
+                continue
+
+            k = layer // 2
+            yield "%LPD*%"
+
+            ## Pads
+            current = None
+            for n in range(dark_pads[k]):
+                if n < dark_macros[k]:
+                    aperture = rnd.choice(("D14", "D15"))
+                else:
+                    aperture = rnd.choice(("D11", "D12", "D13"))
+                if aperture != current:
+                    yield aperture + "*"
+                    current = aperture
+                x, y = self.point(rnd)
+                yield "X%sY%sD03*" % (c(x), c(y))
+
+            ## Tracks
+            yield "D10*"
+            yield "G01*"
+            for _ in range(dark_tracks[k]):
+                x, y = self.point(rnd)
+                yield "X%sY%sD02*" % (c(x), c(y))
+                for _ in range(rnd.randint(2, 5)):
+                    x = min(max(x + rnd.uniform(-0.3, 0.3), 0.0), self.width)
+                    y = min(max(y + rnd.uniform(-0.3, 0.3), 0.0), self.height)
+                    yield "X%sY%sD01*" % (c(x), c(y))
+
+            ## Arcs
+            for _ in range(dark_arcs[k]):
+                cx, cy = self.point(rnd, margin=0.6)
+                r = rnd.uniform(0.02, 0.5)
+                yield "X%sY%sD02*" % (c(cx + r), c(cy))
+                yield "%sX%sY%sI%sJ0D01*" % (rnd.choice(("G02", "G03")),
+                                             c(cx), c(cy + r), c(-r))
+            yield "G01*"
+
+            ## Regions
+            for _ in range(dark_regions[k]):
+                x, y = self.point(rnd, margin=0.6)
+                w = rnd.uniform(0.1, 0.5)
+                h = rnd.uniform(0.1, 0.5)
+                yield "G36*"
+                yield "X%sY%sD02*" % (c(x), c(y))
+                yield "X%sY%sD01*" % (c(x + w), c(y))
+                yield "X%sY%sD01*" % (c(x + w), c(y + h))
+                yield "X%sY%sD01*" % (c(x), c(y + h))
+                yield "X%sY%sD01*" % (c(x), c(y))
+                yield "G37*"
+
+        yield "M02*"
+
+    def excellon_lines(self):
+        """
+        Generates the lines of the Excellon file.
+
+        :return: Lines of Excellon code without line terminators.
+        :rtype: generator
+        """
+        rnd = random.Random(self.seed + 1)
+        c = SyntheticBoard.coord
+        diameters = [0.0135, 0.0200, 0.0310, 0.0400, 0.0630, 0.1250]
+
+        yield "M48"
+        yield "INCH,TZ"
+        for n, dia in enumerate(diameters):
+            yield "T%dC%.4f" % (n + 1, dia)
+        yield "%"
+
+        holes = self.split(self.holes, len(diameters))
+        for n in range(len(diameters)):
+            if holes[n] == 0:
+                continue
+            yield "T%d" % (n + 1)
+            for _ in range(holes[n]):
+                x, y = self.point(rnd)
+                yield "X%sY%s" % (c(x), c(y))
+
+        yield "M30"
+
+    @staticmethod
+    def write(lines, filename):
+        f = open(filename, 'w')
+        try:
+            for line in lines:
+                f.write(line + "\n")
+        finally:
+            f.close()
+
+    def write_gerber(self, filename):
+        SyntheticBoard.write(self.gerber_lines(), filename)
+
+    def write_excellon(self, filename):
+        SyntheticBoard.write(self.excellon_lines(), filename)
+
+
+def add_board_arguments(parser):
+    """
+    Adds the parameters of ``SyntheticBoard`` to an
+    ``argparse.ArgumentParser``.
+    """
+    defaults = SyntheticBoard().params()
+    for name in ['pads', 'tracks', 'arcs', 'macros', 'regions',
+                 'layers', 'holes', 'seed']:
+        parser.add_argument('--' + name, type=int, default=defaults[name])
+    for name in ['width', 'height']:
+        parser.add_argument('--' + name, type=float, default=defaults[name])
+
+
+def board_from_arguments(args):
+    return SyntheticBoard(pads=args.pads, tracks=args.tracks, arcs=args.arcs,
+                          macros=args.macros, regions=args.regions,
+                          layers=args.layers, holes=args.holes,
+                          width=args.width, height=args.height, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Writes <basename>.gbr and <basename>.drl.")
+    parser.add_argument('basename')
+    add_board_arguments(parser)
+    args = parser.parse_args()
+
+    board = board_from_arguments(args)
+    board.write_gerber(args.basename + ".gbr")
+    board.write_excellon(args.basename + ".drl")
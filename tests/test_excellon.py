@@ -0,0 +1,59 @@
+from numpy import array, allclose
+
+from camlib import Excellon
+
+
+def make_excellon():
+    ex = Excellon()
+    ex.parse_lines(["M48", "INCH", "T1C0.03", "T2C0.05", "%",
+                    "T1", "X10000Y10000", "X20000Y10000",
+                    "T2", "X30000Y20000",
+                    "M30"])
+    return ex
+
+
+def test_parse():
+    ex = make_excellon()
+    assert sorted(ex.drills.keys()) == ['1', '2']
+    assert allclose(ex.drills['1'], [[1, 1], [2, 1]])
+    assert allclose(ex.drill_points(), [[1, 1], [2, 1], [3, 2]])
+    assert ex.drill_points(['3']).shape == (0, 2)
+
+
+def test_scale():
+    ex = make_excellon()
+    before = ex.drills['1']
+    ex.scale(2.0)
+    assert allclose(ex.drill_points(), [[2, 2], [4, 2], [6, 4]])
+    # A new array, the old one is left as it was.
+    assert allclose(before, [[1, 1], [2, 1]])
+
+
+def test_offset():
+    ex = make_excellon()
+    ex.offset((0.5, -1))
+    assert allclose(ex.drill_points(), [[1.5, 0], [2.5, 0], [3.5, 1]])
+
+
+def test_mirror():
+    ex = make_excellon()
+    ex.mirror("X", [0, 1.5])
+    assert allclose(ex.drill_points(), [[1, 2], [2, 2], [3, 1]])
+    ex.mirror("Y", [1, 0])
+    assert allclose(ex.drill_points(), [[1, 2], [0, 2], [-1, 1]])
+
+
+def test_convert_units():
+    ex = make_excellon()
+    tools = ex.tools
+    ex.convert_units("MM")
+    assert allclose(ex.drill_points(), array([[1, 1], [2, 1], [3, 2]]) * 25.4)
+    assert abs(ex.tools['1']['C'] - 0.03 * 25.4) < 1e-9
+    assert tools['1']['C'] == 0.03
+
+
+def test_geometry():
+    ex = make_excellon()
+    ex.create_geometry()
+    assert len(ex.solid_geometry) == 3
+    assert abs(ex.solid_geometry[2].area - 3.14159 * 0.025 ** 2) < 1e-5
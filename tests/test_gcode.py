@@ -0,0 +1,190 @@
+import os
+import tempfile
+
+from numpy import concatenate, isnan
+from shapely.geometry import Point, Polygon
+
+from camlib import CNCjob, GCodeWriter, Geometry, gcode_chunks, gcode_columns
+from camlib import pack, unpack
+
+
+def square(a, b):
+    return Polygon([(a, a), (b, a), (b, b), (a, b)]).exterior
+
+
+def test_link_in_cleared_region():
+    geo = Geometry()
+    geo.solid_geometry = [square(0, 1), square(0.05, 0.95)]
+    region = CNCjob.cleared_region(geo.solid_geometry, 0.1)
+    assert region.contains(Point(0.025, 0.025))
+    assert not region.contains(Point(0.5, 0.5))
+
+    plunges = []
+    for safe_region in [None, region]:
+        job = CNCjob(z_cut=-0.01, z_move=0.1)
+        job.generate_from_geometry(geo, tooldia=0.1, safe_region=safe_region)
+        assert not isinstance(job.gcode, (str, bytes))
+        plunges.append(job.gcode[:].count(b"G01 Z-0.01\n"))
+
+    # Cut straight from one square to the other.
+    assert plunges == [2, 1]
+
+
+def test_writer_modal():
+    w = GCodeWriter(units="MM")
+    w.feedrate(100)
+    w.move(0, 1, 2, 5)
+    w.move(0, z=5)  # Already there, left out.
+    w.move(1, z=-0.1)
+    w.feedrate(100.0)
+    w.cut_along([(1, 2), (3.14159, 2), (3.14159, -0.0001)])
+    w.move(1, 0, 0)
+    assert w.text().splitlines() == ["F100", "G00 X1Y2Z5", "G01 Z-0.1",
+                                     "X3.142", "Y0", "X0"]
+    assert w.lines == 6
+
+
+def test_columns():
+    columns = gcode_columns(b"G1 X1.5 Y-2\ny3 (X9 comment)\nG0Z1 ; X8\nG21\nG20 G00 X2\n")
+    assert columns['X'][0] == 1.5 and columns['Y'][0] == -2
+    assert columns['Y'][1] == 3 and isnan(columns['X'][1])
+    assert isnan(columns['X'][2]) and columns['Z'][2] == 1
+    assert columns['X'][4] == 2
+    assert columns['G'].tolist() == [1, -1, 0, -1, 0, -1]
+    assert columns['U'].tolist() == [-1, -1, -1, 21, 20, -1]
+
+
+def test_modal_moves():
+    job = CNCjob()
+    moves = job.gcode_parse("G00 X0 Y0 Z1\nG01 Z-1\nX1\nY1\nG02 X2 Y2 I1 J0\nX3 Y3\nG00 Z1\nX0 Y0\n")
+
+    assert moves['x1'].tolist() == [0, 1, 1, 2, 3, 0]
+    assert moves['y1'].tolist() == [0, 0, 1, 2, 3, 0]
+    assert moves['x0'].tolist() == [0, 0, 1, 1, 2, 3]
+    assert moves['g'].tolist() == [0, 1, 1, 2, 2, 0]
+    assert moves['z'].tolist() == [1, -1, -1, -1, -1, 1]
+    assert moves['i'].tolist() == [0, 0, 0, 1, 0, 0]
+    assert moves['line'].tolist() == [0, 2, 3, 4, 5, 7]
+    # Paths break at moves along Z and at changes of kind.
+    assert moves['path'].tolist() == [0, 1, 1, 1, 1, 2]
+
+
+def test_chunks_match_whole():
+    gcode = b"".join([b"G01 X%d Y%d Z%d\n" % (k, k % 7, -(k % 2)) for k in range(500)])
+    whole = CNCjob().gcode_parse(gcode)
+
+    state = {'x': 0.0, 'y': 0.0, 'z': 0.0, 'g': 0, 'line': 0,
+             'plunges': 0, 'path': -1, 'last': None,
+             'units': None, 'moved': False}
+    parts = [CNCjob.gcode_moves(gcode_columns(chunk), state)
+             for chunk, done in gcode_chunks(gcode, chunk_size=100)]
+    assert len(parts) > 10
+    assert concatenate(parts).tolist() == whole.tolist()
+
+
+def test_view_lines():
+    job = CNCjob()
+    job.gcode_parse("".join(["G01 X%g Y%g\n" % (k * 0.001, (k % 100) * 0.01) for k in range(20000)]))
+
+    # Coarse levels have fewer vertices than moves.
+    pyramid = job.gcode_pyramid()
+    assert len(pyramid) > 0
+    counts = [len(lines["C"][0]) for resolution, lines in pyramid]
+    assert counts == sorted(counts) and counts[-1] < 20000
+
+    # Zoomed in past the pyramid, only what is in view.
+    finest = pyramid[-1][0]
+    x, y = job.view_lines(0, 0, 0.5, 1, finest / 100)["C"]
+    assert 0 < len(x) < 1000
+
+
+def test_swept_area():
+    job = CNCjob()
+    job.gcode_parse("G00 X0 Y0\nG01 X1 Y0\n")
+    area = job.swept_area(0.1)
+    assert abs(area["C"].area - (0.1 + 3.14159 * 0.05 ** 2)) < 1e-3
+
+    # Kept until the paths or the tool change.
+    assert job.swept_area(0.1) is area
+    assert job.swept_area(0.2) is not area
+
+
+def test_offset_makes_new_moves():
+    job = CNCjob()
+    moves = job.gcode_parse("G00 X1 Y1\nG01 X2 Y2\n")
+    job.offset((1, 0))
+    job.scale(2.0)
+    assert job.gcode_parsed['x1'].tolist() == [4, 6]
+    # Snapshots taken before are left as they were.
+    assert moves['x1'].tolist() == [1, 2]
+
+
+def test_writer_keeps_full_circles():
+    w = GCodeWriter()
+    w.move(0, 1, 1)
+    w.move(1, 1, 1)  # Goes nowhere, left out.
+    w.move(2, 1, 1, i=0.5, j=0)
+    w.move(3, 1, 1, i=0, j=0)  # No arc, left out.
+    w.move(2, 2, 1, i=0.5, j=0)
+    assert w.text().splitlines() == ["G00 X1Y1", "G02 X1Y1I0.5J0", "X2I0.5J0"]
+
+
+def test_units_from_file():
+    fd, filename = tempfile.mkstemp(suffix=".nc")
+    os.write(fd, b"(Job in mm)\nG21\nG90\nG00 Z5\nG00 X10 Y10\nG20\nG01 X20\n")
+    os.close(fd)
+    try:
+        job = CNCjob()
+        job.parse_file(filename)
+    finally:
+        os.remove(filename)
+
+    # G20 after the first move is ignored.
+    assert job.units == "MM"
+    assert job.gcode_parsed['x1'].tolist() == [10.0, 20.0]
+
+
+def test_export_from_file():
+    fd, filename = tempfile.mkstemp(suffix=".nc")
+    os.write(fd, b"G00 X1 Y1\nG01 X2 Y2")
+    os.close(fd)
+    try:
+        job = CNCjob()
+        job.parse_file(filename)
+        assert not isinstance(job.gcode, (str, bytes))
+
+        # Over the file it is mapped from.
+        job.export_gcode(filename, postamble="M30\n")
+        with open(filename, 'rb') as f:
+            assert f.read() == b"G00 X1 Y1\nG01 X2 Y2\nM30\n"
+    finally:
+        os.remove(filename)
+
+    assert unpack(pack({"gcode": job.gcode}))["gcode"] == b"G00 X1 Y1\nG01 X2 Y2"
+
+
+def test_export_generated():
+    geo = Geometry()
+    geo.solid_geometry = [square(0, 1)]
+    job = CNCjob(z_cut=-0.01, z_move=0.1)
+    job.generate_from_geometry(geo, tooldia=0.1)
+    job.gcode_parse()
+
+    fd, filename = tempfile.mkstemp(suffix=".nc")
+    os.close(fd)
+    try:
+        job.export_gcode(filename)
+        exported = CNCjob()
+        exported.parse_file(filename)
+    finally:
+        os.remove(filename)
+
+    assert exported.gcode[:] == job.gcode[:]
+    assert exported.gcode_parsed.tolist() == job.gcode_parsed.tolist()
+
+
+def test_units_kept_when_not_given():
+    job = CNCjob()
+    job.set_units("MM")
+    job.gcode_parse("G00 X1 Y1\n")
+    assert job.units == "MM"
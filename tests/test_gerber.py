@@ -0,0 +1,246 @@
+import os
+import tempfile
+
+from shapely.geometry import LineString, Point
+
+from camlib import ApertureMacro, Gerber, file_lines, gerber_geometry
+
+
+def parse(source):
+    g = Gerber()
+    g.parse_lines(source.split('\n'))
+    return g
+
+
+def write_temp(text):
+    fd, filename = tempfile.mkstemp()
+    os.write(fd, text.encode('ascii'))
+    os.close(fd)
+    return filename
+
+
+HEADER = """%FSLAX24Y24*%
+%MOIN*%
+%ADD10C,0.01*%
+%ADD11C,0.1*%
+G75*
+"""
+
+
+def test_blocks():
+    lines = ["%FSLAX24Y24*MOIN*%G01*X0Y0D02*X100",
+             "Y200D01*%ADD10C,0.1",
+             "*%M02*"]
+    assert list(Gerber.gerber_blocks(lines)) == [
+        (1, '%FSLAX24Y24*MOIN*'), (1, 'G01'), (1, 'X0Y0D02'),
+        (2, 'X100Y200D01'), (3, '%ADD10C,0.1*'), (3, 'M02')]
+
+
+def test_tracks_and_flashes():
+    g = parse(HEADER + """D11*
+X0Y0D03*
+D10*
+G01X0Y0D02*
+X20000Y0D01*
+M02*""")
+    xmin, ymin, xmax, ymax = g.solid_geometry.bounds
+    assert abs(xmin + 0.05) < 1e-4
+    assert abs(xmax - 2.005) < 1e-4
+    assert abs(ymax - 0.05) < 1e-4
+    assert g.units == 'IN'
+    assert sorted(g.apertures.keys()) == ['10', '11']
+
+
+def test_region():
+    g = parse(HEADER + """G36*
+X0Y0D02*
+G01X10000Y0D01*
+X10000Y10000D01*
+X0Y10000D01*
+X0Y0D01*
+G37*
+M02*""")
+    assert abs(g.solid_geometry.area - 1.0) < 1e-9
+
+
+def test_file_lines():
+    filename = write_temp("one\ntwo\n\nthree*four*five")
+    try:
+        assert list(file_lines(filename, chunk_size=3)) == ["one", "two", "", "three*four*five"]
+        pieces = list(file_lines(filename, chunk_size=3, split_long='*'))
+        assert "".join(pieces[3:]) == "three*four*five"
+        assert all([piece.endswith('*') for piece in pieces[3:-1]])
+    finally:
+        os.remove(filename)
+
+
+def test_parse_file_without_line_breaks():
+    source = HEADER + "D10*G01X0Y0D02*X20000Y0D01*M02*"
+    filename = write_temp(source.replace("\n", ""))
+    try:
+        g = Gerber()
+        g.parse_file(filename)
+    finally:
+        os.remove(filename)
+    assert abs(g.solid_geometry.bounds[2] - 2.005) < 1e-4
+
+
+def test_flash_instances():
+    template = Gerber.aperture_geometry({'type': 'R', 'width': 0.2, 'height': 0.1})
+    flashes = Gerber.flash_instances(template, [(1, 1), (2, 3)])
+    assert [flash.bounds for flash in flashes] == [(0.9, 0.95, 1.1, 1.05), (1.9, 2.95, 2.1, 3.05)]
+
+    # Same shapes as moving the template one by one.
+    template = Gerber.aperture_geometry({'type': 'O', 'width': 0.2, 'height': 0.1})
+    flash = Gerber.flash_instances(template, [(1, 2)])[0]
+    moved = Gerber.create_flash_geometry(Point(1, 2), {'type': 'O', 'width': 0.2, 'height': 0.1})
+    assert flash.symmetric_difference(moved).area < 1e-9
+
+
+def test_macro_expressions():
+    compute = ApertureMacro.compile_expression("$1x2+($2-1)/4")
+    assert compute({'1': 1.5, '2': 3.0}) == 3.5
+    assert compute({}) == -0.25  # Undefined variables are 0.
+
+
+def test_macro_geometry():
+    am = ApertureMacro(name="BOX")
+    am.append("0 Centered box*$3=$1x$2*21,1,$1,$2,0,0,0*1,0,$3,0,0*")
+    box = am.make_geometry(["0.2", "0.1"])
+    assert abs(box.area - (0.02 - 3.14159 * 0.01 ** 2)) < 1e-4
+
+    # Made once for the same modifiers.
+    assert am.make_geometry(["0.2", "0.1"]) is box
+    assert abs(am.make_geometry(["0.4", "0.1"]).area - (0.04 - 3.14159 * 0.02 ** 2)) < 1e-4
+
+
+def test_clear_polarity():
+    gerber = parse(HEADER + "%ADD12R,1.0X1.0*%\n%ADD13C,0.4*%\n"
+                   "D12*\nX0Y0D03*\n"
+                   "%LPC*%\nD13*\nX0Y0D03*\n"
+                   "%LPD*%\nD11*\nX0Y0D03*\n"
+                   "M02*\n")
+    geo = gerber.solid_geometry
+    assert abs(geo.area - (1.0 - Point(0, 0).buffer(0.2).area + Point(0, 0).buffer(0.05).area)) < 1e-3
+    assert geo.contains(Point(0, 0))
+    assert not geo.contains(Point(0.12, 0))
+
+
+def test_compose_layers():
+    a = Point(0, 0).buffer(1.0)
+    b = Point(1, 0).buffer(1.0)
+    far = Point(10, 10).buffer(1.0)
+    hole = Point(0.5, 0).buffer(0.2)
+
+    gerber = Gerber()
+    geo = gerber.compose_layers([('D', a.union(far)), ('C', hole), ('D', b)])
+    assert geo.is_valid
+    assert len(geo.geoms) == 2
+    assert geo.symmetric_difference(a.difference(hole).union(b).union(far)).area < 1e-9
+
+    # Overlapping copies of the same level.
+    assert gerber.compose_layers([('D', a), ('D', a), ('D', b)]).symmetric_difference(a.union(b)).area < 1e-9
+    assert gerber.compose_layers([('D', a), ('C', a)]).is_empty
+
+
+def test_gerber_geometry():
+    pad = Point(0, 0).buffer(0.1)
+    geo = gerber_geometry([('track', 0.2, [(0, 0), (1, 0)]),
+                           ('region', [(2, 0), (3, 0), (3, 1), (2, 1)]),
+                           ('flash', pad, [(1, 0), (5, 5)])])
+    assert abs(geo.area - (LineString([(0, 0), (1, 0)]).buffer(0.1).area + 1.0 + pad.area)) < 1e-3
+
+
+def test_union_all():
+    from camlib import union_all
+
+    pads = [Point(i * 0.15, j * 0.15).buffer(0.1) for i in range(10) for j in range(10)]
+    expected = pads[0]
+    for pad in pads[1:]:
+        expected = expected.union(pad)
+
+    union = union_all(pads + [None, Point(0, 0).buffer(0)])
+    assert union.geom_type == "Polygon"
+    assert union.symmetric_difference(expected).area < 1e-9
+    assert union_all([]).is_empty
+
+
+def test_synthetic_board():
+    from synthetic_board import SyntheticBoard
+
+    board = SyntheticBoard(pads=200, tracks=50, arcs=10, macros=20, regions=3, layers=2, holes=50)
+    lines = list(board.gerber_lines())
+    assert lines == list(SyntheticBoard(**board.params()).gerber_lines())
+
+    gerber = parse("\n".join(lines))
+    assert not gerber.solid_geometry.is_empty
+    assert len(gerber.apertures) > 0
+
+
+def test_geometry_cache():
+    from camlib import GeometryCache
+
+    filename = write_temp(HEADER + "D10*\nX0Y0D02*\nX10000Y0D01*\nD11*\nX0Y10000D03*\nM02*\n")
+    path = tempfile.mkdtemp()
+    try:
+        cache = GeometryCache(path)
+        key = cache.key(filename, Gerber())
+        assert not cache.load(key, Gerber())
+
+        gerber = Gerber()
+        gerber.parse_file(filename)
+        cache.store(key, gerber)
+
+        cached = Gerber()
+        assert cache.key(filename, cached) == key
+        assert cache.load(key, cached)
+        assert cached.solid_geometry.symmetric_difference(gerber.solid_geometry).area < 1e-12
+        assert cached.apertures.keys() == gerber.apertures.keys()
+
+        # Different settings, different entry.
+        other = Gerber()
+        other.arc_tolerance /= 2
+        assert cache.key(filename, other) != key
+    finally:
+        os.remove(filename)
+        for name in os.listdir(path):
+            os.remove(os.path.join(path, name))
+        os.rmdir(path)
+
+
+def test_aperture_select_with_coordinates():
+    # The track to X2 is drawn with D10, the flash with D11.
+    g = parse(HEADER + """D10*
+G01X0Y0D02*
+X10000Y0D01*
+X20000Y0D11*
+X0Y10000D03*
+M02*""")
+    xmin, ymin, xmax, ymax = g.solid_geometry.bounds
+    assert abs(xmax - 2.005) < 1e-4
+    assert abs(ymax - 1.05) < 1e-4
+
+
+def test_ij_ignored_in_linear_mode():
+    g = parse(HEADER + """D11*
+G01X0Y0D02*
+X20000Y10000I5000J0D01*
+M02*""")
+    xmin, ymin, xmax, ymax = g.solid_geometry.bounds
+    assert abs(xmax - 2.05) < 1e-4
+    assert abs(ymax - 1.05) < 1e-4
+    assert abs(g.solid_geometry.area - (5 ** 0.5 * 0.1 + 3.14159 * 0.05 ** 2)) < 1e-3
+
+
+def test_parallel_geometry_matches_serial():
+    from synthetic_board import SyntheticBoard
+
+    lines = list(SyntheticBoard(pads=2500, tracks=300, arcs=20, regions=5, layers=2).gerber_lines())
+
+    serial = Gerber()
+    serial.parse_lines(lines, processes=1)
+    parallel = Gerber()
+    parallel.parse_lines(lines, processes=2)
+
+    assert abs(serial.solid_geometry.area - parallel.solid_geometry.area) < 1e-9
+    assert serial.solid_geometry.symmetric_difference(parallel.solid_geometry).area < 1e-6
@@ -0,0 +1,107 @@
+import random
+from math import hypot, pi
+
+from numpy import array, arctan2
+from shapely.geometry import LineString, Point
+
+from camlib import arc, fit_arcs, optimize_path, path_length
+
+
+def rebuild(path, moves, tolerance):
+    """
+    The path as drawn from the moves of ``fit_arcs()``.
+    """
+    points = [tuple(path[0])]
+    for k, center, direction in moves:
+        if center is None:
+            points.append(tuple(path[k]))
+            continue
+        x0, y0 = points[-1]
+        x1, y1 = path[k]
+        cx, cy = center
+        radius = Point(center).distance(Point(x0, y0))
+        points += [tuple(p) for p in arc(center, radius, arctan2(y0 - cy, x0 - cx),
+                                         arctan2(y1 - cy, x1 - cx), direction, tolerance / 10)[1:]]
+    return points
+
+
+def test_arc_tolerance():
+    for radius, tolerance in [(1.0, 0.001), (10.0, 0.001), (0.01, 0.001)]:
+        points = arc((1.0, 2.0), radius, 0, pi, "ccw", tolerance)
+        assert abs(points[0][0] - (1.0 + radius)) < 1e-9
+        for (x1, y1), (x2, y2) in zip(points[:-1], points[1:]):
+            # Distance from the center to the middle of the chord.
+            middle = hypot((x1 + x2) / 2 - 1.0, (y1 + y2) / 2 - 2.0)
+            assert radius - middle <= tolerance + 1e-12
+
+    # Larger arcs need more points for the same tolerance.
+    assert len(arc((0, 0), 10.0, 0, pi, "ccw", 0.001)) > len(arc((0, 0), 1.0, 0, pi, "ccw", 0.001))
+
+
+def test_optimize_path_not_longer():
+    rnd = random.Random(1)
+    for n in [0, 1, 2, 3, 10, 200]:
+        points = array([[rnd.uniform(0, 10), rnd.uniform(0, 5)] for k in range(n)]).reshape(-1, 2)
+        for end in [None, (0, 0)]:
+            order = optimize_path(points, start=(0, 0), end=end, time_budget=0.2)
+            assert sorted(order) == list(range(n))
+            assert path_length(points[order], end=end) <= path_length(points, end=end) + 1e-9
+
+
+def test_sequence_paths():
+    from camlib import sequence_paths
+
+    square = [(5, 5), (6, 5), (6, 6), (5, 6), (5, 5)]
+    line = [(10, 0), (2, 0)]
+    result = sequence_paths([(square, True), (line, False)], start=(0, 0))
+
+    # The line first, backwards, then the square entered at its
+    # nearest corner and kept closed, in the same direction.
+    assert [tuple(p) for p in result[0]] == [(2, 0), (10, 0)]
+    assert [tuple(p) for p in result[1]] == [(6, 5), (6, 6), (5, 6), (5, 5), (6, 5)]
+
+
+def test_fit_arcs_round_trip():
+    tolerance = 0.001
+    path = [(-2.0, 0.0), (0.0, 0.0)]
+    path += [tuple(p) for p in arc((0, 1), 1.0, -pi / 2, pi / 2, "ccw", tolerance / 10)[1:]]
+    path += [(-1.0, 2.0), (-1.0, 3.0)]
+    path += [tuple(p) for p in arc((-2, 3), 1.0, 0, pi, "cw", tolerance / 10)[1:]]
+
+    moves = fit_arcs(path, tolerance)
+
+    # Fewer moves, ending at the last point.
+    assert len(moves) < len(path) / 4
+    assert moves[-1][0] == len(path) - 1
+    assert len([m for m in moves if m[1] is not None]) == 2
+    assert [m[2] for m in moves if m[1] is not None] == ["ccw", "cw"]
+
+    # Every point is within tolerance of the new path and back.
+    drawn = LineString(rebuild(path, moves, tolerance))
+    original = LineString(path)
+    assert max([drawn.distance(Point(p)) for p in path]) <= tolerance
+    assert max([original.distance(Point(p)) for p in drawn.coords]) <= tolerance
+
+
+def test_fit_arcs_straight_path():
+    path = [(0, 0), (1, 0), (2, 0), (3, 0), (3, 1)]
+    moves = fit_arcs(path, 0.001)
+    assert [m[0] for m in moves] == [1, 2, 3, 4]
+    assert all([m[1] is None for m in moves])
+
+
+def test_rings_of():
+    from shapely.geometry import Polygon
+    from camlib import rings_bounds, rings_of
+
+    def area(ring):
+        x, y = ring[:, 0], ring[:, 1]
+        return 0.5 * (x[:-1] * y[1:] - x[1:] * y[:-1]).sum()
+
+    # Clockwise exterior, counter-clockwise hole.
+    square = Polygon([(0, 0), (0, 4), (4, 4), (4, 0)], [[(1, 1), (2, 1), (2, 2), (1, 2)]])
+    rings = rings_of([square, LineString([(5, 5), (6, 6)]), None])
+    assert len(rings) == 3
+    assert area(rings[0]) > 0 and area(rings[1]) < 0
+    assert rings[2].tolist() == [[5, 5], [6, 6]]
+    assert rings_bounds(rings).tolist() == [[0, 0, 4, 4], [1, 1, 2, 2], [5, 5, 6, 6]]
@@ -0,0 +1,248 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+
+import pytest
+from numpy import allclose
+from shapely.geometry import LineString, Point
+
+from camlib import CNCjob, Excellon, dict2obj, pack, to_dict, unpack
+from FlatCAMProject import ProjectFile
+
+
+class Drills(Excellon):
+    """
+    Excellon with the attributes FlatCAMObj adds for projects.
+    """
+    def __init__(self, name="drills"):
+        Excellon.__init__(self)
+        self.options = {"name": name}
+        self.kind = "excellon"
+        self.ser_attrs += ['options', 'kind']
+
+
+def make_drills(name, x, extra=0):
+    """
+    Drills at (x, 1) and (x, 2), in 1/10000 inch, followed by
+    ``extra`` more to make the object larger.
+    """
+    ex = Drills(name)
+    ex.parse_lines(["M48", "INCH", "T1C0.03", "%", "T1",
+                    "X%dY10000" % x, "X%dY20000" % x] +
+                   ["X%dY%d" % (x + k * 7, 30000 + k * 13) for k in range(extra)])
+    return ex
+
+
+def load(filename):
+    project = ProjectFile(filename)
+    objs = []
+    for entry in project.objects:
+        obj = Drills()
+        project.init_object(obj, entry)
+        objs.append(obj)
+    return project, objs
+
+
+@pytest.fixture
+def workdir():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def test_geometry_round_trip():
+    geo = [Point(1.0 / 3, 2.0 / 7).buffer(0.1), LineString([(0.1, 0.2), (1.0 / 3, 0.5)])]
+    text = json.dumps({"solid_geometry": geo}, default=to_dict)
+    assert "ShplyWKB" in text
+
+    loaded = json.loads(text, object_hook=dict2obj)["solid_geometry"]
+    assert [g.wkb for g in loaded] == [g.wkb for g in geo]
+
+
+def test_wkt_still_read():
+    loaded = json.loads('{"g": {"__class__": "Shply", "__inst__": "POINT (1 2)"}}', object_hook=dict2obj)
+    assert loaded["g"].equals(Point(1, 2))
+
+
+def test_save_and_load(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    a = make_drills("a", 10000)
+    b = make_drills("b", 20000)
+
+    project = ProjectFile()
+    project.save(filename, project.snapshot([a, b]), {"units": "IN"}, 8)
+    project.close()
+
+    assert ProjectFile.is_container(filename)
+    loaded, objs = load(filename)
+    assert loaded.options == {"units": "IN"}
+    assert [obj.options["name"] for obj in objs] == ["a", "b"]
+
+    # Drills are only read when used.
+    assert "drills" not in objs[0].__dict__
+    assert allclose(objs[1].drill_points(), [[2, 1], [2, 2]])
+    assert allclose(objs[0].drill_points(), [[1, 1], [1, 2]])
+    loaded.close()
+
+
+def test_bounds_and_view(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    a = make_drills("a", 10000)
+
+    project = ProjectFile()
+    project.save(filename, project.snapshot([a]), {}, 8, view=[0, 0, 4, 3])
+    project.close()
+
+    loaded, objs = load(filename)
+    assert loaded.view == [0, 0, 4, 3]
+
+    # Known without loading the drills, until the object changes.
+    assert allclose(loaded.saved_bounds(objs[0]), [0.985, 0.985, 1.015, 2.015])
+    assert "drills" not in objs[0].__dict__
+    objs[0].offset((1, 0))
+    assert loaded.saved_bounds(objs[0]) is None
+    loaded.close()
+
+
+def test_append_only_changed(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    objs = [make_drills(name, 10000 * (k + 1), extra=500) for k, name in enumerate("abcdef")]
+
+    project = ProjectFile()
+    project.save(filename, project.snapshot(objs), {}, 8)
+    size = os.path.getsize(filename)
+    blobs = [entry['blob'] for entry in project.objects]
+
+    objs[2].offset((1, 0))
+    project.save(filename, project.snapshot(objs), {}, 8)
+
+    # Appended, unchanged blobs stay where they were.
+    assert os.path.getsize(filename) > size
+    assert [entry['blob'] for entry in project.objects][:2] == blobs[:2]
+    assert project.objects[2]['blob'][0] >= size
+    project.close()
+
+    loaded, loaded_objs = load(filename)
+    assert allclose(loaded_objs[2].drill_points()[:2], [[4, 1], [4, 2]])
+    assert allclose(loaded_objs[5].drill_points()[:2], [[6, 1], [6, 2]])
+
+    # Saving again objects loaded lazily copies nothing.
+    loaded_objs[0].offset((0, 1))
+    loaded.save(filename, loaded.snapshot(loaded_objs), {}, 8)
+    assert "drills" not in loaded_objs[1].__dict__
+    assert allclose(loaded_objs[1].drill_points()[:2], [[2, 1], [2, 2]])
+    loaded.close()
+
+
+def test_compaction(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    objs = [make_drills(name, 10000 * (k + 1)) for k, name in enumerate("abc")]
+
+    project = ProjectFile()
+    project.save(filename, project.snapshot(objs), {}, 8)
+
+    # Changing everything a few times leaves mostly garbage,
+    # and the file is written anew.
+    sizes = []
+    for k in range(4):
+        for obj in objs:
+            obj.offset((1, 0))
+        project.save(filename, project.snapshot(objs), {}, 8)
+        sizes.append(os.path.getsize(filename))
+    assert min(sizes[1:]) < max(sizes)
+    assert not os.path.exists(filename + ".tmp")
+    project.close()
+
+    loaded, loaded_objs = load(filename)
+    assert allclose(loaded_objs[2].drill_points(), [[7, 1], [7, 2]])
+    loaded.close()
+
+
+def test_save_to_new_file(workdir):
+    first = os.path.join(workdir, "first.fcp")
+    second = os.path.join(workdir, "second.fcp")
+
+    project = ProjectFile()
+    project.save(first, project.snapshot([make_drills("a", 10000)]), {}, 8)
+    project.close()
+
+    loaded, objs = load(first)
+    loaded.save(second, loaded.snapshot(objs), {}, 8)
+    loaded.close()
+
+    # Blobs not loaded are copied over.
+    loaded, objs = load(second)
+    assert allclose(objs[0].drill_points(), [[1, 1], [1, 2]])
+    loaded.close()
+
+
+def test_save_copy(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    copy = os.path.join(workdir, "copy.fcp")
+
+    a = make_drills("a", 10000)
+    project = ProjectFile()
+    project.save(filename, project.snapshot([a]), {}, 8)
+    project.save(copy, project.snapshot([a, make_drills("b", 20000)]), {}, 8, copy=True)
+    assert project.filename == filename
+    assert len(load(copy)[1]) == 2
+
+    # Still saves to the original file.
+    project.save(filename, project.snapshot([a]), {}, 8)
+    project.close()
+    assert len(load(filename)[1]) == 1
+
+
+def test_save_snapshot(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    a = make_drills("a", 10000)
+    project = ProjectFile()
+    items = project.snapshot([a])
+
+    # Later changes to the object are not written.
+    a.drills['1'] = a.drills['1'][:1]
+    a.options["name"] = "changed"
+
+    progress = []
+    project.save(filename, items, {}, 8, progress=progress.append)
+    assert progress[-1] == 1.0
+    assert not os.path.exists(filename + ".tmp")
+    project.close()
+
+    loaded, objs = load(filename)
+    assert objs[0].options["name"] == "a"
+    assert len(objs[0].drills['1']) == 2
+    loaded.close()
+
+
+def test_pack_round_trip():
+    job = CNCjob()
+    job.gcode_parse("G00 X1 Y1\nG01 X2 Y2\n")
+    d = {"moves": job.gcode_parsed, "tuple": (1, "a"), "keys": {1: None},
+         "text": u"G01 X1\n" * 100, "drills": make_drills("a", 10000).drills,
+         "geometry": [Point(1, 2).buffer(0.5)]}
+    result = unpack(pack(d))
+    assert result["moves"].dtype == CNCjob.segment_dtype
+    assert result["moves"].tolist() == job.gcode_parsed.tolist()
+    assert result["tuple"] == (1, "a")
+    assert result["keys"] == {1: None}
+    assert result["text"] == d["text"]
+    assert allclose(result["drills"]["1"], [[1, 1], [1, 2]])
+    assert result["geometry"][0].wkb == d["geometry"][0].wkb
+
+
+def test_unpack_rejects_pickle():
+    with pytest.raises(ValueError):
+        unpack(pickle.dumps({"a": 1}))
+
+
+def test_blob_format(workdir):
+    filename = os.path.join(workdir, "project.fcp")
+    project = ProjectFile()
+    project.save(filename, project.snapshot([make_drills("a", 10000)]), {}, 8)
+    data = zlib.decompress(project.raw_blob(project.objects[0]))
+    assert sorted(unpack(data).keys()) == ['drills', 'tools']
+    project.close()